@@ -7,14 +7,23 @@ Tích hợp với RAG MongoDB + Gemini Flash 2.0
 
 import os
 import json
+import io
+import asyncio
 import csv
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from enum import Enum
 from pydantic import BaseModel, Field
-from fastapi import HTTPException, UploadFile, File
+from fastapi import HTTPException, Request, UploadFile, File
+from fastapi.responses import StreamingResponse
 import google.generativeai as genai
-from modules.mongodb_service import MongoDBManager
+from modules.mongodb_service import MongoDBManager, get_mongo_manager
+from modules.embedding import get_embedding_batcher
+from modules.llm_service import generate_content_async, stream_content_async
+from modules.answer_cache import answer_key, document_revisions, get_answer_cache
+from modules.context_packer import pack_context, select_fields
+from modules.sse_service import single_piece, sse_response, stream_answer_events
+from modules.import_service import ImportItem, create_import_job, get_import_job, run_import, stream_import
 from dotenv import load_dotenv
 
 # Load environment variables from root directory
@@ -25,13 +34,29 @@ load_dotenv(root_env_path)
 mongo_manager: Optional[MongoDBManager] = None
 llm_model = None
 
+# Bump when an analysis prompt changes so cached analyses of the old prompt are not served
+BUG_ANALYSIS_PROMPT_VERSION = "3"
+
+# Bugs shown to the model per analysis, and the metadata each analysis needs; everything
+# else (import bookkeeping, ids, vectors) stays out of the prompt
+MAX_ANALYZED_BUGS = 10
+ANALYSIS_FIELDS = {
+    "summary": ("bug_name", "bug_type", "severity", "status", "component", "project", "labels"),
+    "trend": ("bug_name", "bug_type", "severity", "status", "component", "file_path", "created_date", "updated_date"),
+    "priority": ("bug_name", "bug_type", "severity", "status", "component", "labels", "effort", "debt"),
+    "search_answer": ("bug_name", "bug_type", "severity", "component"),
+}
+DEFAULT_ANALYSIS_FIELDS = ("bug_name", "bug_type", "severity", "status", "component")
+
+NO_BUGS_FOUND_ANSWER = "Không tìm thấy bugs phù hợp với tiêu chí tìm kiếm."
+
 def init_resources():
     global mongo_manager, llm_model
     if llm_model is None:
         genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
         llm_model = genai.GenerativeModel('gemini-2.0-flash-exp')
     if mongo_manager is None:
-        mongo_manager = MongoDBManager()
+        mongo_manager = get_mongo_manager()
 
 # Bug Types Enum
 class BugType(str, Enum):
@@ -88,6 +113,7 @@ class BugImportRequest(BaseModel):
     project_name: Optional[str] = Field(None, description="Tên project")
     import_source: Optional[str] = Field("manual", description="Nguồn import")
     batch_name: Optional[str] = Field(None, description="Tên batch import")
+    background: bool = Field(False, description="Chạy import nền và trả về job_id để theo dõi tiến độ")
 
 class BugSearchRequest(BaseModel):
     query: str = Field(..., description="Câu hỏi tìm kiếm")
@@ -105,14 +131,9 @@ class BugAnalysisRequest(BaseModel):
 
 # Helper Functions
 async def get_gemini_embedding(text: str) -> List[float]:
-    """Get embedding from Gemini Flash 2.0"""
+    """Get embedding from Gemini Flash 2.0, batched with concurrent requests and cached"""
     try:
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
+        return await get_embedding_batcher().embed(text, task_type="retrieval_document")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating embedding: {str(e)}")
 
@@ -175,6 +196,81 @@ def create_bug_metadata(bug: BugItem, import_info: Dict) -> Dict:
     # Remove None values
     return {k: v for k, v in metadata.items() if v is not None}
 
+def create_import_item(bug: BugItem, import_info: Dict) -> ImportItem:
+    """Content, metadata and reported fields of one bug to import"""
+    return ImportItem(
+        content=format_bug_content(bug),
+        metadata=create_bug_metadata(bug, import_info),
+        summary={
+            "bug_name": bug.name,
+            "type": bug.type.value,
+            "severity": bug.severity.value if bug.severity else None
+        }
+    )
+
+def parse_csv_bug(row: Dict) -> BugItem:
+    """Build a BugItem from one CSV row; raises on invalid values"""
+    return BugItem(
+        name=row.get('name', ''),
+        description=row.get('description', ''),
+        type=BugType(row.get('type', 'BUG')),
+        severity=BugSeverity(row.get('severity', 'MAJOR')) if row.get('severity') else BugSeverity.MAJOR,
+        status=BugStatus(row.get('status', 'OPEN')) if row.get('status') else BugStatus.OPEN,
+        labels=row.get('labels', '').split(',') if row.get('labels') else [],
+        file_path=row.get('file_path'),
+        line_number=int(row.get('line_number', 0)) if row.get('line_number') else None,
+        component=row.get('component'),
+        project=row.get('project'),
+        assignee=row.get('assignee'),
+        reporter=row.get('reporter'),
+        created_date=row.get('created_date'),
+        updated_date=row.get('updated_date'),
+        resolution=row.get('resolution'),
+        effort=row.get('effort'),
+        debt=row.get('debt'),
+        tags=row.get('tags', '').split(',') if row.get('tags') else []
+    )
+
+def open_csv_upload(file: UploadFile) -> csv.DictReader:
+    """Row reader over the spooled upload, decoding it incrementally"""
+    file.file.seek(0)
+    return csv.DictReader(io.TextIOWrapper(file.file, encoding='utf-8', newline=''))
+
+def read_csv_rows(reader: csv.DictReader, limit: int) -> List[Tuple[int, Dict]]:
+    """Next limit rows with the file line each one ends on"""
+    rows = []
+    for row in reader:
+        rows.append((reader.line_num, row))
+        if len(rows) >= limit:
+            break
+    return rows
+
+async def iter_csv_import_chunks(
+    file: UploadFile, import_info: Dict, chunk_size: int
+) -> AsyncIterator[Tuple[int, List[ImportItem], List[Dict]]]:
+    """Parse the upload chunk by chunk into import items and rejected rows"""
+    reader = open_csv_upload(file)
+    start = 0
+    row_number = 0
+    while True:
+        rows = await asyncio.to_thread(read_csv_rows, reader, chunk_size)
+        if not rows:
+            return
+        items, rejected = [], []
+        for line, row in rows:
+            row_number += 1
+            position = {"row": row_number, "line": line}
+            try:
+                item = create_import_item(parse_csv_bug(row), import_info)
+                item.summary.update(position)
+                # Same index space as rejected rows
+                item.index = row_number - 1
+                items.append(item)
+            except Exception as e:
+                rejected.append({"index": row_number - 1, **position, "bug_name": row.get('name'), "error": str(e)})
+        yield start, items, rejected
+        start += len(items)
+
 def convert_mongodb_to_json(data):
     """Convert MongoDB documents to JSON-serializable format"""
     from bson import ObjectId
@@ -194,88 +290,207 @@ def convert_mongodb_to_json(data):
     else:
         return data
 
+def pack_bugs_for_prompt(bugs_data: List[Dict], analysis_type: str, limit: int = MAX_ANALYZED_BUGS) -> str:
+    """Compact JSON of the bugs with only the fields analysis_type needs, within the context token budget"""
+    fields = ANALYSIS_FIELDS.get(analysis_type, DEFAULT_ANALYSIS_FIELDS)
+    bugs = [
+        {
+            **select_fields(convert_mongodb_to_json(bug.get("metadata", {})), fields),
+            "description": bug.get("content", "")
+        }
+        for bug in bugs_data[:limit]
+    ]
+    return json.dumps(pack_context(bugs, text_field="description"), ensure_ascii=False, separators=(",", ":"))
+
+def build_bug_analysis_prompt(bugs_data: List[Dict], analysis_type: str) -> str:
+    """Prompt asking Gemini for one analysis_type of the bugs"""
+    # Unknown analysis types get a shorter generic prompt over fewer bugs
+    bugs_json = pack_bugs_for_prompt(bugs_data, analysis_type, MAX_ANALYZED_BUGS if analysis_type in ANALYSIS_FIELDS else 5)
+    
+    if analysis_type == "summary":
+        prompt = f"""
+                Phân tích tổng quan về {len(bugs_data)} bugs sau đây:
+
+                {bugs_json}
+
+                Hãy cung cấp:
+                1. Tổng quan về số lượng bugs theo loại
+                2. Phân tích mức độ nghiêm trọng
+                3. Các vấn đề phổ biến nhất
+                4. Đề xuất ưu tiên xử lý
+                5. Xu hướng và pattern
+
+                Trả lời bằng tiếng Việt, chi tiết và có cấu trúc.
+                """
+    elif analysis_type == "trend":
+        prompt = f"""
+                Phân tích xu hướng bugs từ dữ liệu sau:
+
+                {bugs_json}
+
+                Hãy phân tích:
+                1. Xu hướng theo thời gian
+                2. Pattern theo component/file
+                3. Phân bố theo loại bug
+                4. Dự đoán và khuyến nghị
+
+                Trả lời bằng tiếng Việt.
+                """
+    elif analysis_type == "priority":
+        prompt = f"""
+                Đề xuất ưu tiên xử lý bugs dựa trên dữ liệu:
+
+                {bugs_json}
+
+                Hãy đưa ra:
+                1. Danh sách bugs ưu tiên cao
+                2. Lý do ưu tiên
+                3. Thứ tự xử lý đề xuất
+                4. Ước tính effort
+
+                Trả lời bằng tiếng Việt.
+                """
+    elif analysis_type == "search_answer":
+        prompt = f"""
+                Dựa trên kết quả tìm kiếm, hãy tóm tắt và phân tích các bugs sau:
+
+                {bugs_json}
+
+                Hãy cung cấp:
+                1. Tóm tắt các bugs tìm thấy
+                2. Mức độ nghiêm trọng và ưu tiên
+                3. Khuyến nghị xử lý
+                4. Mối liên hệ giữa các bugs
+
+                Trả lời bằng tiếng Việt, ngắn gọn và súc tích.
+                """
+    else:
+        prompt = f"Phân tích dữ liệu bugs: {bugs_json}"
+    
+    return prompt
+
+def analysis_cache_key(bugs_data: List[Dict], analysis_type: str) -> str:
+    """Analysis cache key; any analyzed bug being updated or deleted changes it"""
+    return answer_key(
+        "",
+        document_revisions(bugs_data, mongo_manager.get_document_revisions),
+        analysis_type,
+        BUG_ANALYSIS_PROMPT_VERSION
+    )
+
 async def generate_bug_analysis(bugs_data: List[Dict], analysis_type: str) -> str:
-    """Generate analysis using Gemini Flash 2.0"""
+    """Generate analysis using Gemini Flash 2.0, reusing the cached analysis of the same bugs"""
     try:
-        # Convert MongoDB data to JSON-serializable format
-        serializable_data = convert_mongodb_to_json(bugs_data[:10])
-        
-        if analysis_type == "summary":
-            prompt = f"""
-                    Phân tích tổng quan về {len(bugs_data)} bugs sau đây:
-
-                    {json.dumps(serializable_data, indent=2, ensure_ascii=False)}
-
-                    Hãy cung cấp:
-                    1. Tổng quan về số lượng bugs theo loại
-                    2. Phân tích mức độ nghiêm trọng
-                    3. Các vấn đề phổ biến nhất
-                    4. Đề xuất ưu tiên xử lý
-                    5. Xu hướng và pattern
-
-                    Trả lời bằng tiếng Việt, chi tiết và có cấu trúc.
-                    """
-        elif analysis_type == "trend":
-            prompt = f"""
-                    Phân tích xu hướng bugs từ dữ liệu sau:
-
-                    {json.dumps(serializable_data, indent=2, ensure_ascii=False)}
-
-                    Hãy phân tích:
-                    1. Xu hướng theo thời gian
-                    2. Pattern theo component/file
-                    3. Phân bố theo loại bug
-                    4. Dự đoán và khuyến nghị
-
-                    Trả lời bằng tiếng Việt.
-                    """
-        elif analysis_type == "priority":
-            prompt = f"""
-                    Đề xuất ưu tiên xử lý bugs dựa trên dữ liệu:
-
-                    {json.dumps(serializable_data, indent=2, ensure_ascii=False)}
-
-                    Hãy đưa ra:
-                    1. Danh sách bugs ưu tiên cao
-                    2. Lý do ưu tiên
-                    3. Thứ tự xử lý đề xuất
-                    4. Ước tính effort
-
-                    Trả lời bằng tiếng Việt.
-                    """
-        elif analysis_type == "search_answer":
-            # For search results, create a summary of found bugs
-            bug_summaries = []
-            for bug in serializable_data:
-                metadata = bug.get("metadata", {})
-                bug_summaries.append({
-                    "name": metadata.get("bug_name"),
-                    "type": metadata.get("bug_type"),
-                    "severity": metadata.get("severity"),
-                    "component": metadata.get("component"),
-                    "description": bug.get("content", "")[:200]
-                })
-            
-            prompt = f"""
-                    Dựa trên kết quả tìm kiếm, hãy tóm tắt và phân tích các bugs sau:
+        analysis, _ = await get_answer_cache().get_or_generate(
+            analysis_cache_key(bugs_data, analysis_type), lambda: _generate_bug_analysis(bugs_data, analysis_type)
+        )
+        return analysis
+    except Exception as e:
+        return f"Không thể tạo phân tích: {str(e)}"
 
-                    {json.dumps(bug_summaries, indent=2, ensure_ascii=False)}
+async def _generate_bug_analysis(bugs_data: List[Dict], analysis_type: str) -> str:
+    # Errors propagate so they are not cached
+    response = await generate_content_async(llm_model, build_bug_analysis_prompt(bugs_data, analysis_type))
+    return response.text
+
+def stream_bug_analysis(bugs_data: List[Dict], analysis_type: str) -> AsyncIterator[str]:
+    """Stream the analysis as Gemini generates it; a cached analysis comes back as a single piece"""
+    return get_answer_cache().stream(
+        analysis_cache_key(bugs_data, analysis_type),
+        lambda: stream_content_async(llm_model, build_bug_analysis_prompt(bugs_data, analysis_type))
+    )
+
+async def search_bug_documents(request: BugSearchRequest) -> List[Dict]:
+    """Bugs matching the query and filters, best first"""
+    # Generate query embedding
+    query_embedding = await get_gemini_embedding(request.query)
+    
+    # Filters are applied inside the vector index, so limit is honoured exactly
+    filters = {
+        "bug_type": [t.value for t in request.bug_types] if request.bug_types else None,
+        "severity": [s.value for s in request.severities] if request.severities else None,
+        "labels": request.labels,
+        "project": request.project
+    }
+    return mongo_manager.search_by_embedding(
+        query_embedding=query_embedding,
+        top_k=request.limit,
+        filters=filters,
+        query=request.query
+    )
+
+def applied_filters(request: BugSearchRequest) -> Dict:
+    """Filters of a search request, echoed in its response"""
+    return {
+        "bug_types": [t.value for t in request.bug_types] if request.bug_types else None,
+        "severities": [s.value for s in request.severities] if request.severities else None,
+        "labels": request.labels,
+        "project": request.project
+    }
 
-                    Hãy cung cấp:
-                    1. Tóm tắt các bugs tìm thấy
-                    2. Mức độ nghiêm trọng và ưu tiên
-                    3. Khuyến nghị xử lý
-                    4. Mối liên hệ giữa các bugs
+def format_bug_results(results: List[Dict]) -> List[Dict]:
+    """Bug summaries returned by the search endpoints"""
+    bugs_info = []
+    for result in results:
+        metadata = result.get("metadata", {})
+        bugs_info.append({
+            "bug_name": metadata.get("bug_name"),
+            "type": metadata.get("bug_type"),
+            "severity": metadata.get("severity"),
+            "status": metadata.get("status"),
+            "component": metadata.get("component"),
+            "project": metadata.get("project"),
+            "labels": metadata.get("labels", []),
+            "similarity_score": result.get("similarity", 0),
+            "content_preview": result["content"][:200] + "..." if len(result["content"]) > 200 else result["content"]
+        })
+    return bugs_info
 
-                    Trả lời bằng tiếng Việt, ngắn gọn và súc tích.
-                    """
-        else:
-            prompt = f"Phân tích dữ liệu bugs: {json.dumps(serializable_data[:5], ensure_ascii=False)}"
+def load_bugs_for_analysis(request: BugAnalysisRequest) -> List[Dict]:
+    """Bugs selected by an analysis request"""
+    if request.bug_ids:
+        # Get specific bugs by IDs in a single query
+        return mongo_manager.hydrate_documents(request.bug_ids)
+    
+    # Get all bugs with filters
+    query_filter = {"metadata.document_type": "bug"}
+    
+    if request.project:
+        query_filter["metadata.project"] = request.project
+    
+    return list(mongo_manager.documents_collection.find(query_filter, {"embedding": 0, "embedding_next": 0}).limit(100))
+
+def compute_bug_statistics(bugs_data: List[Dict]) -> Dict:
+    """Counts of the analyzed bugs by type, severity and status, and their projects"""
+    stats = {
+        "total_bugs": len(bugs_data),
+        "by_type": {},
+        "by_severity": {},
+        "by_status": {},
+        "projects": set()
+    }
+    
+    for bug in bugs_data:
+        metadata = bug.get("metadata", {})
         
-        response = llm_model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        return f"Không thể tạo phân tích: {str(e)}"
+        # Count by type
+        bug_type = metadata.get("bug_type", "Unknown")
+        stats["by_type"][bug_type] = stats["by_type"].get(bug_type, 0) + 1
+        
+        # Count by severity
+        severity = metadata.get("severity", "Unknown")
+        stats["by_severity"][severity] = stats["by_severity"].get(severity, 0) + 1
+        
+        # Count by status
+        status = metadata.get("status", "Unknown")
+        stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
+        
+        # Collect projects
+        if metadata.get("project"):
+            stats["projects"].add(metadata["project"])
+    
+    stats["projects"] = list(stats["projects"])
+    return stats
 
 # API Endpoints
 from fastapi import APIRouter
@@ -310,159 +525,124 @@ async def health_check():
 async def import_bugs(request: BugImportRequest):
     """Import danh sách bugs vào hệ thống"""
     try:
-        imported_bugs = []
-        failed_bugs = []
-        
         import_info = {
             "project_name": request.project_name,
             "import_source": request.import_source,
             "batch_name": request.batch_name or f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         }
         
-        for i, bug in enumerate(request.bugs):
-            try:
-                # Format bug content for embedding
-                bug_content = format_bug_content(bug)
-                
-                # Generate embedding
-                embedding = await get_gemini_embedding(bug_content)
-                
-                # Create metadata
-                metadata = create_bug_metadata(bug, import_info)
-                
-                # Add to MongoDB
-                doc_id = mongo_manager.add_document(
-                    content=bug_content,
-                    embedding=embedding,
-                    metadata=metadata
-                )
-                
-                imported_bugs.append({
-                    "bug_name": bug.name,
-                    "document_id": doc_id,
-                    "type": bug.type.value,
-                    "severity": bug.severity.value if bug.severity else None
-                })
-                
-            except Exception as e:
-                failed_bugs.append({
-                    "bug_name": bug.name,
-                    "error": str(e),
-                    "index": i
-                })
+        # Pipelined import: concurrent embeddings per chunk, one insert_many per chunk
+        items = [create_import_item(bug, import_info) for bug in request.bugs]
+        job = create_import_job(len(items), import_info["batch_name"])
+        # Duplicates of stored bugs are linked to the canonical document instead of re-embedded
+        import_coro = run_import(
+            job, items,
+            embed=get_gemini_embedding,
+            store=mongo_manager.add_documents,
+            resolve=mongo_manager.resolve_duplicates,
+            release=mongo_manager.release_duplicates
+        )
+        
+        if request.background:
+            job.task = asyncio.create_task(import_coro)
+            return {
+                "message": f"Import started: {len(items)} bugs",
+                "job_id": job.job_id,
+                "batch_name": import_info["batch_name"],
+                "status": job.status,
+                "project": request.project_name
+            }
+        
+        await import_coro
+        if job.status == "failed":
+            raise Exception(job.error)
         
         return {
-            "message": f"Import completed: {len(imported_bugs)} success, {len(failed_bugs)} failed",
+            "message": f"Import completed: {job.imported_count} success, {job.failed_count} failed",
             "batch_name": import_info["batch_name"],
-            "imported_count": len(imported_bugs),
-            "failed_count": len(failed_bugs),
-            "imported_bugs": imported_bugs,
-            "failed_bugs": failed_bugs,
+            "imported_count": job.imported_count,
+            "failed_count": job.failed_count,
+            "duplicate_count": job.duplicate_count,
+            "imported_bugs": [
+                {key: entry.get(key) for key in ("bug_name", "document_id", "type", "severity", "duplicate_of")}
+                for entry in job.imported_items()
+            ],
+            "failed_bugs": [
+                {key: entry[key] for key in ("bug_name", "error", "index")}
+                for entry in job.failed_items()
+            ],
             "project": request.project_name
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
 
+@app.get("/bugs/import/jobs/{job_id}")
+async def get_import_job_status(job_id: str, include_items: bool = False):
+    """Tiến độ của một import chạy nền"""
+    job = get_import_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.to_dict(include_items=include_items)
+
 @app.post("/bugs/search")
 async def search_bugs(request: BugSearchRequest):
     """Tìm kiếm bugs với AI-powered search"""
     try:
-        # Generate query embedding
-        query_embedding = await get_gemini_embedding(request.query)
-        
-        # Search in MongoDB
-        results = mongo_manager.search_by_embedding(
-            query_embedding=query_embedding,
-            top_k=request.limit * 2  # Get more results for filtering
-        )
-        
-        # Filter results based on criteria
-        filtered_results = []
-        for result in results:
-            metadata = result.get("metadata", {})
-            
-            # Filter by bug type
-            if request.bug_types and metadata.get("bug_type") not in [t.value for t in request.bug_types]:
-                continue
-            
-            # Filter by severity
-            if request.severities and metadata.get("severity") not in [s.value for s in request.severities]:
-                continue
-            
-            # Filter by labels
-            if request.labels:
-                bug_labels = metadata.get("labels", [])
-                if not any(label in bug_labels for label in request.labels):
-                    continue
-            
-            # Filter by project
-            if request.project and metadata.get("project") != request.project:
-                continue
-            
-            filtered_results.append(result)
-            
-            if len(filtered_results) >= request.limit:
-                break
+        filtered_results = await search_bug_documents(request)
         
         # Generate AI answer
         if filtered_results:
             answer = await generate_bug_analysis(filtered_results, "search_answer")
         else:
-            answer = "Không tìm thấy bugs phù hợp với tiêu chí tìm kiếm."
-        
-        # Format response
-        bugs_info = []
-        for result in filtered_results:
-            metadata = result.get("metadata", {})
-            bugs_info.append({
-                "bug_name": metadata.get("bug_name"),
-                "type": metadata.get("bug_type"),
-                "severity": metadata.get("severity"),
-                "status": metadata.get("status"),
-                "component": metadata.get("component"),
-                "project": metadata.get("project"),
-                "labels": metadata.get("labels", []),
-                "similarity_score": result.get("similarity", 0),
-                "content_preview": result["content"][:200] + "..." if len(result["content"]) > 200 else result["content"]
-            })
+            answer = NO_BUGS_FOUND_ANSWER
         
+        bugs_info = format_bug_results(filtered_results)
         return {
             "query": request.query,
             "answer": answer,
             "found_bugs": len(bugs_info),
             "bugs": bugs_info,
-            "filters_applied": {
-                "bug_types": [t.value for t in request.bug_types] if request.bug_types else None,
-                "severities": [s.value for s in request.severities] if request.severities else None,
-                "labels": request.labels,
-                "project": request.project
-            }
+            "filters_applied": applied_filters(request)
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+@app.post("/bugs/search/stream")
+async def search_bugs_stream(request: BugSearchRequest, http_request: Request):
+    """
+    Tìm kiếm bugs như /bugs/search nhưng trả về câu trả lời dạng server-sent events
+
+    Event `sources` (bugs tìm được) được gửi ngay sau bước tìm kiếm, sau đó là các event
+    `token` khi Gemini sinh câu trả lời, kết thúc bằng `done` (hoặc `error`).
+    """
+    try:
+        filtered_results = await search_bug_documents(request)
+        answer = (stream_bug_analysis(filtered_results, "search_answer") if filtered_results
+                  else single_piece(NO_BUGS_FOUND_ANSWER))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+    
+    bugs_info = format_bug_results(filtered_results)
+    return sse_response(stream_answer_events(
+        http_request,
+        "sources",
+        {
+            "query": request.query,
+            "found_bugs": len(bugs_info),
+            "bugs": bugs_info,
+            "filters_applied": applied_filters(request)
+        },
+        answer,
+        error_prefix="Không thể tạo phân tích: "
+    ))
+
 @app.post("/bugs/analyze")
 async def analyze_bugs(request: BugAnalysisRequest):
     """Phân tích bugs với AI"""
     try:
-        # Get bugs data from MongoDB
-        if request.bug_ids:
-            # Get specific bugs by IDs
-            bugs_data = []
-            for bug_id in request.bug_ids:
-                doc = mongo_manager.documents_collection.find_one({"doc_id": bug_id})
-                if doc:
-                    bugs_data.append(doc)
-        else:
-            # Get all bugs with filters
-            query_filter = {"metadata.document_type": "bug"}
-            
-            if request.project:
-                query_filter["metadata.project"] = request.project
-            
-            bugs_data = list(mongo_manager.documents_collection.find(query_filter).limit(100))
+        bugs_data = load_bugs_for_analysis(request)
         
         if not bugs_data:
             return {
@@ -473,46 +653,44 @@ async def analyze_bugs(request: BugAnalysisRequest):
         # Generate analysis
         analysis = await generate_bug_analysis(bugs_data, request.analysis_type)
         
-        # Calculate statistics
-        stats = {
-            "total_bugs": len(bugs_data),
-            "by_type": {},
-            "by_severity": {},
-            "by_status": {},
-            "projects": set()
-        }
-        
-        for bug in bugs_data:
-            metadata = bug.get("metadata", {})
-            
-            # Count by type
-            bug_type = metadata.get("bug_type", "Unknown")
-            stats["by_type"][bug_type] = stats["by_type"].get(bug_type, 0) + 1
-            
-            # Count by severity
-            severity = metadata.get("severity", "Unknown")
-            stats["by_severity"][severity] = stats["by_severity"].get(severity, 0) + 1
-            
-            # Count by status
-            status = metadata.get("status", "Unknown")
-            stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
-            
-            # Collect projects
-            if metadata.get("project"):
-                stats["projects"].add(metadata["project"])
-        
-        stats["projects"] = list(stats["projects"])
-        
         return {
             "analysis_type": request.analysis_type,
             "analysis": analysis,
-            "statistics": stats,
+            "statistics": compute_bug_statistics(bugs_data),
             "analyzed_bugs_count": len(bugs_data)
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@app.post("/bugs/analyze/stream")
+async def analyze_bugs_stream(request: BugAnalysisRequest, http_request: Request):
+    """
+    Phân tích bugs như /bugs/analyze nhưng trả về kết quả dạng server-sent events
+
+    Event `statistics` (thống kê tính từ MongoDB) được gửi ngay, sau đó là các event
+    `token` khi Gemini sinh phân tích, kết thúc bằng `done` (hoặc `error`).
+    """
+    try:
+        bugs_data = load_bugs_for_analysis(request)
+        analysis = (stream_bug_analysis(bugs_data, request.analysis_type) if bugs_data
+                    else single_piece("Không có dữ liệu bugs phù hợp."))
+        statistics = compute_bug_statistics(bugs_data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    
+    return sse_response(stream_answer_events(
+        http_request,
+        "statistics",
+        {
+            "analysis_type": request.analysis_type,
+            "statistics": statistics,
+            "analyzed_bugs_count": len(bugs_data)
+        },
+        analysis,
+        error_prefix="Không thể tạo phân tích: "
+    ))
+
 @app.get("/bugs/stats")
 async def get_bug_stats():
     """Lấy thống kê tổng quan về bugs"""
@@ -577,37 +755,11 @@ async def import_bugs_from_csv(file: UploadFile = File(...)):
         if not file.filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail="File must be CSV format")
         
-        # Read CSV content
-        content = await file.read()
-        csv_content = content.decode('utf-8')
-        
-        # Parse CSV
-        csv_reader = csv.DictReader(csv_content.splitlines())
+        # Parse CSV straight from the spooled upload
         bugs = []
-        
-        for row in csv_reader:
+        for row in open_csv_upload(file):
             try:
-                bug = BugItem(
-                    name=row.get('name', ''),
-                    description=row.get('description', ''),
-                    type=BugType(row.get('type', 'BUG')),
-                    severity=BugSeverity(row.get('severity', 'MAJOR')) if row.get('severity') else BugSeverity.MAJOR,
-                    status=BugStatus(row.get('status', 'OPEN')) if row.get('status') else BugStatus.OPEN,
-                    labels=row.get('labels', '').split(',') if row.get('labels') else [],
-                    file_path=row.get('file_path'),
-                    line_number=int(row.get('line_number', 0)) if row.get('line_number') else None,
-                    component=row.get('component'),
-                    project=row.get('project'),
-                    assignee=row.get('assignee'),
-                    reporter=row.get('reporter'),
-                    created_date=row.get('created_date'),
-                    updated_date=row.get('updated_date'),
-                    resolution=row.get('resolution'),
-                    effort=row.get('effort'),
-                    debt=row.get('debt'),
-                    tags=row.get('tags', '').split(',') if row.get('tags') else []
-                )
-                bugs.append(bug)
+                bugs.append(parse_csv_bug(row))
             except Exception as e:
                 print(f"Error parsing row: {row}, error: {e}")
                 continue
@@ -632,6 +784,39 @@ async def import_bugs_from_csv(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"CSV import failed: {str(e)}")
 
+@app.post("/bugs/import/csv/stream")
+async def import_bugs_from_csv_stream(file: UploadFile = File(...), chunk_size: int = 200):
+    """Import bugs từ CSV file lớn, trả về tiến độ và lỗi từng dòng dạng NDJSON"""
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="File must be CSV format")
+    
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    import_info = {
+        "project_name": f"csv_import_{stamp}",
+        "import_source": "csv_file",
+        "batch_name": f"csv_{file.filename}_{stamp}"
+    }
+    # Counters only: per-row outcomes are streamed, not accumulated
+    job = create_import_job(0, import_info["batch_name"], keep_items=False)
+    events = stream_import(
+        job,
+        iter_csv_import_chunks(file, import_info, max(1, chunk_size)),
+        embed=get_gemini_embedding,
+        store=mongo_manager.add_documents,
+        resolve=mongo_manager.resolve_duplicates,
+        release=mongo_manager.release_duplicates
+    )
+    
+    async def ndjson():
+        yield json.dumps({"event": "started", "job_id": job.job_id, "source_file": file.filename}) + "\n"
+        try:
+            async for event in events:
+                yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -12,6 +12,10 @@ from pydantic import BaseModel, Field
 import google.generativeai as genai
 from dotenv import load_dotenv
 from modules.mongodb_service import get_mongo_manager
+from modules.search import normalize_filters
+from modules.embedding import get_embedding_batcher, get_embedding_service
+from modules.llm_service import generate_content_async
+from utils.logger import logger
 import uvicorn
 from bson import ObjectId
 
@@ -21,11 +25,11 @@ load_dotenv(root_env_path)
 
 # Configure Gemini
 gemini_api_key = os.getenv("GEMINI_API_KEY")
-if not gemini_api_key:
+if gemini_api_key:
+    genai.configure(api_key=gemini_api_key)
+elif get_embedding_service().provider.requires_api_key:
     raise ValueError("GEMINI_API_KEY not found in environment variables")
 
-genai.configure(api_key=gemini_api_key)
-
 # Initialize APIRouter
 app = APIRouter()
 
@@ -65,7 +69,11 @@ class BugSearchRequest(BaseModel):
     query: str = Field(..., description="Search query")
     collection_name: str = Field(default="bug_rag_documents", description="MongoDB collection name")
     top_k: int = Field(default=5, description="Number of results to return")
-    filters: Dict[str, Any] = Field(default_factory=dict, description="Additional filters")
+    filters: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Metadata filters: {field: value | [values] | {'$eq': value} | {'$in': [values]}}; "
+                    "a list or $in matches any of the values, on both the Atlas and the local index path"
+    )
 
 class BugFixSuggestionRequest(BaseModel):
     """Request for AI-powered bug fix suggestions"""
@@ -74,18 +82,21 @@ class BugFixSuggestionRequest(BaseModel):
     include_similar_fixes: bool = Field(default=True, description="Include similar fixes from RAG")
 
 # Helper Functions
-def generate_gemini_embedding(text: str) -> List[float]:
-    """Generate embedding using Gemini"""
+async def generate_gemini_embedding(text: str) -> List[float]:
+    """Generate embedding using Gemini, batched with concurrent requests"""
     try:
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
+        return await get_embedding_batcher().embed(text, task_type="retrieval_document")
     except Exception as e:
         print(f"Error generating embedding: {e}")
-        return [0.0] * 768  # Default embedding size
+        return [0.0] * (get_embedding_service().dimension or 768)  # Default embedding size
+
+async def generate_gemini_embeddings(texts: List[str]) -> List[List[float]]:
+    """Generate embeddings for several texts; cached texts skip the Gemini request"""
+    try:
+        return await get_embedding_batcher().embed_many(texts, task_type="retrieval_document")
+    except Exception as e:
+        print(f"Error generating embeddings: {e}")
+        return [[0.0] * (get_embedding_service().dimension or 768) for _ in texts]  # Default embedding size
 
 def format_bug_for_rag(bug: BugRAGItem) -> str:
     """Format bug information for RAG processing"""
@@ -168,41 +179,63 @@ async def import_bugs_as_rag(request: BugRAGImportRequest):
         
         imported_bugs = []
         
-        for bug in request.bugs:
-            # Format bug content for RAG
-            content = format_bug_for_rag(bug)
-            
-            # Generate embedding if requested
-            embedding = None
-            if request.generate_embeddings:
-                embedding = generate_gemini_embedding(content)
-            
-            # Create metadata
-            metadata = create_bug_rag_metadata(bug)
-            
-            # Create document
-            document = {
-                "content": content,
-                "metadata": metadata,
-                "embedding": embedding,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            # Insert into MongoDB
-            result = collection.insert_one(document)
+        # Format bug content for RAG
+        contents = [format_bug_for_rag(bug) for bug in request.bugs]
+        
+        # doc_id mirrors _id so bug_id works for both lookups; duplicates link to their canonical bug
+        object_ids = [ObjectId() for _ in contents]
+        resolutions = mongo_manager.resolve_duplicates(
+            contents, request.collection_name, doc_ids=[str(object_id) for object_id in object_ids]
+        )
+        canonical = [position for position, resolution in enumerate(resolutions) if resolution["duplicate_of"] is None]
+        
+        try:
+            # Generate embeddings if requested, in one batched call, for new content only
+            embeddings = [None] * len(contents)
+            if request.generate_embeddings and canonical:
+                vectors = await generate_gemini_embeddings([contents[position] for position in canonical])
+                for position, vector in zip(canonical, vectors):
+                    embeddings[position] = vector
             
-            imported_bugs.append({
-                "bug_id": str(result.inserted_id),
-                "bug_name": bug.name,
-                "status": "imported"
-            })
+            for bug, content, embedding, object_id, resolution in zip(request.bugs, contents, embeddings, object_ids, resolutions):
+                # Create metadata
+                metadata = create_bug_rag_metadata(bug)
+                
+                # Create document
+                document = mongo_manager.apply_resolution({
+                    "_id": object_id,
+                    "doc_id": str(object_id),
+                    "content": content,
+                    "metadata": metadata,
+                    **mongo_manager.embedding_fields(embedding),
+                    "created_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow()
+                }, resolution)
+                
+                # Insert into MongoDB
+                result = collection.insert_one(document)
+                mongo_manager.index_inserted([document], request.collection_name)
+                
+                imported_bugs.append({
+                    "bug_id": str(result.inserted_id),
+                    "bug_name": bug.name,
+                    "status": "duplicate" if resolution["duplicate_of"] else "imported",
+                    "duplicate_of": resolution["duplicate_of"]
+                })
+        except Exception:
+            stored = {bug["bug_id"] for bug in imported_bugs}
+            mongo_manager.release_duplicates(
+                [resolutions[position]["doc_id"] for position in canonical if resolutions[position]["doc_id"] not in stored],
+                request.collection_name
+            )
+            raise
         
         return {
             "message": f"Successfully imported {len(imported_bugs)} bugs as RAG documents",
             "collection": request.collection_name,
             "imported_bugs": imported_bugs,
-            "total_imported": len(imported_bugs)
+            "total_imported": len(imported_bugs),
+            "total_duplicates": sum(1 for bug in imported_bugs if bug["duplicate_of"])
         }
     
     except Exception as e:
@@ -211,66 +244,89 @@ async def import_bugs_as_rag(request: BugRAGImportRequest):
 @app.post("/search")
 async def search_bugs_in_rag(request: BugSearchRequest):
     """Search for bugs in RAG collection"""
+    try:
+        filters = normalize_filters(request.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         mongo_manager = get_mongo_manager()
         collection = mongo_manager.get_collection(request.collection_name)
         
         # Generate query embedding
-        query_embedding = generate_gemini_embedding(request.query)
+        query_embedding = await generate_gemini_embedding(request.query)
         
-        # Build search pipeline
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "vector_index",
-                    "path": "embedding",
-                    "queryVector": query_embedding,
-                    "numCandidates": request.top_k * 10,
-                    "limit": request.top_k
+        results = None
+        search_type = "atlas_vector"
+        if mongo_manager.supports_vector_search(request.collection_name):
+            # Build search pipeline
+            pipeline = [
+                {
+                    "$vectorSearch": {
+                        "index": "vector_index",
+                        "path": "embedding",
+                        "queryVector": query_embedding,
+                        "numCandidates": request.top_k * 10,
+                        "limit": request.top_k
+                    }
                 }
-            }
-        ]
-        
-        # Add filters if provided
-        if request.filters:
-            match_stage = {"$match": {}}
-            for key, value in request.filters.items():
-                match_stage["$match"][f"metadata.{key}"] = value
-            pipeline.append(match_stage)
-        
-        # Execute search
-        results = list(collection.aggregate(pipeline))
+            ]
+            
+            # Add filters if provided (same any-of semantics as the posting lists)
+            if filters:
+                pipeline.append({"$match": {f"metadata.{key}": {"$in": values} for key, values in filters.items()}})
+            
+            # Same fields as the local index path
+            pipeline.append({
+                "$project": {
+                    "_id": 0,
+                    "doc_id": 1,
+                    "content": 1,
+                    "metadata": 1,
+                    "similarity": {"$meta": "vectorSearchScore"}
+                }
+            })
+            
+            try:
+                results = mongo_manager.cached_search(
+                    "atlas_vector", query_embedding, request.top_k, filters, request.collection_name,
+                    lambda: convert_objectid_to_str(list(collection.aggregate(pipeline))),
+                    request.query
+                )
+            except Exception as e:
+                logger.warning(f"$vectorSearch failed, switching to local vector index: {e}")
+                mongo_manager.disable_vector_search(request.collection_name)
         
-        # Convert ObjectId to string
-        results = convert_objectid_to_str(results)
+        if results is None:
+            # Self-hosted MongoDB: in-process index with filters applied before ranking
+            search_type = "local_vector"
+            results = convert_objectid_to_str(mongo_manager.search_by_embedding(
+                query_embedding,
+                top_k=request.top_k,
+                filters=filters,
+                collection_name=request.collection_name,
+                query=request.query
+            ))
         
         return {
             "query": request.query,
             "results": results,
             "total_found": len(results),
-            "collection": request.collection_name
+            "collection": request.collection_name,
+            "search_type": search_type
         }
     
     except Exception as e:
         # Fallback to text search if vector search fails
         try:
             mongo_manager = get_mongo_manager()
-            collection = mongo_manager.get_collection(request.collection_name)
             
-            search_filter = {
-                "$or": [
-                    {"content": {"$regex": request.query, "$options": "i"}},
-                    {"metadata.bug_name": {"$regex": request.query, "$options": "i"}},
-                    {"metadata.description": {"$regex": request.query, "$options": "i"}}
-                ]
-            }
-            
-            # Add additional filters
-            for key, value in request.filters.items():
-                search_filter[f"metadata.{key}"] = value
-            
-            results = list(collection.find(search_filter).limit(request.top_k))
-            results = convert_objectid_to_str(results)
+            # BM25 over content and bug names instead of regex collection scans
+            results = mongo_manager.search_documents(
+                request.query,
+                top_k=request.top_k,
+                filters=filters,
+                collection_name=request.collection_name
+            )
             
             return {
                 "query": request.query,
@@ -310,17 +366,15 @@ async def fix_bug(request: BugFixRequest):
                 "metadata.status": "FIXED",
                 "metadata.fix_record": fix_record,
                 "updated_at": datetime.utcnow()
-            }
+            },
+            "$inc": {"metadata.fix_count": 1}
         }
         
-        # Add fix information to content for better RAG retrieval
+        # The fix gets its own small vector; the bug's content and vector stay as they are
+        fix_content = f"FIX APPLIED:\nDescription: {request.fix_description}"
         if request.fixed_code:
-            fix_content = f"\n\nFIX APPLIED:\nDescription: {request.fix_description}\nFixed Code:\n{request.fixed_code}"
-            update_data["$set"]["content"] = bug_doc["content"] + fix_content
-            
-            # Regenerate embedding with fix information
-            new_embedding = generate_gemini_embedding(update_data["$set"]["content"])
-            update_data["$set"]["embedding"] = new_embedding
+            fix_content += f"\nFixed Code:\n{request.fixed_code}"
+        fix_embedding = await generate_gemini_embedding(fix_content)
         
         # Update the document
         result = collection.update_one(
@@ -331,10 +385,28 @@ async def fix_bug(request: BugFixRequest):
         if result.modified_count == 0:
             raise HTTPException(status_code=500, detail="Failed to update bug")
         
+        doc_id = bug_doc.get("doc_id", request.bug_id)
+        # Only the status changed: the bug's vector may predate the loaded index version
+        mongo_manager.reindex_metadata(
+            doc_id,
+            {**bug_doc["metadata"], "status": "FIXED", "fix_record": fix_record},
+            "bug_rag_documents"
+        )
+        # Duplicates are not searchable, so their fixes are found through the canonical bug
+        fix_vector_id = mongo_manager.add_document_part(
+            bug_doc.get("duplicate_of") or doc_id,
+            "fix",
+            fix_content,
+            fix_embedding,
+            {"bug_id": request.bug_id, "fix_type": request.fix_type, "fixed_by": request.fixed_by},
+            "bug_rag_documents"
+        )
+        
         return {
             "message": "Bug fixed successfully",
             "bug_id": request.bug_id,
             "fix_record": fix_record,
+            "fix_vector_id": fix_vector_id,
             "status": "FIXED"
         }
     
@@ -406,7 +478,7 @@ async def suggest_bug_fix(request: BugFixSuggestionRequest):
                     Format your response in a clear, structured manner.
                     """
         
-        response = model.generate_content(prompt)
+        response = await generate_content_async(model, prompt)
         
         return {
             "bug_id": request.bug_id,
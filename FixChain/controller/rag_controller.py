@@ -1,11 +1,27 @@
 import os
+import asyncio
 import uvicorn
 import google.generativeai as genai
-from typing import List, Dict, Any, Union, Optional
-from fastapi import APIRouter, HTTPException
+from typing import AsyncIterator, List, Dict, Any, Tuple, Union, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from modules.mongodb_service import MongoDBManager
+from modules.mongodb_service import MongoDBManager, get_mongo_manager
+from modules.embedding import get_embedding_batcher, get_embedding_service
+from modules.llm_service import generate_content_async, stream_content_async
+from modules.answer_cache import answer_key, defer_answer, document_revisions, get_answer_cache, get_deferred_answer
+from modules.context_packer import pack_context
+from modules.sse_service import single_piece, sse_response, stream_answer_events
+from modules.reembed_service import (
+    DEFAULT_COLLECTIONS,
+    get_active_version,
+    get_reembed_job,
+    resume_reembed_job,
+    resume_reembed_jobs,
+    start_reembed_job,
+    sync_active_version,
+    watch_reembed_jobs,
+)
 
 # Load environment variables from root directory
 root_env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.env')
@@ -15,25 +31,36 @@ load_dotenv(root_env_path)
 embedding_model = None
 llm_model = None
 mongo_manager: Optional[MongoDBManager] = None
+reembed_watcher: Optional[asyncio.Task] = None
+
+# Bump when the answer prompt changes so cached answers of the old prompt are not served
+RAG_ANSWER_PROMPT_VERSION = "3"
+
+NO_RESULTS_ANSWER = "Xin lỗi, tôi không tìm thấy thông tin liên quan đến câu hỏi của bạn."
 
 def init_resources():
     global embedding_model, llm_model, mongo_manager
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     if embedding_model is None or llm_model is None:
-        if not gemini_api_key:
+        if gemini_api_key:
+            genai.configure(api_key=gemini_api_key)
+        elif get_embedding_service().provider.requires_api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
-        genai.configure(api_key=gemini_api_key)
         embedding_model = genai.GenerativeModel('gemini-2.0-flash-exp')
         llm_model = genai.GenerativeModel('gemini-2.0-flash-exp')
     if mongo_manager is None:
-        mongo_manager = MongoDBManager()
+        mongo_manager = get_mongo_manager()
 
 # APIRouter
 app = APIRouter()
 
 @app.on_event("startup")
 async def startup_event():
+    global reembed_watcher
     init_resources()
+    # Queries follow the version stored vectors use; unfinished re-embedding jobs resume
+    sync_active_version(mongo_manager)
+    reembed_watcher = asyncio.create_task(watch_reembed_jobs(mongo_manager))
 
 # Pydantic models
 class DocumentInput(BaseModel):
@@ -54,7 +81,7 @@ class DocumentInput(BaseModel):
         }
     )
 
-class SearchInput(BaseModel):
+class RetrieveInput(BaseModel):
     query: Union[str, List[str]] = Field(
         ..., 
         description="Câu hỏi tìm kiếm (string) hoặc danh sách các từ khóa (array of strings)",
@@ -71,9 +98,56 @@ class SearchInput(BaseModel):
     )
     combine_mode: str = Field(
         default="OR", 
-        description="Cách kết hợp multiple queries: 'OR' (tìm documents khớp BẤT KỲ query nào) hoặc 'AND' (tìm documents khớp TẤT CẢ queries)",
-        pattern="^(OR|AND)$"
+        description="Cách kết hợp multiple queries: 'OR' (tìm documents khớp BẤT KỲ query nào), 'AND' (tìm documents khớp TẤT CẢ queries) hoặc 'RRF' (reciprocal rank fusion)",
+        pattern="^(OR|AND|RRF)$"
     )
+    search_mode: str = Field(
+        default="vector",
+        description="Cách tìm kiếm cho single query: 'vector' (embedding) hoặc 'hybrid' (BM25 + embedding, kết hợp bằng reciprocal rank fusion)",
+        pattern="^(vector|hybrid)$"
+    )
+
+class SearchInput(RetrieveInput):
+    generate_answer: bool = Field(
+        default=True,
+        description="Có tạo câu trả lời bằng Gemini hay không; false chỉ trả về sources (như /retrieve)"
+    )
+    defer_answer: bool = Field(
+        default=False,
+        description="Trả về sources ngay và tạo câu trả lời ở nền; lấy câu trả lời qua GET /answers/{answer_id}"
+    )
+
+class ReembedInput(BaseModel):
+    provider: str = Field(
+        default="gemini",
+        description="Embedding provider của version mới: 'gemini' hoặc 'local'",
+        pattern="^(gemini|local)$"
+    )
+    model: Optional[str] = Field(
+        default=None,
+        description="Tên model embedding (mặc định theo EMBEDDING_MODEL)",
+        example="models/text-embedding-004"
+    )
+    dimension: Optional[int] = Field(default=None, description="Số chiều vector (chỉ dùng cho provider 'local')", ge=8)
+    tag: Optional[str] = Field(
+        default=None,
+        description="Nhãn version bổ sung, ví dụ khi đổi format content nhưng giữ nguyên model",
+        example="bug-format-v2"
+    )
+    collections: List[str] = Field(
+        default_factory=lambda: list(DEFAULT_COLLECTIONS),
+        description="Các collection cần embed lại"
+    )
+    batch_size: int = Field(default=100, description="Số documents mỗi batch (mỗi batch được checkpoint)", ge=1, le=1000)
+    requests_per_minute: Optional[int] = Field(
+        default=None,
+        description="Giới hạn số request embedding mỗi phút để không vượt quota",
+        ge=1
+    )
+
+class RetrieveResponse(BaseModel):
+    sources: List[Dict[str, Any]] = Field(..., description="Danh sách documents liên quan, xếp theo độ liên quan")
+    query: str = Field(..., description="Query đã được xử lý (kết hợp từ array nếu có)")
 
 class SearchResponse(BaseModel):
     answer: str = Field(
@@ -97,46 +171,124 @@ class SearchResponse(BaseModel):
         description="Query đã được xử lý (kết hợp từ array nếu có)",
         example="Python performance optimization"
     )
+    answer_id: Optional[str] = Field(
+        default=None,
+        description="ID của câu trả lời đang được tạo ở nền (khi defer_answer=true)"
+    )
 
 # Helper functions
 async def get_gemini_embedding(text: str) -> List[float]:
-    """Get embedding from Gemini Flash 2.0"""
+    """Get embedding from Gemini Flash 2.0, batched with concurrent requests and cached"""
     try:
-        # Use Gemini's embedding task
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
+        return await get_embedding_batcher().embed(text, task_type="retrieval_document")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating embedding: {str(e)}")
 
-async def generate_answer_with_gemini(query: str, context_docs: List[Dict]) -> str:
-    """Generate answer using Gemini Flash 2.0"""
+async def get_gemini_embeddings(texts: List[str]) -> List[List[float]]:
+    """Get embeddings for several texts, one Gemini request for the uncached ones"""
     try:
-        # Prepare context from retrieved documents
-        context = "\n\n".join([
-            f"Document {i+1}: {doc.get('content', '')}" 
-            for i, doc in enumerate(context_docs)
-        ])
-        
-        prompt = f"""
-                Bạn là một AI assistant thông minh. Dựa trên thông tin được cung cấp, hãy trả lời câu hỏi một cách chính xác và chi tiết.
+        return await get_embedding_batcher().embed_many(texts, task_type="retrieval_document")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating embeddings: {str(e)}")
+
+def build_answer_prompt(query: str, context_docs: List[Dict]) -> str:
+    """Prompt asking Gemini to answer query from the retrieved documents"""
+    # Only the passages that fit the context token budget, most relevant documents first
+    packed = pack_context([{"content": doc.get("content", "")} for doc in context_docs], query)
+    context = "\n\n".join([
+        f"Document {i+1}: {doc['content']}" 
+        for i, doc in enumerate(packed)
+    ])
+    
+    return f"""
+            Bạn là một AI assistant thông minh. Dựa trên thông tin được cung cấp, hãy trả lời câu hỏi một cách chính xác và chi tiết.
 
-                Thông tin tham khảo:
-                {context}
+            Thông tin tham khảo:
+            {context}
 
-                Câu hỏi: {query}
+            Câu hỏi: {query}
 
-                Hãy trả lời bằng tiếng Việt, dựa trên thông tin được cung cấp. Nếu không có thông tin liên quan, hãy nói rằng bạn không có đủ thông tin để trả lời.
-                """
-        
-        response = llm_model.generate_content(prompt)
-        return response.text
+            Hãy trả lời bằng tiếng Việt, dựa trên thông tin được cung cấp. Nếu không có thông tin liên quan, hãy nói rằng bạn không có đủ thông tin để trả lời.
+            """
+
+def answer_cache_key(query: str, context_docs: List[Dict]) -> str:
+    """Answer cache key; editing or deleting any source document changes it
+
+    A query the semantic query cache matched to an earlier rewording shares that wording's answer.
+    """
+    return answer_key(
+        mongo_manager.query_cache.canonical_label(query),
+        document_revisions(context_docs, mongo_manager.get_document_revisions),
+        "rag_answer",
+        RAG_ANSWER_PROMPT_VERSION
+    )
+
+async def generate_answer_with_gemini(query: str, context_docs: List[Dict]) -> str:
+    """Generate answer using Gemini Flash 2.0, reusing the cached answer for the same query and sources"""
+    try:
+        answer, _ = await get_answer_cache().get_or_generate(
+            answer_cache_key(query, context_docs), lambda: _generate_answer(query, context_docs)
+        )
+        return answer
     except Exception as e:
         return f"Xin lỗi, tôi không thể tạo câu trả lời do lỗi: {str(e)}"
 
+async def _generate_answer(query: str, context_docs: List[Dict]) -> str:
+    # Errors propagate so they are not cached
+    response = await generate_content_async(llm_model, build_answer_prompt(query, context_docs))
+    return response.text
+
+def stream_answer_with_gemini(query: str, context_docs: List[Dict]) -> AsyncIterator[str]:
+    """Stream the answer as Gemini generates it; a cached answer comes back as a single piece"""
+    return get_answer_cache().stream(
+        answer_cache_key(query, context_docs),
+        lambda: stream_content_async(llm_model, build_answer_prompt(query, context_docs))
+    )
+
+async def retrieve_documents(search_input: RetrieveInput) -> Tuple[str, List[Dict]]:
+    """Query text used for the answer and the documents retrieved for it"""
+    # Handle both single query and array of queries
+    if isinstance(search_input.query, str):
+        # Single query
+        query_text = search_input.query
+        query_embedding = await get_gemini_embedding(query_text)
+        
+        if search_input.search_mode == "hybrid":
+            results = mongo_manager.hybrid_search(
+                query=query_text,
+                query_embedding=query_embedding,
+                top_k=search_input.limit
+            )
+        else:
+            results = mongo_manager.search_by_embedding(
+                query_embedding=query_embedding,
+                top_k=search_input.limit,
+                query=query_text
+            )
+    else:
+        # Multiple queries (array): one embedding request, one batched index search,
+        # rankings fused on doc_id
+        query_text = " ".join(search_input.query)  # Combine for answer generation
+        query_embeddings = await get_gemini_embeddings(search_input.query) if search_input.query else []
+        
+        results = mongo_manager.search_by_embeddings(
+            query_embeddings=query_embeddings,
+            top_k=search_input.limit,
+            combine_mode=search_input.combine_mode
+        )
+    return query_text, results
+
+def format_sources(results: List[Dict]) -> List[Dict[str, Any]]:
+    """Source previews returned with an answer"""
+    return [
+        {
+            "content": doc["content"][:200] + "..." if len(doc["content"]) > 200 else doc["content"],
+            "metadata": doc.get("metadata", {}),
+            "similarity_score": doc.get("similarity", 0)
+        }
+        for doc in results
+    ]
+
 # API endpoints
 
 @app.get("/")
@@ -153,6 +305,9 @@ async def root():
         "endpoints": {
             "add_document": "POST /add",
             "search": "POST /search",
+            "search_stream": "POST /search/stream",
+            "retrieve": "POST /retrieve",
+            "answer": "GET /answers/{answer_id}",
             "stats": "GET /stats"
         }
     }
@@ -170,21 +325,33 @@ async def health_check():
 async def add_document(doc_input: DocumentInput):
     """Add a document to MongoDB with Gemini embeddings"""
     try:
-        # Generate embedding using Gemini
-        embedding = await get_gemini_embedding(doc_input.content)
-        
-        # Add document to MongoDB
-        doc_id = mongo_manager.add_document(
-            content=doc_input.content,
-            embedding=embedding,
-            metadata=doc_input.metadata
-        )
+        # Duplicates of a stored document are linked to it instead of re-embedded
+        resolution = mongo_manager.resolve_duplicates([doc_input.content])[0]
+        embedding = None
+        try:
+            if resolution["duplicate_of"] is None:
+                # Generate embedding using Gemini
+                embedding = await get_gemini_embedding(doc_input.content)
+            
+            # Add document to MongoDB
+            doc_id = mongo_manager.add_document(
+                content=doc_input.content,
+                embedding=embedding,
+                metadata=doc_input.metadata,
+                resolution=resolution
+            )
+        except Exception:
+            if resolution["duplicate_of"] is None:
+                mongo_manager.release_duplicates([resolution["doc_id"]])
+            raise
         
         return {
             "message": "Document added successfully",
             "document_id": str(doc_id),
+            "duplicate_of": resolution["duplicate_of"],
             "content_length": len(doc_input.content),
-            "embedding_model": "gemini-2.0-flash-exp"
+            "embedding_model": get_embedding_service().model,
+            "embedding_version": get_embedding_service().version
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding document: {str(e)}")
@@ -200,7 +367,11 @@ async def search_documents(search_input: SearchInput):
     
     **OR Mode**: Tìm documents khớp với BẤT KỲ query nào (mặc định)
     **AND Mode**: Tìm documents khớp với TẤT CẢ queries
-    
+    **RRF Mode**: Xếp hạng theo reciprocal rank fusion của các queries
+
+    **generate_answer=false**: chỉ trả về sources, không gọi Gemini
+    **defer_answer=true**: trả về sources và `answer_id` ngay, câu trả lời lấy qua GET /answers/{answer_id}
+
     **Ví dụ Single Query:**
     ```json
     {
@@ -228,80 +399,30 @@ async def search_documents(search_input: SearchInput):
     ```
     """
     try:
-        # Handle both single query and array of queries
-        if isinstance(search_input.query, str):
-            # Single query
-            query_text = search_input.query
-            query_embedding = await get_gemini_embedding(query_text)
-            
-            results = mongo_manager.search_by_embedding(
-                query_embedding=query_embedding,
-                top_k=search_input.limit
-            )
-        else:
-            # Multiple queries (array)
-            query_text = " ".join(search_input.query)  # Combine for answer generation
-            all_results = []
-            
-            for single_query in search_input.query:
-                query_embedding = await get_gemini_embedding(single_query)
-                single_results = mongo_manager.search_by_embedding(
-                    query_embedding=query_embedding,
-                    top_k=search_input.limit
-                )
-                all_results.extend(single_results)
-            
-            # Remove duplicates and combine results based on mode
-            if search_input.combine_mode.upper() == "AND":
-                # For AND mode, only keep documents that appear in all query results
-                doc_counts = {}
-                for doc in all_results:
-                    doc_id = doc.get("_id", str(doc))
-                    if doc_id not in doc_counts:
-                        doc_counts[doc_id] = {"count": 0, "doc": doc, "total_score": 0}
-                    doc_counts[doc_id]["count"] += 1
-                    doc_counts[doc_id]["total_score"] += doc.get("similarity_score", 0)
-                
-                # Only keep docs that appear in all queries
-                num_queries = len(search_input.query)
-                results = [
-                    {**item["doc"], "similarity_score": item["total_score"] / item["count"]}
-                    for item in doc_counts.values() 
-                    if item["count"] == num_queries
-                ]
-            else:
-                # For OR mode (default), combine all results and remove duplicates
-                seen_docs = set()
-                results = []
-                for doc in all_results:
-                    doc_id = doc.get("_id", str(doc))
-                    if doc_id not in seen_docs:
-                        seen_docs.add(doc_id)
-                        results.append(doc)
-            
-            # Sort by similarity score and limit
-            results = sorted(results, key=lambda x: x.get("similarity_score", 0), reverse=True)[:search_input.limit]
+        query_text, results = await retrieve_documents(search_input)
         
         if not results:
             return SearchResponse(
-                answer="Xin lỗi, tôi không tìm thấy thông tin liên quan đến câu hỏi của bạn.",
+                answer=NO_RESULTS_ANSWER,
                 sources=[],
                 query=query_text
             )
         
+        sources = format_sources(results)
+        if not search_input.generate_answer:
+            return SearchResponse(answer="", sources=sources, query=query_text)
+        
+        if search_input.defer_answer:
+            key = answer_cache_key(query_text, results)
+            cached = get_answer_cache().get(key)
+            if cached is not None:
+                return SearchResponse(answer=cached, sources=sources, query=query_text)
+            deferred = defer_answer(key, lambda: _generate_answer(query_text, results))
+            return SearchResponse(answer="", sources=sources, query=query_text, answer_id=deferred.answer_id)
+        
         # Generate answer using Gemini
         answer = await generate_answer_with_gemini(query_text, results)
         
-        # Format sources
-        sources = [
-            {
-                "content": doc["content"][:200] + "..." if len(doc["content"]) > 200 else doc["content"],
-                "metadata": doc.get("metadata", {}),
-                "similarity_score": doc.get("similarity_score", 0)
-            }
-            for doc in results
-        ]
-        
         return SearchResponse(
             answer=answer,
             sources=sources,
@@ -310,6 +431,51 @@ async def search_documents(search_input: SearchInput):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during search: {str(e)}")
 
+@app.post("/retrieve", response_model=RetrieveResponse)
+async def retrieve(retrieve_input: RetrieveInput):
+    """
+    Chỉ tìm documents liên quan, không gọi Gemini để tạo câu trả lời
+
+    Dành cho các client chỉ dùng `sources` (ví dụ batch fixer): nhận cùng body
+    như /search và trả về kết quả với tốc độ của index.
+    """
+    try:
+        query_text, results = await retrieve_documents(retrieve_input)
+        return RetrieveResponse(sources=format_sources(results), query=query_text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error during retrieval: {str(e)}")
+
+@app.get("/answers/{answer_id}")
+async def get_answer(answer_id: str):
+    """Trạng thái và nội dung của câu trả lời được tạo ở nền (search với defer_answer=true)"""
+    deferred = get_deferred_answer(answer_id)
+    if deferred is None:
+        raise HTTPException(status_code=404, detail="Answer not found")
+    return deferred.to_dict()
+
+@app.post("/search/stream")
+async def search_documents_stream(search_input: SearchInput, request: Request):
+    """
+    Tìm kiếm như /search nhưng trả về câu trả lời dạng server-sent events
+
+    Event `sources` (documents tìm được và query) được gửi ngay sau bước retrieval,
+    sau đó là các event `token` chứa từng phần câu trả lời khi Gemini sinh ra, kết thúc
+    bằng `done` (hoặc `error`). Khi client ngắt kết nối, việc sinh câu trả lời bị hủy.
+    """
+    try:
+        query_text, results = await retrieve_documents(search_input)
+        answer = stream_answer_with_gemini(query_text, results) if results else single_piece(NO_RESULTS_ANSWER)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error during search: {str(e)}")
+    
+    return sse_response(stream_answer_events(
+        request,
+        "sources",
+        {"query": query_text, "sources": format_sources(results)},
+        answer,
+        error_prefix="Xin lỗi, tôi không thể tạo câu trả lời do lỗi: "
+    ))
+
 @app.get("/stats")
 async def get_stats():
     """Get system statistics"""
@@ -319,13 +485,76 @@ async def get_stats():
             "status": "active",
             "document_count": doc_count,
             "database": "MongoDB",
-            "embedding_model": "gemini-2.0-flash-exp",
+            "embedding_model": get_embedding_service().model,
             "llm_model": "gemini-2.0-flash-exp",
-            "storage_type": "MongoDB with vector embeddings"
+            "storage_type": "MongoDB with vector embeddings",
+            "embedding_cache": get_embedding_service().stats(),
+            "embedding_batching": get_embedding_batcher().stats(),
+            "answer_cache": get_answer_cache().stats(),
+            "query_cache": mongo_manager.query_cache.stats()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
 
+@app.post("/embeddings/reembed")
+async def start_reembedding(reembed_input: ReembedInput):
+    """
+    Embed lại toàn bộ vectors bằng version mới trong một job chạy nền
+
+    Vectors mới được ghi cạnh vectors hiện tại; search vẫn dùng version cũ cho đến khi
+    mọi vectors đã có version mới, rồi chuyển hẳn sang version mới (không trộn hai version).
+    Tiến độ được checkpoint trong MongoDB nên job tự chạy tiếp sau khi worker bị dừng.
+    """
+    try:
+        job = start_reembed_job(
+            mongo_manager,
+            reembed_input.model_dump(include={"provider", "model", "dimension", "tag"}),
+            collections=reembed_input.collections,
+            batch_size=reembed_input.batch_size,
+            requests_per_minute=reembed_input.requests_per_minute
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting re-embedding: {str(e)}")
+    resume_reembed_jobs(mongo_manager)
+    return job
+
+@app.get("/embeddings/reembed/{job_id}")
+async def get_reembedding_job(job_id: str):
+    """Tiến độ của một job embed lại"""
+    job = get_reembed_job(mongo_manager, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Re-embedding job not found")
+    return job
+
+@app.post("/embeddings/reembed/{job_id}/resume")
+async def resume_reembedding_job(job_id: str):
+    """Chạy tiếp một job đã tạm dừng (ví dụ do hết quota) từ checkpoint"""
+    try:
+        job = resume_reembed_job(mongo_manager, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="No paused re-embedding job with this id")
+    resume_reembed_jobs(mongo_manager)
+    return job
+
+@app.get("/embeddings/versions")
+async def get_embedding_versions(collections: Optional[List[str]] = Query(None)):
+    """Version embedding đang dùng và số vectors theo từng version của mỗi collection"""
+    try:
+        return {
+            "active_version": get_embedding_service().version,
+            "stored_active": get_active_version(mongo_manager),
+            "collections": {
+                collection_name: mongo_manager.count_embedding_versions(collection_name)
+                for collection_name in collections or DEFAULT_COLLECTIONS
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting embedding versions: {str(e)}")
+
 @app.delete("documents/{doc_id}")
 async def delete_document(doc_id: str):
     """Delete a document from MongoDB"""
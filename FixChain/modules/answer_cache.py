@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.logger import logger
+
+# Deferred answers kept for fetching by id
+MAX_DEFERRED_ANSWERS = 1000
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a question"""
+    return " ".join((query or "").split()).casefold()
+
+
+def answer_key(query: str, documents: Sequence[Tuple[str, str]], kind: str, prompt_version: str) -> str:
+    """Cache key of an answer: normalized query, ordered (doc_id, revision) pairs, kind and prompt version
+
+    A document's revision is its updated_at, so editing, fixing or deleting any
+    contributing document changes the retrieval and therefore the key.
+    """
+    payload = json.dumps([normalize_query(query), [list(document) for document in documents], kind, prompt_version],
+                         ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """In-process LRU of generated answers with a time-to-live.
+
+    Concurrent misses on one key share a single generation, so a burst of the
+    same popular question costs one LLM call.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, answer = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return answer
+
+    def put(self, key: str, answer: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, answer)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """(answer, whether it came from the cache); only answers generate returns are cached, not its errors"""
+        answer = self.get(key)
+        if answer is not None:
+            self.hits += 1
+            return answer, True
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending), True
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            answer = await generate()
+            self.put(key, answer)
+            future.set_result(answer)
+            return answer, False
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters get the error; nobody else awaits the future if none were waiting
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def stream(self, key: str, generate: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Yield a cached answer whole, or stream generate's pieces and cache them once it completes
+
+        A stream that fails or is closed early (client gone) caches nothing.
+        """
+        answer = self.get(key)
+        if answer is not None:
+            self.hits += 1
+            yield answer
+            return
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            yield await asyncio.shield(pending)
+            return
+
+        self.misses += 1
+        pieces: List[str] = []
+        generation = generate()
+        try:
+            async for piece in generation:
+                pieces.append(piece)
+                yield piece
+        finally:
+            await generation.aclose()
+        self.put(key, "".join(pieces))
+
+    def stats(self) -> Dict:
+        """Hit rate and size; coalesced counts requests that waited on an identical in-flight one."""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+def document_revisions(documents: List[Dict], lookup: Callable[[List[str]], Dict[str, str]]) -> List[Tuple[str, str]]:
+    """Ordered (doc_id, revision) pairs of retrieved documents
+
+    Documents that came without updated_at (e.g. hydrated search hits) are
+    resolved through lookup, one query for all of them.
+    """
+    doc_ids = [str(document.get("doc_id") or document.get("_id")) for document in documents]
+    revisions = {
+        doc_id: str(document["updated_at"])
+        for doc_id, document in zip(doc_ids, documents) if document.get("updated_at") is not None
+    }
+    missing = [doc_id for doc_id in doc_ids if doc_id not in revisions]
+    if missing:
+        revisions.update(lookup(missing))
+    return [(doc_id, revisions.get(doc_id, "")) for doc_id in doc_ids]
+
+
+class DeferredAnswer:
+    """An answer generated in the background after its sources were returned"""
+
+    def __init__(self):
+        self.answer_id = uuid.uuid4().hex
+        self.status = "pending"
+        self.answer: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self, cache: AnswerCache, key: str, generate: Callable[[], Awaitable[str]]) -> None:
+        try:
+            self.answer, _ = await cache.get_or_generate(key, generate)
+            self.status = "completed"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Deferred answer {self.answer_id} failed: {str(e)}")
+        finally:
+            self.finished_at = datetime.now()
+
+    def to_dict(self) -> Dict:
+        return {
+            "answer_id": self.answer_id,
+            "status": self.status,
+            "answer": self.answer,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+_deferred: "OrderedDict[str, DeferredAnswer]" = OrderedDict()
+_deferred_lock = threading.Lock()
+
+
+def defer_answer(key: str, generate: Callable[[], Awaitable[str]]) -> DeferredAnswer:
+    """Start generating an answer in the background through the answer cache; fetch it with get_deferred_answer"""
+    deferred = DeferredAnswer()
+    with _deferred_lock:
+        _deferred[deferred.answer_id] = deferred
+        while len(_deferred) > MAX_DEFERRED_ANSWERS:
+            _deferred.popitem(last=False)
+    deferred.task = asyncio.create_task(deferred.run(get_answer_cache(), key, generate))
+    return deferred
+
+
+def get_deferred_answer(answer_id: str) -> Optional[DeferredAnswer]:
+    with _deferred_lock:
+        return _deferred.get(answer_id)
+
+
+# Global answer cache instance
+answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Get or create the answer cache, sized by ANSWER_CACHE_MAX_ENTRIES and ANSWER_CACHE_TTL_SECONDS"""
+    global answer_cache
+    if answer_cache is None:
+        with _answer_cache_lock:
+            if answer_cache is None:
+                answer_cache = AnswerCache(
+                    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+                    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+                )
+                logger.info(f"Answer cache: {answer_cache.max_entries} entries, {answer_cache.ttl_seconds:.0f}s TTL")
+    return answer_cache
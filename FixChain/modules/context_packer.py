@@ -0,0 +1,198 @@
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from modules.search.bm25 import tokenize
+from modules.search.dedup import MinHasher
+
+# Tokens of retrieved context allowed in one LLM prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "3000"))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n|\n(?=\s*[-*\d])")
+
+# Joins the kept passages of one document where text was left out
+ELLIPSIS = " … "
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate LLM token count without a tokenizer
+
+    Each word counts one token per 4 characters (rounded up), each punctuation
+    mark one token, which tracks Gemini's SentencePiece counts within ~15% on
+    English, Vietnamese and code.
+    """
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PATTERN.findall(text or ""))
+
+
+def _cut_chars(text: str, max_tokens: int) -> str:
+    """Longest character prefix of text within max_tokens"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest whitespace-delimited prefix of text within max_tokens
+
+    A first word longer than max_tokens (a URL, a stack trace without spaces)
+    is cut at character level instead of leaving nothing.
+    """
+    kept: List[str] = []
+    used = 0
+    for word in text.split():
+        cost = estimate_tokens(word)
+        if used + cost > max_tokens:
+            if not kept:
+                return _cut_chars(word, max_tokens)
+            break
+        kept.append(word)
+        used += cost
+    return " ".join(kept)
+
+
+def select_fields(document: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    """The given fields of a document that have a value, in the given order"""
+    return {field: document[field] for field in fields if document.get(field) not in (None, "", [], {})}
+
+
+def split_passages(text: str, max_tokens: int) -> List[str]:
+    """Paragraphs of text, with long ones cut at sentence (then word) boundaries into ≤ max_tokens pieces"""
+    passages: List[str] = []
+    for paragraph in _PARAGRAPH_BREAK.split(text or ""):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        current: List[str] = []
+        used = 0
+        for sentence in _SENTENCE_END.split(paragraph):
+            cost = estimate_tokens(sentence)
+            if current and used + cost > max_tokens:
+                passages.append(" ".join(current))
+                current, used = [], 0
+            while cost > max_tokens:
+                head = truncate_to_tokens(sentence, max_tokens) or sentence[:1]
+                passages.append(head)
+                sentence = sentence[len(head):].strip()
+                cost = estimate_tokens(sentence)
+            if sentence:
+                current.append(sentence)
+                used += cost
+        if current:
+            passages.append(" ".join(current))
+    return passages
+
+
+def _normalize(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+class ContextPacker:
+    """Fits ranked documents into a token budget for an LLM prompt.
+
+    Fields other than text_field (the metadata line) are kept for every
+    document that fits, in rank order, so no document is dropped for what
+    its text shares with others. The text is cut into passages; a passage
+    repeating a kept one (normalized text contained in it, or word-shingle
+    Jaccard at least duplicate_threshold) is dropped, so overlapping chunks
+    and duplicate bugs cost nothing while texts that only share template
+    words are all kept. Every document first gets its passage that best
+    matches the query, then the remaining budget goes to further passages of
+    the best-ranked documents; the passage that crosses the budget is
+    truncated. Callers strip fields the prompt does not need (select_fields).
+    """
+
+    def __init__(self, budget_tokens: int = CONTEXT_TOKEN_BUDGET, passage_tokens: int = 120,
+                 duplicate_threshold: float = 0.9, min_passage_tokens: int = 16):
+        self.budget_tokens = budget_tokens
+        self.passage_tokens = passage_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.min_passage_tokens = min_passage_tokens
+        # Shingled like ingest deduplication (see DuplicateIndex)
+        self._hasher = MinHasher(num_perm=1, shingle_size=3)
+
+    def _is_duplicate(self, normalized: str, shingles: Set[str], kept: List[Tuple[str, Set[str]]]) -> bool:
+        for kept_text, kept_shingles in kept:
+            if f" {normalized} " in f" {kept_text} ":
+                return True
+            union = len(shingles | kept_shingles)
+            if union and len(shingles & kept_shingles) / union >= self.duplicate_threshold:
+                return True
+        return False
+
+    def pack(self, documents: List[Dict[str, Any]], query: str = "", text_field: str = "content") -> List[Dict[str, Any]]:
+        """Copies of the documents (best first) whose text_field holds only the passages that fit"""
+        query_terms = set(tokenize(query))
+        used = 0
+        included: List[int] = []
+        has_fields: Set[int] = set()
+        for rank, document in enumerate(documents):
+            fields = {field: value for field, value in document.items() if field != text_field}
+            cost = estimate_tokens(json.dumps(fields, ensure_ascii=False, default=str)) if fields else 0
+            if used + cost > self.budget_tokens:
+                break
+            used += cost
+            included.append(rank)
+            if fields:
+                has_fields.add(rank)
+
+        # (document rank, query overlap, position, text) of every passage
+        candidates: List[Tuple[int, int, int, str]] = []
+        for rank in included:
+            text = str(documents[rank].get(text_field) or "")
+            for position, passage in enumerate(split_passages(text, self.passage_tokens)):
+                candidates.append((rank, len(set(tokenize(passage)) & query_terms), position, passage))
+
+        # Round one: the best passage of each document; round two: the rest, best documents first
+        best: Dict[int, Tuple[int, int, int, str]] = {}
+        for candidate in candidates:
+            current = best.get(candidate[0])
+            if current is None or candidate[1] > current[1]:
+                best[candidate[0]] = candidate
+        first = [best[rank] for rank in sorted(best)]
+        chosen_ids = {id(candidate) for candidate in first}
+        rest = sorted((candidate for candidate in candidates if id(candidate) not in chosen_ids),
+                      key=lambda candidate: (candidate[0], -candidate[1], candidate[2]))
+
+        kept: List[Tuple[str, Set[str]]] = []
+        selected: Dict[int, List[Tuple[int, str]]] = {}
+        for rank, _, position, passage in first + rest:
+            normalized = _normalize(passage)
+            shingles = self._hasher.shingles(passage)
+            if self._is_duplicate(normalized, shingles, kept):
+                continue
+            cost = estimate_tokens(passage)
+            if used + cost > self.budget_tokens:
+                room = self.budget_tokens - used
+                if room < self.min_passage_tokens:
+                    continue
+                passage = truncate_to_tokens(passage, room)
+                cost = estimate_tokens(passage)
+            selected.setdefault(rank, []).append((position, passage))
+            kept.append((normalized, shingles))
+            used += cost
+
+        packed = []
+        for rank in included:
+            # A document with nothing but its text left out has nothing to show
+            if rank not in selected and rank not in has_fields and documents[rank].get(text_field):
+                continue
+            document = dict(documents[rank])
+            document[text_field] = ELLIPSIS.join(passage for _, passage in sorted(selected.get(rank, [])))
+            packed.append(document)
+        return packed
+
+
+def pack_context(documents: List[Dict[str, Any]], query: str = "", text_field: str = "content",
+                 budget_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Pack ranked documents into budget_tokens (default LLM_CONTEXT_TOKEN_BUDGET)"""
+    return ContextPacker(budget_tokens if budget_tokens is not None else CONTEXT_TOKEN_BUDGET).pack(
+        documents, query, text_field
+    )
@@ -0,0 +1,27 @@
+from .cache import cache_key, MemoryCache, EmbeddingStore, SQLiteEmbeddingStore, MongoEmbeddingStore, EmbeddingCache
+from .providers import EmbeddingProvider, GeminiEmbeddingProvider, LocalEmbeddingProvider
+from .registry import register, create
+from .service import EmbeddingService, create_embedding_provider, embedding_version, get_embedding_service, set_embedding_service
+from .batcher import EmbeddingBatcher, RateLimiter, get_embedding_batcher
+
+__all__ = [
+    "cache_key",
+    "MemoryCache",
+    "EmbeddingStore",
+    "SQLiteEmbeddingStore",
+    "MongoEmbeddingStore",
+    "EmbeddingCache",
+    "EmbeddingProvider",
+    "GeminiEmbeddingProvider",
+    "LocalEmbeddingProvider",
+    "register",
+    "create",
+    "EmbeddingService",
+    "create_embedding_provider",
+    "embedding_version",
+    "get_embedding_service",
+    "set_embedding_service",
+    "EmbeddingBatcher",
+    "RateLimiter",
+    "get_embedding_batcher",
+]
@@ -0,0 +1,157 @@
+from __future__ import annotations
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from utils.logger import logger
+from .providers import MAX_BATCH_SIZE
+from .service import EmbeddingService, get_embedding_service
+
+
+class RateLimiter:
+    """Sliding one-minute window limiting how many requests may start."""
+
+    def __init__(self, requests_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self._starts: Deque[float] = deque()
+
+    def reserve(self) -> float:
+        """Start a request if the window allows one (0), else the seconds until it does."""
+        now = time.monotonic()
+        while self._starts and now - self._starts[0] >= 60:
+            self._starts.popleft()
+        if len(self._starts) < self.requests_per_minute:
+            self._starts.append(now)
+            return 0.0
+        return 60 - (now - self._starts[0])
+
+    async def acquire(self) -> None:
+        while True:
+            delay = self.reserve()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embedding requests into batched Gemini calls.
+
+    Texts awaiting an embedding are queued per task type. A queue is flushed
+    when it reaches max_batch_size texts or max_delay seconds after its first
+    text arrived, whichever comes first; the batch goes through the cached
+    EmbeddingService in a worker thread and each awaiting coroutine gets its
+    own vector back. max_concurrency bounds in-flight calls and
+    requests_per_minute keeps them under the API quota.
+    """
+
+    def __init__(
+        self,
+        service: Optional[EmbeddingService] = None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_delay: float = 0.01,
+        max_concurrency: int = 4,
+        requests_per_minute: Optional[int] = None,
+    ):
+        self.service = service or get_embedding_service()
+        self.max_batch_size = max(1, min(max_batch_size, self.service.provider.max_batch_size))
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._rate_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.texts = 0
+        self.batches = 0
+
+    def use_service(self, service: EmbeddingService) -> None:
+        """Send later batches to service (texts already queued go there too)."""
+        self.service = service
+        self.max_batch_size = max(1, min(self.max_batch_size, service.provider.max_batch_size))
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Queues and the semaphore belong to one event loop
+            self._loop = loop
+            self._pending.clear()
+            self._timers.clear()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return loop
+
+    async def embed(self, text: str, task_type: str = "retrieval_document") -> List[float]:
+        """Embedding of one text, batched with whatever else arrives meanwhile."""
+        loop = self._bind()
+        future = loop.create_future()
+        queue = self._pending.setdefault(task_type, [])
+        queue.append((text, future))
+        self.texts += 1
+        if len(queue) >= self.max_batch_size:
+            self._flush(task_type)
+        elif task_type not in self._timers:
+            self._timers[task_type] = loop.call_later(self.max_delay, self._flush, task_type)
+        return await future
+
+    async def embed_many(self, texts: Sequence[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        """Embeddings of several texts, in order."""
+        return list(await asyncio.gather(*(self.embed(text, task_type) for text in texts)))
+
+    def _flush(self, task_type: str) -> None:
+        timer = self._timers.pop(task_type, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(task_type, [])
+        if batch:
+            self.batches += 1
+            self._loop.create_task(self._send(task_type, batch))
+
+    async def _send(self, task_type: str, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            async with self._semaphore:
+                if self._rate_limiter is not None:
+                    await self._rate_limiter.acquire()
+                vectors = await asyncio.to_thread(self.service.embed_many, [text for text, _ in batch], task_type)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(batch)} texts failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> Dict:
+        """Texts submitted, batches sent and the resulting mean batch size."""
+        return {
+            "texts": self.texts,
+            "batches": self.batches,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_delay_ms": self.max_delay * 1000,
+        }
+
+
+# Global embedding batcher instance
+embedding_batcher = None
+_embedding_batcher_lock = threading.Lock()
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Get or create the embedding batcher, configured from EMBEDDING_BATCH_* variables"""
+    global embedding_batcher
+    if embedding_batcher is None:
+        with _embedding_batcher_lock:
+            if embedding_batcher is None:
+                rpm = os.getenv("EMBEDDING_RPM")
+                embedding_batcher = EmbeddingBatcher(
+                    max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", str(MAX_BATCH_SIZE))),
+                    max_delay=float(os.getenv("EMBEDDING_BATCH_DELAY_MS", "10")) / 1000,
+                    max_concurrency=int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4")),
+                    requests_per_minute=int(rpm) if rpm else None,
+                )
+    return embedding_batcher
@@ -0,0 +1,201 @@
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+
+def cache_key(text: str, model: str, task_type: str) -> str:
+    """Content address of an embedding: model, task type and sha256 of the text."""
+    return f"{model}:{task_type}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def as_stored(vector: Sequence[float]) -> List[float]:
+    """A vector rounded to float32, the precision every cache tier keeps"""
+    return np.asarray(vector, dtype=np.float32).tolist()
+
+
+class MemoryCache:
+    """In-process LRU of float32 vectors, evicted by total size in bytes."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                return None
+            self._entries.move_to_end(key)
+            return vector.tolist()
+
+    def put(self, key: str, vector: Sequence[float]) -> None:
+        array = np.asarray(vector, dtype=np.float32)
+        if array.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = array
+            self._bytes += array.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+
+class EmbeddingStore(ABC):
+    """Persistent second cache tier shared across restarts (and processes)."""
+
+    kind = "base"
+
+    @abstractmethod
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_many(self, items: Sequence[Tuple[str, Sequence[float]]]) -> None:
+        raise NotImplementedError
+
+
+class SQLiteEmbeddingStore(EmbeddingStore):
+    """Embeddings as float32 blobs in a local SQLite file."""
+
+    kind = "sqlite"
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at TEXT)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        keys = list(keys)
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Sequence[Tuple[str, Sequence[float]]]) -> None:
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+            )
+            self._conn.commit()
+
+
+class MongoEmbeddingStore(EmbeddingStore):
+    """Embeddings in a MongoDB collection keyed by cache key, shared by every worker."""
+
+    kind = "mongo"
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        cursor = self.collection.find({"_id": {"$in": list(keys)}}, {"vector": 1})
+        return {doc["_id"]: doc["vector"] for doc in cursor}
+
+    def put_many(self, items: Sequence[Tuple[str, Sequence[float]]]) -> None:
+        if not items:
+            return
+        now = datetime.now()
+        self.collection.bulk_write([
+            UpdateOne({"_id": key}, {"$set": {"vector": [float(v) for v in vector], "created_at": now}}, upsert=True)
+            for key, vector in items
+        ], ordered=False)
+
+
+class EmbeddingCache:
+    """Two-tier cache: memory LRU in front of an optional persistent store.
+
+    Store hits are promoted into memory. Counters report where lookups were
+    served from so the hit rate can be monitored.
+    """
+
+    def __init__(self, memory: Optional[MemoryCache] = None, store: Optional[EmbeddingStore] = None):
+        self.memory = memory if memory is not None else MemoryCache()
+        self.store = store
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        missing = []
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None:
+                found[key] = vector
+            else:
+                missing.append(key)
+        memory_hits = len(found)
+
+        store_hits = 0
+        if missing and self.store is not None:
+            stored = self.store.get_many(missing)
+            for key, vector in stored.items():
+                self.memory.put(key, vector)
+                found[key] = vector
+            store_hits = len(stored)
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.store_hits += store_hits
+            self.misses += len(keys) - memory_hits - store_hits
+        return found
+
+    def put_many(self, items: Sequence[Tuple[str, Sequence[float]]]) -> None:
+        for key, vector in items:
+            self.memory.put(key, vector)
+        if self.store is not None and items:
+            self.store.put_many(items)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.memory_hits + self.store_hits + self.misses
+            return {
+                "lookups": lookups,
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.store_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory.size_bytes,
+                "store": self.store.kind if self.store is not None else None,
+            }
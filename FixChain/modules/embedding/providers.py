@@ -0,0 +1,135 @@
+from __future__ import annotations
+import hashlib
+import math
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import List, Optional
+
+import google.generativeai as genai
+import numpy as np
+
+from modules.search.bm25 import tokenize
+
+# Gemini accepts at most this many texts per batched embed_content request
+MAX_BATCH_SIZE = 100
+
+DEFAULT_MODEL = "models/text-embedding-004"
+
+
+class EmbeddingProvider(ABC):
+    """Backend that turns texts into embedding vectors."""
+
+    name = "base"
+    # Whether the provider calls the Gemini API (and so needs GEMINI_API_KEY)
+    requires_api_key = False
+    max_batch_size = MAX_BATCH_SIZE
+
+    @property
+    @abstractmethod
+    def model(self) -> str:
+        """Identifier of the vector space; part of every cache key."""
+        raise NotImplementedError
+
+    @property
+    def dimension(self) -> Optional[int]:
+        """Vector size, when known without calling the backend."""
+        return None
+
+    @abstractmethod
+    def embed_batch(self, texts: List[str], task_type: str) -> List[List[float]]:
+        """Embeddings of at most max_batch_size texts, in order."""
+        raise NotImplementedError
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Gemini embed_content, one batched request per call."""
+
+    name = "gemini"
+    requires_api_key = True
+
+    def __init__(self, model: str = DEFAULT_MODEL):
+        self._model = model
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return 768 if self._model == DEFAULT_MODEL else None
+
+    def embed_batch(self, texts: List[str], task_type: str) -> List[List[float]]:
+        result = genai.embed_content(model=self._model, content=texts, task_type=task_type)
+        return result["embedding"]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Network-free embeddings from hashed n-grams, NumPy only.
+
+    Features are word unigrams, word bigrams and character trigrams of each
+    word, weighted by sublinear term frequency. Every feature is hashed
+    (blake2b, so vectors are stable across processes) onto a few signed
+    coordinates of a dimension-sized vector. That is a sparse random
+    projection of the hashed feature vector. The result is L2-normalized, so
+    cosine similarity tracks shared vocabulary and spelling. It is much
+    weaker semantically than Gemini, but deterministic and sub-millisecond.
+    """
+
+    name = "local"
+    max_batch_size = 1000
+
+    # Weight of each n-gram family
+    WORD_WEIGHT = 1.0
+    BIGRAM_WEIGHT = 0.7
+    CHAR_WEIGHT = 0.4
+
+    def __init__(self, dimension: int = 768, projections: int = 2, seed: int = 0):
+        if not 1 <= projections <= 4:
+            raise ValueError("projections must be between 1 and 4")
+        self._dimension = dimension
+        self.projections = projections
+        self.seed = seed
+        self._salt = seed.to_bytes(8, "little")
+
+    @property
+    def model(self) -> str:
+        return f"local-hash-v1-d{self._dimension}-p{self.projections}-s{self.seed}"
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._dimension
+
+    def features(self, text: str) -> Counter:
+        """Weighted n-gram features of a text."""
+        tokens = tokenize(text)
+        weights: Counter = Counter()
+        counts = Counter(f"w:{token}" for token in tokens)
+        counts.update(f"b:{first} {second}" for first, second in zip(tokens, tokens[1:]))
+        for token in tokens:
+            padded = f"#{token}#"
+            counts.update(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        kinds = {"w": self.WORD_WEIGHT, "b": self.BIGRAM_WEIGHT, "c": self.CHAR_WEIGHT}
+        for feature, count in counts.items():
+            weights[feature] = kinds[feature[0]] * (1.0 + math.log(count))
+        return weights
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self._dimension, dtype=np.float32)
+        weights = self.features(text)
+        if not weights:
+            return vector
+        digests = np.frombuffer(b"".join(
+            hashlib.blake2b(feature.encode("utf-8"), digest_size=16, salt=self._salt).digest()
+            for feature in weights
+        ), dtype=np.uint32).reshape(len(weights), 4)
+        values = np.fromiter(weights.values(), dtype=np.float32, count=len(weights))
+        for projection in range(self.projections):
+            hashed = digests[:, projection]
+            signs = np.where(hashed & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(vector, (hashed >> 1) % self._dimension, signs * values)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed_batch(self, texts: List[str], task_type: str) -> List[List[float]]:
+        # Queries and documents share one space; task_type does not change the vector
+        return [self.embed_one(text).tolist() for text in texts]
@@ -0,0 +1,30 @@
+from __future__ import annotations
+from typing import Dict, Type
+
+from .providers import EmbeddingProvider
+
+_registry: Dict[str, Type[EmbeddingProvider]] = {}
+
+
+def register(name: str, cls: Type[EmbeddingProvider]) -> None:
+    """Register an embedding provider implementation."""
+    _registry[name] = cls
+
+
+def get(name: str) -> Type[EmbeddingProvider]:
+    """Look up a registered embedding provider class."""
+    if name not in _registry:
+        raise KeyError(f"Embedding provider '{name}' is not registered")
+    return _registry[name]
+
+
+def create(name: str, *args, **kwargs) -> EmbeddingProvider:
+    """Create a registered embedding provider."""
+    return get(name)(*args, **kwargs)
+
+
+# Register built-in providers
+from .providers import GeminiEmbeddingProvider, LocalEmbeddingProvider
+
+register("gemini", GeminiEmbeddingProvider)
+register("local", LocalEmbeddingProvider)
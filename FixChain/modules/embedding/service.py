@@ -0,0 +1,139 @@
+from __future__ import annotations
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+from utils.logger import logger
+from .cache import EmbeddingCache, MemoryCache, MongoEmbeddingStore, SQLiteEmbeddingStore, as_stored, cache_key
+from .providers import DEFAULT_MODEL, EmbeddingProvider, GeminiEmbeddingProvider
+from . import registry
+
+
+def embedding_version(model: str, tag: Optional[str] = None) -> str:
+    """Version label of vectors produced by model (and an optional content/format tag)"""
+    return f"{model}#{tag}" if tag else model
+
+
+class EmbeddingService:
+    """Single entry point for embeddings, with a content-addressed cache.
+
+    Texts are looked up by sha256 + model + task type; only the misses of a
+    call are sent to the provider (Gemini by default), deduplicated and batched.
+    """
+
+    def __init__(self, provider: Optional[EmbeddingProvider] = None, cache: Optional[EmbeddingCache] = None,
+                 tag: Optional[str] = None):
+        self.provider = provider or GeminiEmbeddingProvider()
+        self.model = self.provider.model
+        # Stored on every vector; the tag is bumped to force re-embedding under the same model
+        self.tag = tag
+        self.version = embedding_version(self.model, tag)
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self._lock = threading.Lock()
+        self.api_calls = 0
+        self.embedded_texts = 0
+
+    def embed(self, text: str, task_type: str = "retrieval_document") -> List[float]:
+        """Embedding of one text."""
+        return self.embed_many([text], task_type)[0]
+
+    def embed_many(self, texts: Sequence[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        """Embeddings of several texts, in order, with one request per batch of misses."""
+        keys = [cache_key(text, self.model, task_type) for text in texts]
+        vectors: Dict[str, List[float]] = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        pending: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                pending.setdefault(key, text)
+        if pending:
+            missing_keys = list(pending)
+            fresh = []
+            batch_size = self.provider.max_batch_size
+            for start in range(0, len(missing_keys), batch_size):
+                batch = missing_keys[start:start + batch_size]
+                # Rounded like cached vectors, so a text embeds the same whether or not it was cached
+                fresh.extend(zip(batch, map(as_stored, self._request([pending[key] for key in batch], task_type))))
+            self.cache.put_many(fresh)
+            vectors.update(fresh)
+
+        return [vectors[key] for key in keys]
+
+    def _request(self, texts: List[str], task_type: str) -> List[List[float]]:
+        vectors = self.provider.embed_batch(texts, task_type)
+        with self._lock:
+            self.api_calls += 1
+            self.embedded_texts += len(texts)
+        return vectors
+    
+    @property
+    def dimension(self) -> Optional[int]:
+        return self.provider.dimension
+
+    def stats(self) -> Dict:
+        """Cache hit rate and API usage counters."""
+        with self._lock:
+            return {
+                "provider": self.provider.name,
+                "model": self.model,
+                "version": self.version,
+                "api_calls": self.api_calls,
+                "embedded_texts": self.embedded_texts,
+                **self.cache.stats(),
+            }
+
+
+def create_embedding_provider(name: Optional[str] = None, model: Optional[str] = None,
+                              dimension: Optional[int] = None) -> EmbeddingProvider:
+    """Build a provider; unset arguments come from EMBEDDING_PROVIDER (gemini or local),
+    EMBEDDING_MODEL and EMBEDDING_DIMENSION"""
+    name = (name or os.getenv("EMBEDDING_PROVIDER", "gemini")).lower()
+    if name == "gemini":
+        return registry.create(name, model or os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL))
+    if name == "local":
+        return registry.create(name, dimension=dimension or int(os.getenv("EMBEDDING_DIMENSION", "768")))
+    return registry.create(name)
+
+
+def create_embedding_cache() -> EmbeddingCache:
+    """Build the cache tiers from EMBEDDING_CACHE_* environment variables"""
+    memory = MemoryCache(int(float(os.getenv("EMBEDDING_CACHE_MB", "64")) * 1024 * 1024))
+    backend = os.getenv("EMBEDDING_CACHE_BACKEND", "sqlite").lower()
+    store = None
+    try:
+        if backend == "sqlite":
+            store = SQLiteEmbeddingStore(os.getenv("EMBEDDING_CACHE_PATH", os.path.join("cache", "embeddings.sqlite3")))
+        elif backend == "mongo":
+            from modules.mongodb_service import get_mongo_manager
+            store = MongoEmbeddingStore(get_mongo_manager().get_collection("embedding_cache"))
+    except Exception as e:
+        logger.warning(f"Persistent embedding cache '{backend}' unavailable, using memory only: {e}")
+    return EmbeddingCache(memory, store)
+
+
+# Global embedding service instance
+embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Get or create the embedding service instance"""
+    global embedding_service
+    if embedding_service is None:
+        with _embedding_service_lock:
+            if embedding_service is None:
+                embedding_service = EmbeddingService(create_embedding_provider(), create_embedding_cache(),
+                                                     os.getenv("EMBEDDING_VERSION_TAG") or None)
+                logger.info(f"Embedding provider: {embedding_service.provider.name} ({embedding_service.version})")
+    return embedding_service
+
+
+def set_embedding_service(service: EmbeddingService) -> None:
+    """Replace the process-wide embedding service, e.g. after a re-embedding cut-over"""
+    global embedding_service
+    with _embedding_service_lock:
+        embedding_service = service
+    from .batcher import embedding_batcher
+    if embedding_batcher is not None:
+        embedding_batcher.use_service(service)
+    logger.info(f"Embedding service switched to {service.provider.name} ({service.version})")
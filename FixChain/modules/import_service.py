@@ -0,0 +1,303 @@
+import asyncio
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+# Finished jobs kept for status polling
+MAX_TRACKED_JOBS = 100
+
+# Pipeline stages: embed one text, store embedded items, resolve and release duplicates
+Embed = Callable[[str], Awaitable[List[float]]]
+Store = Callable[..., Tuple[List[Optional[str]], Dict[int, str]]]
+Resolve = Callable[[List[str]], List[Dict[str, Any]]]
+Release = Callable[[List[str]], None]
+
+
+class ImportItem:
+    """One document to import, with the fields reported back for it
+
+    index is the item's position in the source (e.g. its CSV row), shared with
+    rows rejected before import; by default its position among the items.
+    """
+
+    def __init__(self, content: str, metadata: Dict[str, Any], summary: Dict[str, Any], index: Optional[int] = None):
+        self.content = content
+        self.metadata = metadata
+        self.summary = summary
+        self.index = index
+
+
+class ImportJob:
+    """Progress and per-item outcome of a bulk import"""
+
+    def __init__(self, total: int, batch_name: Optional[str] = None, keep_items: bool = True):
+        self.job_id = uuid.uuid4().hex
+        self.batch_name = batch_name
+        self.total = total
+        # Streaming imports only keep counters so memory stays flat
+        self.keep_items = keep_items
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.imported: List[Tuple[int, Dict[str, Any]]] = []
+        self.failed: List[Tuple[int, Dict[str, Any]]] = []
+        self.imported_count = 0
+        self.failed_count = 0
+        self.duplicate_count = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def processed(self) -> int:
+        return self.imported_count + self.failed_count
+
+    def record_imported(self, index: int, item: ImportItem, doc_id: str, duplicate_of: Optional[str] = None) -> None:
+        self.imported_count += 1
+        if duplicate_of:
+            self.duplicate_count += 1
+        if self.keep_items:
+            entry = {**item.summary, "document_id": doc_id}
+            if duplicate_of:
+                entry["duplicate_of"] = duplicate_of
+            self.imported.append((index, entry))
+
+    def record_failed(self, index: int, item: Optional[ImportItem], error: Any) -> Dict[str, Any]:
+        self.failed_count += 1
+        entry = {**(item.summary if item else {}), "error": str(error), "index": index}
+        if self.keep_items:
+            self.failed.append((index, entry))
+        return entry
+
+    def imported_items(self) -> List[Dict[str, Any]]:
+        return [entry for _, entry in sorted(self.imported, key=lambda pair: pair[0])]
+
+    def failed_items(self) -> List[Dict[str, Any]]:
+        return [entry for _, entry in sorted(self.failed, key=lambda pair: pair[0])]
+
+    def to_dict(self, include_items: bool = False) -> Dict[str, Any]:
+        info = {
+            "job_id": self.job_id,
+            "batch_name": self.batch_name,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "imported_count": self.imported_count,
+            "failed_count": self.failed_count,
+            "duplicate_count": self.duplicate_count,
+            "progress": self.processed / self.total if self.total else 1.0,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+        }
+        if include_items:
+            info["imported_bugs"] = self.imported_items()
+            info["failed_bugs"] = self.failed_items()
+        return info
+
+
+_jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def create_import_job(total: int, batch_name: Optional[str] = None, keep_items: bool = True) -> ImportJob:
+    """Register a job so its progress can be polled"""
+    job = ImportJob(total, batch_name, keep_items)
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        while len(_jobs) > MAX_TRACKED_JOBS:
+            _jobs.popitem(last=False)
+    return job
+
+
+def get_import_job(job_id: str) -> Optional[ImportJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+async def import_chunk(
+    job: ImportJob,
+    start: int,
+    chunk: List[ImportItem],
+    embed: Embed,
+    store: Store,
+    resolve: Optional[Resolve] = None,
+    release: Optional[Release] = None,
+) -> List[Dict[str, Any]]:
+    """Embed one chunk concurrently and store it in a worker thread; returns its failures
+
+    With resolve (e.g. MongoDBManager.resolve_duplicates), duplicates of stored
+    or earlier content are linked to their canonical document and not embedded;
+    release is told about canonical doc_ids that could not be stored.
+    """
+    failures: List[Dict[str, Any]] = []
+    resolutions = await asyncio.to_thread(resolve, [item.content for item in chunk]) if resolve else None
+    canonical = [
+        offset for offset in range(len(chunk))
+        if resolutions is None or resolutions[offset]["duplicate_of"] is None
+    ]
+    vectors = await asyncio.gather(*(embed(chunk[offset].content) for offset in canonical), return_exceptions=True)
+    embeddings: List[Any] = [None] * len(chunk)
+    for offset, vector in zip(canonical, vectors):
+        embeddings[offset] = vector
+    
+    ready: List[Tuple[int, ImportItem, Optional[List[float]], Optional[Dict[str, Any]]]] = []
+    unstored: Dict[str, Any] = {}
+    for offset, (item, embedding) in enumerate(zip(chunk, embeddings)):
+        resolution = resolutions[offset] if resolutions else None
+        index = item.index if item.index is not None else start + offset
+        if isinstance(embedding, BaseException):
+            failures.append(job.record_failed(index, item, embedding))
+            if resolution:
+                unstored[resolution["doc_id"]] = embedding
+        elif resolution and resolution["duplicate_of"] in unstored:
+            failures.append(job.record_failed(
+                index, item, f"Canonical document failed: {unstored[resolution['duplicate_of']]}"
+            ))
+        else:
+            ready.append((index, item, embedding, resolution))
+    if unstored and release:
+        release(list(unstored))
+    if not ready:
+        return failures
+    triples = [(item.content, item.metadata, embedding) for _, item, embedding, _ in ready]
+    try:
+        if resolutions:
+            doc_ids, errors = await asyncio.to_thread(
+                store, triples, resolutions=[resolution for _, _, _, resolution in ready]
+            )
+        else:
+            doc_ids, errors = await asyncio.to_thread(store, triples)
+    except Exception as e:
+        if resolutions and release:
+            release([resolution["doc_id"] for _, _, _, resolution in ready if not resolution["duplicate_of"]])
+        return failures + [job.record_failed(index, item, e) for index, item, _, _ in ready]
+    for position, (index, item, _, resolution) in enumerate(ready):
+        if position in errors:
+            failures.append(job.record_failed(index, item, errors[position]))
+        else:
+            job.record_imported(index, item, doc_ids[position], resolution["duplicate_of"] if resolution else None)
+    return failures
+
+
+async def run_import(
+    job: ImportJob,
+    items: List[ImportItem],
+    embed: Embed,
+    store: Store,
+    chunk_size: int = 200,
+    max_chunks_in_flight: int = 4,
+    resolve: Optional[Resolve] = None,
+    release: Optional[Release] = None,
+) -> ImportJob:
+    """Embed and store items as a pipeline of chunks
+
+    Each chunk requests all its embeddings concurrently (the embedding
+    batcher coalesces them into few API calls), then hands the chunk to
+    store (e.g. MongoDBManager.add_documents) in a worker thread. Up to
+    max_chunks_in_flight chunks run at once, so one chunk is written while
+    the next ones are still embedding.
+    """
+    semaphore = asyncio.Semaphore(max_chunks_in_flight)
+    job.status = "running"
+    job.started_at = datetime.now()
+
+    async def process(start: int, chunk: List[ImportItem]) -> None:
+        async with semaphore:
+            await import_chunk(job, start, chunk, embed, store, resolve, release)
+
+    try:
+        await asyncio.gather(*(
+            process(start, items[start:start + chunk_size]) for start in range(0, len(items), chunk_size)
+        ))
+        job.status = "completed"
+    except Exception as e:
+        logger.error(f"Import job {job.job_id} failed: {e}")
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished_at = datetime.now()
+    logger.info(f"Import job {job.job_id}: {job.imported_count} imported ({job.duplicate_count} duplicates), "
+                f"{job.failed_count} failed")
+    return job
+
+
+async def stream_import(
+    job: ImportJob,
+    chunks: AsyncIterator[Tuple[int, List[ImportItem], List[Dict[str, Any]]]],
+    embed: Embed,
+    store: Store,
+    max_chunks_in_flight: int = 4,
+    resolve: Optional[Resolve] = None,
+    release: Optional[Release] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Import chunks as they are produced and yield progress and error events
+
+    chunks yields (start index, items, rejected rows). The source is only
+    read while fewer than max_chunks_in_flight chunks are queued, so a
+    large upload is never buffered ahead of the embedding and insert rate.
+    """
+    pending: asyncio.Queue = asyncio.Queue(maxsize=max_chunks_in_flight)
+    # Bounded too: a slow reader holds back the workers instead of the queue growing
+    events: asyncio.Queue = asyncio.Queue(maxsize=max_chunks_in_flight * 2)
+    done = object()
+    job.status = "running"
+    job.started_at = datetime.now()
+
+    async def produce() -> None:
+        async for start, items, rejected in chunks:
+            job.total += len(items) + len(rejected)
+            for entry in rejected:
+                job.record_failed(entry["index"], None, entry["error"])
+                await events.put({"event": "error", **entry})
+            await pending.put((start, items))
+        for _ in range(max_chunks_in_flight):
+            await pending.put(done)
+
+    async def consume() -> None:
+        while True:
+            work = await pending.get()
+            if work is done:
+                return
+            start, items = work
+            for failure in await import_chunk(job, start, items, embed, store, resolve, release):
+                await events.put({"event": "error", **failure})
+            await events.put({"event": "progress", **job.to_dict()})
+
+    async def run() -> None:
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(consume()) for _ in range(max_chunks_in_flight)]
+        try:
+            await asyncio.gather(*tasks)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            job.error = "Import cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Import job {job.job_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            # A failed worker must not leave its siblings blocked on the queues
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            job.finished_at = datetime.now()
+        await events.put(done)
+
+    job.task = asyncio.create_task(run())
+    try:
+        while True:
+            event = await events.get()
+            if event is done:
+                break
+            yield event
+    finally:
+        # Stop reading the upload once the client is gone
+        if not job.task.done():
+            job.task.cancel()
+    yield {"event": "done", **job.to_dict()}
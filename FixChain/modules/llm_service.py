@@ -0,0 +1,88 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Optional
+
+# Bound on Gemini generate_content calls in flight per worker
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Dedicated threads so LLM calls neither queue behind nor starve the default executor
+_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _semaphore_loop = loop
+    return _semaphore
+
+
+async def generate_content_async(model: Any, prompt: Any, **kwargs) -> Any:
+    """Run a blocking model.generate_content call in a worker thread
+
+    The event loop keeps serving other requests (including /health) while the
+    model answers; at most LLM_MAX_CONCURRENCY calls run at once, the rest wait
+    without holding a thread.
+    """
+    async with _get_semaphore():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(model.generate_content, prompt, **kwargs))
+
+
+def _chunk_text(chunk: Any) -> str:
+    # Chunks without a text part (e.g. only a finish reason) raise on .text
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+async def stream_content_async(model: Any, prompt: Any, **kwargs) -> AsyncIterator[str]:
+    """Yield the text of a streaming model.generate_content call as it arrives
+
+    The response is read in a worker thread and handed to the event loop chunk
+    by chunk. Closing the generator (e.g. the client disconnected) makes the
+    thread stop reading at the next chunk.
+    """
+    async with _get_semaphore():
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def put(item: Any) -> None:
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                # The loop is closed; nobody is reading anymore
+                stop.set()
+
+        def produce() -> None:
+            try:
+                for chunk in model.generate_content(prompt, stream=True, **kwargs):
+                    if stop.is_set():
+                        return
+                    text = _chunk_text(chunk)
+                    if text:
+                        put(text)
+                put(done)
+            except Exception as e:
+                put(e)
+
+        loop.run_in_executor(_executor, produce)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
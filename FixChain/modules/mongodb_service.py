@@ -1,22 +1,88 @@
 import os
 import math
 from datetime import datetime
-from typing import List, Dict, Any
-from pymongo import MongoClient
+import threading
+import itertools
+from typing import List, Dict, Any, Callable, Iterator, Optional, Set, Tuple
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from pymongo.collection import Collection
 from dotenv import load_dotenv
 from utils.logger import logger
+import random
+import hashlib
+import numpy as np
+from collections import Counter
+import json
+from modules.search import BM25Index, DuplicateIndex, FlatIndex, MappedIndex, PostingIndex, QuantizedIndex, ReducedIndex, SemanticQueryCache, VectorIndex, fuse_results, read_manifest, write_snapshot
+from modules.search.postings import filter_values, normalize_filters
+from modules.search.reduction import load_reducer, save_reducer
+from modules.embedding import get_embedding_service
 
 # Load environment variables from root directory
 root_env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.env')
 load_dotenv(root_env_path)
 
+# Metadata fields with in-memory posting lists for filtered vector search
+FILTER_FIELDS = ("document_type", "bug_type", "severity", "status", "project", "component", "labels")
+
+# Per-query candidates gathered before AND/RRF fusion, so intersections are not starved by top_k
+FUSION_CANDIDATES = 100
+
+# Ingest-time deduplication: exact content hash, then MinHash LSH at this estimated
+# Jaccard similarity (1.0 keeps only exact duplicates)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+
+# Multi-vector documents: extra vectors (e.g. one per bug fix) live in "<collection>_parts" under
+# doc_id "<parent doc_id>#<kind>-<id>", and search scores a document by all of its vectors:
+# "max" takes the best one, "weighted" mixes the document's own score with its best part's
+PART_SEPARATOR = "#"
+MULTI_VECTOR_MODE = os.getenv("MULTI_VECTOR_MODE", "max").lower()
+MULTI_VECTOR_MAIN_WEIGHT = float(os.getenv("MULTI_VECTOR_MAIN_WEIGHT", "0.5"))
+# Raw hits fetched per result when several vectors of one document may rank
+PART_OVERFETCH = 4
+
+# Semantic query cache: a search reuses the results of a cached query of the same collection,
+# mode, top_k and filters whose embedding is at least this cosine-similar, until the corpus
+# changes (QUERY_CACHE_MAX_ENTRIES=0 disables it)
+QUERY_CACHE_THRESHOLD = float(os.getenv("QUERY_CACHE_THRESHOLD", "0.95"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "600"))
+# Per-collection change counters shared by every worker, so a write anywhere retires cached results everywhere
+CORPUS_VERSIONS_COLLECTION = "corpus_versions"
+
+class _VectorState:
+    """Resident search structures of one collection"""
+    
+    def __init__(self):
+        self.index: VectorIndex | None = None
+        self.postings: PostingIndex | None = None
+        self.postings_synced_size = 0
+        self.lexical: BM25Index | None = None
+        self.duplicates: DuplicateIndex | None = None
+        # parent doc_id -> doc_ids of its part vectors
+        self.parts: Dict[str, List[str]] | None = None
+        # Atlas search index name -> whether $vectorSearch can use it
+        self.atlas_search: Dict[str, bool] = {}
+        # Embedding version of the vectors in index
+        self.index_version: str | None = None
+        # Last shared corpus version seen (see MongoDBManager.cached_search)
+        self.corpus_version = 0
+        self.lock = threading.Lock()
+
 class MongoDBManager:
     def __init__(self):
         self.client = None
         self.db = None
         self.documents_collection = None
+        # Legacy side collection; vectors now live inline on documents (see migrate_embeddings)
         self.embeddings_collection = None
+        self._vector_states: Dict[str, _VectorState] = {}
+        self._vector_states_lock = threading.Lock()
+        # Disambiguates doc_ids generated within one bulk insert
+        self._doc_sequence = itertools.count()
+        self.query_cache = SemanticQueryCache(QUERY_CACHE_THRESHOLD, QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS)
         self.connect()
     
     def connect(self):
@@ -40,114 +106,1002 @@ class MongoDBManager:
             
             # Test connection
             self.client.admin.command('ping')
+            
+            # doc_id lookups back search hydration and deletes
+            self.documents_collection.create_index("doc_id")
+            self.embeddings_collection.create_index("doc_id")
             logger.info("Connected to MongoDB successfully")
             
         except Exception as e:
             logger.error(f"Error connecting to MongoDB: {e}")
             raise e
     
-    def add_document(self, content: str, metadata: Dict | None, embedding: List[float] | None) -> str:
-        """Add document to MongoDB"""
+    def _build_document(self, doc_id: str, content: str, metadata: Dict | None, embedding: List[float] | None) -> Dict:
+        document = {
+            "doc_id": doc_id,
+            "content": content,
+            "metadata": {
+                **(metadata or {}),
+                "timestamp": datetime.now().isoformat(),
+                "created_at": datetime.now()
+            },
+            "created_at": datetime.now(),
+            "updated_at": datetime.now()
+        }
+        
+        # Store the embedding inline, like every other collection
+        document.update(self.embedding_fields(embedding))
+        return document
+    
+    @staticmethod
+    def embedding_fields(embedding: List[float] | None, version: Optional[str] = None) -> Dict:
+        """Inline fields of a vector, tagged with the version that produced it (default: the active one)"""
+        if not embedding:
+            return {}
+        return {
+            "embedding": embedding,
+            "embedding_dimension": len(embedding),
+            "embedding_version": version or get_embedding_service().version
+        }
+    
+    def add_document(self, content: str, metadata: Dict | None, embedding: List[float] | None,
+                     resolution: Optional[Dict] = None) -> str:
+        """Add document to MongoDB
+
+        resolution is the resolve_duplicates entry of content, if it was checked.
+        """
         try:
-            if metadata is None:
-                metadata = {}
-            
             # Generate document ID
-            doc_id = f"doc_{datetime.now().timestamp()}"
+            doc_id = resolution["doc_id"] if resolution else f"doc_{datetime.now().timestamp()}"
             
             # Prepare document
-            document = {
-                "doc_id": doc_id,
-                "content": content,
-                "metadata": {
-                    **metadata,
-                    "timestamp": datetime.now().isoformat(),
-                    "created_at": datetime.now()
-                },
-                "created_at": datetime.now(),
-                "updated_at": datetime.now()
-            }
+            document = self.apply_resolution(self._build_document(doc_id, content, metadata, embedding), resolution)
             
             # Insert document
             result = self.documents_collection.insert_one(document)
-            
-            # Insert embedding if provided
-            if embedding:
-                embedding_doc = {
-                    "doc_id": doc_id,
-                    "vector": embedding,
-                    "dimension": len(embedding),
-                    "created_at": datetime.now()
-                }
-                self.embeddings_collection.insert_one(embedding_doc)
+            self.index_inserted([document])
             
             return doc_id
             
         except Exception as e:
             raise Exception(f"Error adding document to MongoDB: {str(e)}")
     
-    def search_documents(self, query: str, top_k: int = 5) -> List[Dict]:
-        """Search documents using text search"""
+    def add_documents(self, items: List[Tuple[str, Dict | None, List[float] | None]],
+                      collection_name: str = "documents",
+                      resolutions: Optional[List[Dict]] = None) -> Tuple[List[Optional[str]], Dict[int, str]]:
+        """Insert (content, metadata, embedding) items with one unordered insert_many
+
+        Returns the doc_id of every item (None where it failed) and the write
+        error of each failed position; one bad document does not stop the rest.
+        resolutions (from resolve_duplicates) supply doc_ids and duplicate links.
+        """
         try:
-            # Use MongoDB text search
-            search_results = self.documents_collection.find(
-                {"$text": {"$search": query}},
-                {"score": {"$meta": "textScore"}}
-            ).sort([("score", {"$meta": "textScore"})]).limit(top_k)
+            if not items:
+                return [], {}
+            stamp = datetime.now().timestamp()
+            documents = [
+                self.apply_resolution(
+                    self._build_document(
+                        resolutions[position]["doc_id"] if resolutions else f"doc_{stamp}_{next(self._doc_sequence)}",
+                        content, metadata, embedding
+                    ),
+                    resolutions[position] if resolutions else None
+                )
+                for position, (content, metadata, embedding) in enumerate(items)
+            ]
             
-            documents = []
-            for doc in search_results:
-                documents.append({
-                    "doc_id": doc["doc_id"],
-                    "content": doc["content"],
-                    "metadata": doc["metadata"],
-                    "score": doc.get("score", 0)
-                })
+            errors: Dict[int, str] = {}
+            try:
+                self.get_collection(collection_name).insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                for write_error in e.details.get("writeErrors", []):
+                    errors[write_error["index"]] = write_error.get("errmsg", "write error")
             
-            return documents
+            inserted = [document for position, document in enumerate(documents) if position not in errors]
+            self.index_inserted(inserted, collection_name)
+            if errors and resolutions:
+                self.release_duplicates([documents[position]["doc_id"] for position in errors], collection_name)
+            return [None if position in errors else document["doc_id"] for position, document in enumerate(documents)], errors
+
+        except Exception as e:
+            raise Exception(f"Error adding documents to {collection_name}: {str(e)}")
+    
+    def index_inserted(self, documents: List[Dict], collection_name: str = "documents") -> None:
+        """Index stored documents and count their duplicates
+
+        The documents are stored at this point, so a failure here is logged
+        instead of reported as a failed insert (a retry would store them twice).
+        """
+        try:
+            self.index_documents(documents, collection_name)
+        except Exception as e:
+            logger.error(f"Error indexing {len(documents)} stored documents of {collection_name}, rebuilding its index: {e}")
+            self.reload_vector_index(collection_name, rewrite_snapshot=False)
+            self._vector_state(collection_name).lexical = None
+        try:
+            self.link_duplicates(documents, collection_name)
+        except Exception as e:
+            logger.error(f"Error updating duplicate counts in {collection_name}: {e}")
+    
+    def search_documents(self, query: str, top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                         collection_name: str = "documents") -> List[Dict]:
+        """Search documents lexically (BM25 over content and bug names)"""
+        try:
+            ranked = self.lexical_search(query, top_k, filters, collection_name)
+            return self.hydrate_documents(
+                [doc_id for doc_id, _ in ranked],
+                scores=dict(ranked),
+                collection_name=collection_name,
+                score_field="score"
+            )
 
         except Exception as e:
             raise Exception(f"Error searching documents: {str(e)}")
     
-    def search_by_embedding(self, query_embedding: List[float], top_k: int = 5) -> List[Dict]:
-        """Search documents by embedding similarity (simplified cosine similarity)"""
+    def lexical_search(self, query: str, top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                       collection_name: str = "documents") -> List[Tuple[str, float]]:
+        """Rank doc_ids with the in-process BM25 index"""
+        lexical = self.get_lexical_index(collection_name)
+        active_filters = normalize_filters(filters)
+        candidates = self.resolve_filters(active_filters, collection_name) if active_filters else None
+        return lexical.search(query, top_k, candidates)
+    
+    def hybrid_search(self, query: str, query_embedding: List[float], top_k: int = 5,
+                      filters: Optional[Dict[str, Any]] = None, collection_name: str = "documents") -> List[Dict]:
+        """Fuse BM25 and vector rankings with reciprocal rank fusion"""
+        try:
+            index = self.get_vector_index(collection_name)
+            active_filters = normalize_filters(filters)
+            candidates = None
+            if active_filters:
+                self._sync_posting_index(index, collection_name)
+                candidates = self.resolve_filters(active_filters, collection_name)
+            lexical = self.get_lexical_index(collection_name).search(query, FUSION_CANDIDATES, candidates)
+            semantic = self._vector_search(index, [query_embedding], FUSION_CANDIDATES, candidates, collection_name)[0]
+            fused = fuse_results([semantic, lexical], "RRF", top_k)
+            return self.hydrate_documents(
+                [doc_id for doc_id, _ in fused],
+                scores=dict(fused),
+                collection_name=collection_name
+            )
+
+        except Exception as e:
+            raise Exception(f"Error in hybrid search: {str(e)}")
+    
+    @staticmethod
+    def _lexical_text(content: str | None, metadata: Dict | None) -> str:
+        bug_name = (metadata or {}).get("bug_name")
+        return f"{content or ''} {bug_name}" if bug_name else content or ""
+    
+    def get_lexical_index(self, collection_name: str = "documents") -> BM25Index:
+        """Get the BM25 index of a collection, building it on first use"""
+        state = self._vector_state(collection_name)
+        if state.lexical is None:
+            with state.lock:
+                if state.lexical is None:
+                    lexical = BM25Index()
+                    part_texts = self._part_texts(collection_name)
+                    cursor = self.get_collection(collection_name).find(
+                        {"doc_id": {"$exists": True}, "duplicate_of": {"$exists": False}},
+                        {"_id": 0, "doc_id": 1, "content": 1, "metadata.bug_name": 1},
+                        batch_size=1000
+                    )
+                    for doc in cursor:
+                        text = self._lexical_text(doc.get("content"), doc.get("metadata"))
+                        lexical.add(doc["doc_id"], " ".join([text, *part_texts.get(doc["doc_id"], [])]))
+                    logger.info(f"Built BM25 index over {len(lexical)} documents of {collection_name}")
+                    state.lexical = lexical
+        return state.lexical
+    
+    def _vector_state(self, collection_name: str) -> _VectorState:
+        """Get (or create) the search structures of a collection"""
+        state = self._vector_states.get(collection_name)
+        if state is None:
+            with self._vector_states_lock:
+                state = self._vector_states.get(collection_name)
+                if state is None:
+                    self.get_collection(collection_name).create_index("doc_id")
+                    self.get_collection(self.parts_collection_name(collection_name)).create_index("parent_id")
+                    state = self._vector_states[collection_name] = _VectorState()
+        return state
+    
+    def index_document(self, doc_id: str, embedding: List[float] | None, metadata: Dict | None,
+                       collection_name: str = "documents", content: str | None = None,
+                       embedding_version: Optional[str] = None) -> None:
+        """Apply a stored document's vector, metadata and text to the loaded search structures
+
+        content is None when the text did not change; embedding_version defaults to the
+        active version. A vector of another version than the loaded index is not added.
+        """
+        state = self._vector_state(collection_name)
+        if state.index is not None:
+            if not embedding:
+                state.index.remove(doc_id)
+            elif (embedding_version or get_embedding_service().version) in (state.index_version, None):
+                state.index.add(doc_id, embedding)
+        if state.postings is not None:
+            state.postings.add(doc_id, metadata)
+        if state.lexical is not None and content is not None:
+            state.lexical.add(doc_id, self._lexical_text(content, metadata))
+        self._corpus_changed(collection_name)
+    
+    def reindex_metadata(self, doc_id: str, metadata: Dict | None, collection_name: str = "documents") -> None:
+        """Apply a metadata-only update (e.g. a status change) of an indexed document to the filters"""
+        state = self._vector_state(collection_name)
+        if state.postings is not None and doc_id in state.postings:
+            state.postings.add(doc_id, metadata)
+        self._corpus_changed(collection_name)
+    
+    def index_documents(self, documents: List[Dict], collection_name: str = "documents") -> None:
+        """Apply freshly inserted documents to the loaded search structures in one batch
+
+        Duplicates linked to a canonical document are stored but not searchable.
+        """
+        state = self._vector_state(collection_name)
+        documents = [document for document in documents if not document.get("duplicate_of")]
+        if state.index is not None:
+            with_vectors = [
+                document for document in documents
+                if document.get("embedding") and document.get("embedding_version") in (state.index_version, None)
+            ]
+            state.index.add_batch([document["doc_id"] for document in with_vectors],
+                                  [document["embedding"] for document in with_vectors])
+        for document in documents:
+            if state.postings is not None:
+                state.postings.add(document["doc_id"], document.get("metadata"))
+            if state.lexical is not None:
+                state.lexical.add(document["doc_id"], self._lexical_text(document.get("content"), document.get("metadata")))
+        self._corpus_changed(collection_name)
+    
+    def unindex_document(self, doc_id: str, collection_name: str = "documents") -> None:
+        """Drop a deleted document (and its part vectors) from the loaded search structures"""
+        state = self._vector_state(collection_name)
+        part_ids = self.get_part_map(collection_name).pop(doc_id, [])
+        if state.index is not None:
+            state.index.remove(doc_id)
+            for part_id in part_ids:
+                state.index.remove(part_id)
+        if state.postings is not None:
+            state.postings.remove(doc_id)
+        if state.lexical is not None:
+            state.lexical.remove(doc_id)
+        if state.duplicates is not None:
+            state.duplicates.remove(doc_id)
+        self._corpus_changed(collection_name)
+    
+    def _corpus_changed(self, collection_name: str) -> None:
+        """Retire the cached search results of a collection whose searchable documents changed
+
+        Called once the change is searchable: a worker that sees the new version also sees the change.
+        """
+        counter = self.get_collection(CORPUS_VERSIONS_COLLECTION).find_one_and_update(
+            {"_id": collection_name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        self._vector_state(collection_name).corpus_version = counter["version"]
+        self.query_cache.invalidate(collection_name)
+    
+    def _shared_corpus_version(self, collection_name: str) -> int:
+        """Corpus version of a collection across workers; drops local cached results older than it"""
+        counter = self.get_collection(CORPUS_VERSIONS_COLLECTION).find_one({"_id": collection_name})
+        version = counter["version"] if counter else 0
+        state = self._vector_state(collection_name)
+        if version != state.corpus_version:
+            state.corpus_version = version
+            self.query_cache.invalidate(collection_name)
+        return version
+    
+    def cached_search(self, mode: str, query_embedding: List[float], top_k: int, filters: Optional[Dict[str, Any]],
+                      collection_name: str, search: Callable[[], Any], query: Optional[str] = None) -> Any:
+        """Serve a search from the semantic query cache, or run search() and cache its results
+
+        Cached results are only reused within one corpus version (shared by
+        every worker) and embedding version of the collection; query (the text)
+        lets reworded queries share text-keyed answers, see
+        SemanticQueryCache.canonical_label.
+        """
+        if self.query_cache.max_entries <= 0:
+            return search()
+        scope = (
+            mode,
+            top_k,
+            json.dumps(filters or {}, sort_keys=True, default=str),
+            self._shared_corpus_version(collection_name),
+            get_embedding_service().version
+        )
+        results = self.query_cache.lookup(collection_name, scope, query_embedding, query)
+        if results is None:
+            results = search()
+            self.query_cache.store(collection_name, scope, query_embedding, results, query)
+        return results
+    
+    @staticmethod
+    def parts_collection_name(collection_name: str) -> str:
+        return f"{collection_name}_parts"
+    
+    @staticmethod
+    def parent_id(doc_id: str) -> str:
+        """doc_id of the document a (part) vector belongs to"""
+        return doc_id.split(PART_SEPARATOR, 1)[0]
+    
+    def get_part_map(self, collection_name: str = "documents") -> Dict[str, List[str]]:
+        """Part vector doc_ids of each multi-vector document of a collection, loaded on first use"""
+        state = self._vector_state(collection_name)
+        if state.parts is None:
+            with state.lock:
+                if state.parts is None:
+                    parts: Dict[str, List[str]] = {}
+                    cursor = self.get_collection(self.parts_collection_name(collection_name)).find(
+                        {}, {"_id": 0, "doc_id": 1, "parent_id": 1}, batch_size=1000
+                    )
+                    for doc in cursor:
+                        parts.setdefault(doc["parent_id"], []).append(doc["doc_id"])
+                    state.parts = parts
+        return state.parts
+    
+    def _part_texts(self, collection_name: str, parent_ids: Optional[List[str]] = None) -> Dict[str, List[str]]:
+        query = {"parent_id": {"$in": parent_ids}} if parent_ids is not None else {}
+        texts: Dict[str, List[str]] = {}
+        cursor = self.get_collection(self.parts_collection_name(collection_name)).find(
+            query, {"_id": 0, "parent_id": 1, "content": 1}, batch_size=1000
+        )
+        for doc in cursor:
+            texts.setdefault(doc["parent_id"], []).append(doc.get("content") or "")
+        return texts
+    
+    def add_document_part(self, parent_id: str, kind: str, content: str, embedding: List[float] | None,
+                          metadata: Dict | None = None, collection_name: str = "documents") -> str:
+        """Store an extra vector of a document (e.g. one bug fix) and index it under the document
+
+        Only the part's own text is embedded; the document and its other vectors stay as they are.
+        """
+        try:
+            parts = self.get_part_map(collection_name)
+            part_id = f"{parent_id}{PART_SEPARATOR}{kind}-{datetime.now().timestamp()}_{next(self._doc_sequence)}"
+            document = {
+                "doc_id": part_id,
+                "parent_id": parent_id,
+                "kind": kind,
+                "content": content,
+                "metadata": metadata or {},
+                **self.embedding_fields(embedding),
+                "created_at": datetime.now()
+            }
+            self.get_collection(self.parts_collection_name(collection_name)).insert_one(document)
+            parts.setdefault(parent_id, []).append(part_id)
+            
+            state = self._vector_state(collection_name)
+            if state.index is not None and embedding:
+                state.index.add(part_id, embedding)
+            if state.lexical is not None:
+                parent = self.get_collection(collection_name).find_one(
+                    {"doc_id": parent_id}, {"_id": 0, "content": 1, "metadata.bug_name": 1}
+                ) or {}
+                text = self._lexical_text(parent.get("content"), parent.get("metadata"))
+                state.lexical.add(parent_id, " ".join([text, *self._part_texts(collection_name, [parent_id]).get(parent_id, [])]))
+            self._corpus_changed(collection_name)
+            return part_id
+
+        except Exception as e:
+            raise Exception(f"Error adding document part to {collection_name}: {str(e)}")
+    
+    def get_duplicate_index(self, collection_name: str = "documents") -> DuplicateIndex:
+        """Get the duplicate index over canonical documents of a collection, building it on first use"""
+        state = self._vector_state(collection_name)
+        if state.duplicates is None:
+            with state.lock:
+                if state.duplicates is None:
+                    duplicates = DuplicateIndex(DEDUP_THRESHOLD)
+                    cursor = self.get_collection(collection_name).find(
+                        {"doc_id": {"$exists": True}, "duplicate_of": {"$exists": False}},
+                        {"_id": 0, "doc_id": 1, "content": 1, "content_hash": 1, "minhash": 1},
+                        batch_size=1000
+                    )
+                    for doc in cursor:
+                        fingerprint = None
+                        if doc.get("content_hash"):
+                            signature = np.frombuffer(doc["minhash"], dtype=np.uint32) if doc.get("minhash") else None
+                            fingerprint = (doc["content_hash"], signature)
+                        duplicates.add(doc["doc_id"], doc.get("content") or "", fingerprint)
+                    logger.info(f"Built duplicate index over {len(duplicates)} documents of {collection_name}")
+                    state.duplicates = duplicates
+        return state.duplicates
+    
+    def resolve_duplicates(self, contents: List[str], collection_name: str = "documents",
+                           doc_ids: Optional[List[str]] = None) -> List[Dict]:
+        """Assign doc_ids to contents about to be stored and link duplicates to canonical documents
+
+        Each entry has doc_id, duplicate_of (None for new content), similarity and
+        the content fingerprint. New content is registered right away, so later
+        contents of this call (or a concurrent one) link to it; release_duplicates
+        undoes that for documents that end up not being stored.
+        """
         try:
-            # Get all embeddings
-            all_embeddings = list(self.embeddings_collection.find())
-            
-            # Calculate similarities
-            similarities = []
-            for emb_doc in all_embeddings:
-                similarity = self.cosine_similarity(query_embedding, emb_doc["vector"])
-                similarities.append({
-                    "doc_id": emb_doc["doc_id"],
-                    "similarity": similarity
+            if doc_ids is None:
+                stamp = datetime.now().timestamp()
+                doc_ids = [f"doc_{stamp}_{next(self._doc_sequence)}" for _ in contents]
+            if not DEDUP_ENABLED:
+                return [{"doc_id": doc_id, "duplicate_of": None, "similarity": None, "fingerprint": None} for doc_id in doc_ids]
+            
+            duplicates = self.get_duplicate_index(collection_name)
+            resolutions = []
+            for doc_id, content in zip(doc_ids, contents):
+                match, fingerprint = duplicates.find_or_add(doc_id, content or "")
+                resolutions.append({
+                    "doc_id": doc_id,
+                    "duplicate_of": match[0] if match else None,
+                    "similarity": match[1] if match else None,
+                    "fingerprint": fingerprint
                 })
+            return resolutions
+
+        except Exception as e:
+            raise Exception(f"Error resolving duplicates: {str(e)}")
+    
+    def release_duplicates(self, doc_ids: List[str], collection_name: str = "documents") -> None:
+        """Forget canonical doc_ids registered by resolve_duplicates that were not stored"""
+        state = self._vector_state(collection_name)
+        if state.duplicates is not None:
+            for doc_id in doc_ids:
+                state.duplicates.remove(doc_id)
+    
+    @staticmethod
+    def apply_resolution(document: Dict, resolution: Optional[Dict]) -> Dict:
+        """Mark a document as a duplicate (dropping its embedding) or store its fingerprint"""
+        if not resolution:
+            return document
+        if resolution["duplicate_of"]:
+            document["duplicate_of"] = resolution["duplicate_of"]
+            document["duplicate_similarity"] = resolution["similarity"]
+            for field in ("embedding", "embedding_dimension", "embedding_version"):
+                document.pop(field, None)
+        elif resolution["fingerprint"]:
+            digest, signature = resolution["fingerprint"]
+            document["content_hash"] = digest
+            if signature is not None:
+                document["minhash"] = signature.tobytes()
+        return document
+    
+    def link_duplicates(self, documents: List[Dict], collection_name: str = "documents") -> None:
+        """Count stored duplicates on their canonical documents"""
+        counts = Counter(document["duplicate_of"] for document in documents if document.get("duplicate_of"))
+        if counts:
+            self.get_collection(collection_name).bulk_write([
+                UpdateOne({"doc_id": canonical_id}, {"$inc": {"duplicate_count": count}})
+                for canonical_id, count in counts.items()
+            ], ordered=False)
+    
+    def supports_vector_search(self, collection_name: str, index_name: str = "vector_index") -> bool:
+        """Whether the server can run $vectorSearch on a collection (detected once, then cached)
+
+        Self-hosted MongoDB rejects the $listSearchIndexes stage; Atlas lists the
+        collection's search indexes, which must include index_name.
+        """
+        state = self._vector_state(collection_name)
+        supported = state.atlas_search.get(index_name)
+        if supported is None:
+            try:
+                indexes = self.get_collection(collection_name).aggregate([{"$listSearchIndexes": {"name": index_name}}])
+                supported = any(index.get("name") == index_name for index in indexes)
+            except Exception as e:
+                logger.info(f"$vectorSearch unavailable for {collection_name}, using local vector index: {e}")
+                supported = False
+            state.atlas_search[index_name] = supported
+        return supported
+    
+    def disable_vector_search(self, collection_name: str, index_name: str = "vector_index") -> None:
+        """Stop routing a collection to $vectorSearch after it failed at query time"""
+        self._vector_state(collection_name).atlas_search[index_name] = False
+    
+    def get_vector_index(self, collection_name: str = "documents") -> VectorIndex:
+        """Get the resident vector index of a collection, loading it on first use
+
+        The index is reloaded when the active embedding version changed, so
+        queries of one model are never ranked against vectors of another.
+        """
+        state = self._vector_state(collection_name)
+        version = get_embedding_service().version
+        if state.index is None or state.index_version != version:
+            with state.lock:
+                if state.index is None or state.index_version != version:
+                    state.index = self._load_vector_index(collection_name)
+                    state.index_version = version
+                    state.postings_synced_size = 0
+        return state.index
+    
+    def reload_vector_index(self, collection_name: str = "documents", rewrite_snapshot: bool = True) -> None:
+        """Rebuild the vector index of a collection from Mongo on next use, e.g. after its vectors were replaced"""
+        snapshot_dir = self.snapshot_dir(collection_name)
+        if rewrite_snapshot and snapshot_dir and read_manifest(snapshot_dir) is not None:
+            self.write_embedding_snapshot(snapshot_dir, collection_name=collection_name)
+        state = self._vector_state(collection_name)
+        with state.lock:
+            state.index = None
+            state.postings_synced_size = 0
+        self._corpus_changed(collection_name)
+    
+    def count_embedding_versions(self, collection_name: str = "documents") -> Dict[str, int]:
+        """Number of stored vectors (part vectors included) per embedding_version
+
+        Vectors written before versions were recorded count as "untagged".
+        """
+        try:
+            counts: Counter = Counter()
+            for name in (collection_name, self.parts_collection_name(collection_name)):
+                cursor = self.get_collection(name).aggregate([
+                    {"$match": {"embedding": {"$exists": True, "$ne": None}}},
+                    {"$group": {"_id": "$embedding_version", "count": {"$sum": 1}}}
+                ])
+                for doc in cursor:
+                    counts[doc["_id"] or "untagged"] += doc["count"]
+            return dict(counts)
+        except Exception as e:
+            raise Exception(f"Error counting embedding versions: {str(e)}")
+    
+    def snapshot_dir(self, collection_name: str, snapshot_root: Optional[str] = None) -> Optional[str]:
+        """Snapshot directory of a collection for the active embedding version"""
+        snapshot_root = snapshot_root or os.getenv("EMBEDDING_SNAPSHOT_DIR")
+        if not snapshot_root:
+            return None
+        # One directory (and delta log) per embedding version: workers on different versions never share vectors
+        version = hashlib.sha1(get_embedding_service().version.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(snapshot_root, collection_name, version)
+    
+    def _load_vector_index(self, collection_name: str) -> VectorIndex:
+        """Build the vector index from every embedding stored in a collection"""
+        # Compact codes in memory, exact re-ranking against the stored vectors
+        quantization = os.getenv("VECTOR_QUANTIZATION")
+        if quantization:
+            index = self.build_quantized_index(quantization, rerank_k=int(os.getenv("VECTOR_RERANK_K", "200")),
+                                               collection_name=collection_name)
+            if index is not None:
+                return index
+        
+        # Truncated or PCA-projected vectors; documents and queries go through the same reducer
+        reduction = os.getenv("VECTOR_REDUCTION")
+        if reduction:
+            index = self.build_reduced_index(reduction, int(os.getenv("VECTOR_REDUCED_DIM", "384")),
+                                             collection_name=collection_name)
+            if index is not None:
+                return index
+        
+        # Workers sharing a snapshot directory map it instead of reading Mongo
+        snapshot_dir = self.snapshot_dir(collection_name)
+        if snapshot_dir:
+            if read_manifest(snapshot_dir) is None:
+                self.write_embedding_snapshot(snapshot_dir, collection_name=collection_name)
+            return MappedIndex.open(snapshot_dir)
+        
+        index = FlatIndex()
+        for doc_ids, vectors in self.iter_embeddings(collection_name=collection_name):
+            index.add_batch(doc_ids, vectors)
+        logger.info(f"Loaded {len(index)} embeddings from {collection_name} into vector index")
+        return index
+    
+    def build_quantized_index(self, quantizer: str = "int8", rerank_k: int = 200, train_size: int = 20000,
+                              collection_name: str = "documents", **quantizer_params) -> Optional[QuantizedIndex]:
+        """Train a quantizer on a sample of stored embeddings and encode the whole corpus"""
+        sample = self.sample_embeddings(train_size, collection_name)
+        if not sample:
+            logger.warning(f"No embeddings in {collection_name} to train a quantizer on, using exact index")
+            return None
+        
+        index = QuantizedIndex(
+            quantizer=quantizer,
+            rerank_k=rerank_k,
+            full_precision=lambda doc_ids: self.get_embeddings(doc_ids, collection_name),
+            **quantizer_params
+        )
+        index.train(sample)
+        for doc_ids, vectors in self.iter_embeddings(collection_name=collection_name):
+            index.add_batch(doc_ids, vectors)
+        logger.info(f"Loaded {len(index)} embeddings into {quantizer} quantized index ({index.memory_bytes} bytes of codes)")
+        return index
+    
+    def sample_embeddings(self, size: int = 20000, collection_name: str = "documents") -> List[List[float]]:
+        """Uniform sample of stored embeddings sharing the first vector's dimension"""
+        # Reservoir sample so training memory stays bounded for any corpus size
+        sample: List[List[float]] = []
+        seen = 0
+        for _, vectors in self.iter_embeddings(collection_name=collection_name):
+            for vector in vectors:
+                if not vector:
+                    continue
+                seen += 1
+                if len(sample) < size:
+                    sample.append(vector)
+                else:
+                    slot = random.randrange(seen)
+                    if slot < size:
+                        sample[slot] = vector
+        if not sample:
+            return sample
+        dimension = len(sample[0])
+        return [vector for vector in sample if len(vector) == dimension]
+    
+    def _reducer_path(self, method: str, dimension: int, collection_name: str) -> str:
+        directory = self.snapshot_dir(collection_name) or os.path.join(os.getenv("VECTOR_REDUCER_DIR", "indexes"), collection_name)
+        # A reducer fitted in one embedding space is meaningless in another
+        version = hashlib.sha1(get_embedding_service().version.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(directory, f"reducer-{method}-{dimension}-{version}.npz")
+    
+    def build_reduced_index(self, method: str = "truncate", dimension: int = 384, train_size: int = 20000,
+                            collection_name: str = "documents", refit: bool = False) -> Optional[ReducedIndex]:
+        """Reduce every stored embedding of a collection to dimension coordinates
+        
+        A fitted reducer is saved next to the collection's index files and reused
+        on the next load, so query and document projections stay identical across
+        restarts and workers; refit forces a new fit on the current corpus.
+        """
+        path = self._reducer_path(method, dimension, collection_name)
+        reducer = None
+        if not refit and os.path.exists(path):
+            try:
+                reducer = load_reducer(path)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable reducer {path}: {e}")
+        
+        if reducer is None or reducer.kind != method or reducer.dimension != dimension:
+            sample = self.sample_embeddings(train_size if method == "pca" else 1, collection_name)
+            if not sample:
+                logger.warning(f"No embeddings in {collection_name} to fit a {method} reducer on, using exact index")
+                return None
+            if dimension >= len(sample[0]):
+                logger.warning(f"Reduced dimension {dimension} is not below {len(sample[0])}, using exact index")
+                return None
+            index = ReducedIndex(reducer=method, reduced_dimension=dimension)
+            index.train(sample)
+            try:
+                save_reducer(index.reducer, path)
+            except OSError as e:
+                logger.warning(f"Could not save reducer to {path}: {e}")
+        else:
+            index = ReducedIndex(reducer=reducer)
+        
+        for doc_ids, vectors in self.iter_embeddings(collection_name=collection_name):
+            index.add_batch(doc_ids, vectors)
+        logger.info(f"Loaded {len(index)} embeddings into {method} index reduced to {dimension} dimensions "
+                    f"({index.memory_bytes} bytes of vectors)")
+        return index
+    
+    def get_embeddings(self, doc_ids: List[str], collection_name: str = "documents") -> Dict[str, List[float]]:
+        """Get stored vectors for doc_ids in one query"""
+        vectors: Dict[str, List[float]] = {}
+        for batch_ids, batch_vectors in self.iter_embeddings(doc_ids, collection_name=collection_name):
+            vectors.update(zip(batch_ids, batch_vectors))
+        return vectors
+    
+    @staticmethod
+    def _version_query(version: str) -> Dict[str, Any]:
+        """Documents holding a vector of version, live or written next to it by a re-embedding job"""
+        return {"$or": [{"embedding_version": {"$in": [version, None]}}, {"embedding_next_version": version}]}
+    
+    @staticmethod
+    def _vector_of_version(doc: Dict, version: str) -> Optional[List[float]]:
+        if doc.get("embedding_next_version") == version:
+            return doc.get("embedding_next")
+        # Untagged vectors predate versioning; re-embedding jobs tag (re-embed) all of them
+        if doc.get("embedding_version") in (version, None):
+            return doc.get("embedding")
+        return None
+    
+    def iter_embeddings(self, doc_ids: Optional[List[str]] = None, batch_size: int = 1000,
+                        collection_name: str = "documents",
+                        version: Optional[str] = None) -> Iterator[Tuple[List[str], List[List[float]]]]:
+        """Yield the inline embeddings of a collection as (doc_ids, vectors) batches
+
+        Only vectors of version (default: the active embedding version) are
+        yielded, so an index never mixes vectors of two models while a
+        re-embedding job is switching a collection over.
+        """
+        version = version or get_embedding_service().version
+        query: Dict[str, Any] = {"embedding": {"$exists": True}, **self._version_query(version)}
+        if doc_ids is not None:
+            query["doc_id"] = {"$in": list(doc_ids)}
+        fields = {"_id": 0, "doc_id": 1, "embedding": 1, "embedding_version": 1,
+                  "embedding_next": 1, "embedding_next_version": 1}
+        sources = [
+            (self.get_collection(collection_name), query, fields),
+            (self.get_collection(self.parts_collection_name(collection_name)), query, fields)
+        ]
+        if collection_name == "documents":
+            # Rows not moved yet by an online migration still live in the side collection
+            legacy_query = {"doc_id": {"$in": list(doc_ids)}} if doc_ids is not None else {}
+            sources.append((self.embeddings_collection, legacy_query, {"_id": 0, "doc_id": 1, "vector": 1}))
+        
+        batch_ids, batch_vectors = [], []
+        for collection, source_query, projection in sources:
+            cursor = collection.find(source_query, projection, batch_size=batch_size)
+            for doc in cursor:
+                if "doc_id" not in doc:
+                    continue
+                vector = doc.get("vector") if "vector" in projection else self._vector_of_version(doc, version)
+                if vector is None:
+                    continue
+                batch_ids.append(doc["doc_id"])
+                batch_vectors.append(vector)
+                if len(batch_ids) >= batch_size:
+                    yield batch_ids, batch_vectors
+                    batch_ids, batch_vectors = [], []
+        if batch_ids:
+            yield batch_ids, batch_vectors
+    
+    def write_embedding_snapshot(self, path: str, shard_size: int = 65536, collection_name: str = "documents") -> Dict:
+        """Write the embeddings of a collection (active version) as memory-mappable float32 shards"""
+        try:
+            return write_snapshot(path, self.iter_embeddings(collection_name=collection_name), shard_size)
+        except Exception as e:
+            raise Exception(f"Error writing embedding snapshot: {str(e)}")
+    
+    def get_embedding_ids(self, collection_name: str = "documents") -> List[str]:
+        """Get doc_ids of every stored embedding of the active version"""
+        doc_ids = [
+            doc["doc_id"] for doc in self.get_collection(collection_name).find(
+                {"embedding": {"$exists": True}, "doc_id": {"$exists": True},
+                 **self._version_query(get_embedding_service().version)},
+                {"_id": 0, "doc_id": 1}
+            )
+        ]
+        if collection_name == "documents":
+            doc_ids.extend(emb_doc["doc_id"] for emb_doc in self.embeddings_collection.find({}, {"_id": 0, "doc_id": 1}))
+        return doc_ids
+    
+    def migrate_embeddings(self, collection_names: Optional[List[str]] = None, batch_size: int = 500,
+                           on_batch: Optional[Callable[[], None]] = None) -> Dict[str, int]:
+        """Move vectors to the unified inline layout, one bounded batch at a time
+
+        Backfills doc_id (from _id) on documents that lack one and moves rows of
+        the legacy embeddings collection onto their documents. Each batch is
+        written before its legacy rows are deleted, so the migration can run
+        while the API is serving and can be resumed after an interruption.
+        on_batch is called after every batch; an exception from it stops the migration.
+        """
+        try:
+            stats = {"doc_ids_backfilled": 0, "embeddings_moved": 0, "orphaned_embeddings": 0}
+            for collection_name in collection_names or ["documents"]:
+                collection = self.get_collection(collection_name)
+                collection.create_index("doc_id")
+                while True:
+                    missing = list(collection.find({"doc_id": {"$exists": False}}, {"_id": 1}).limit(batch_size))
+                    if not missing:
+                        break
+                    result = collection.bulk_write([
+                        UpdateOne({"_id": doc["_id"], "doc_id": {"$exists": False}}, {"$set": {"doc_id": str(doc["_id"])}})
+                        for doc in missing
+                    ], ordered=False)
+                    stats["doc_ids_backfilled"] += result.modified_count
+                    if on_batch:
+                        on_batch()
             
-            # Sort by similarity
-            similarities.sort(key=lambda x: x["similarity"], reverse=True)
+            while True:
+                legacy = list(self.embeddings_collection.find({}, {"_id": 1, "doc_id": 1, "vector": 1}).limit(batch_size))
+                if not legacy:
+                    break
+                updates = [
+                    UpdateOne(
+                        {"doc_id": emb_doc["doc_id"]},
+                        {"$set": {"embedding": emb_doc["vector"], "embedding_dimension": len(emb_doc["vector"])}}
+                    )
+                    for emb_doc in legacy if emb_doc.get("doc_id") and emb_doc.get("vector")
+                ]
+                if updates:
+                    result = self.documents_collection.bulk_write(updates, ordered=False)
+                    stats["embeddings_moved"] += result.matched_count
+                    stats["orphaned_embeddings"] += len(updates) - result.matched_count
+                self.embeddings_collection.delete_many({"_id": {"$in": [emb_doc["_id"] for emb_doc in legacy]}})
+                logger.info(f"Migrated {stats['embeddings_moved']} embeddings so far")
+                if on_batch:
+                    on_batch()
             
-            # Get top documents
-            top_doc_ids = [item["doc_id"] for item in similarities[:top_k]]
+            return stats
+
+        except Exception as e:
+            raise Exception(f"Error migrating embeddings: {str(e)}")
+    
+    def get_posting_index(self, collection_name: str = "documents") -> PostingIndex:
+        """Get the metadata posting lists of a collection, loading them on first use"""
+        state = self._vector_state(collection_name)
+        if state.postings is None:
+            with state.lock:
+                if state.postings is None:
+                    postings = PostingIndex(FILTER_FIELDS)
+                    projection = {"_id": 0, "doc_id": 1, **{f"metadata.{field}": 1 for field in FILTER_FIELDS}}
+                    query = {"doc_id": {"$exists": True}, "duplicate_of": {"$exists": False}}
+                    for doc in self.get_collection(collection_name).find(query, projection, batch_size=1000):
+                        postings.add(doc["doc_id"], doc.get("metadata"))
+                    state.postings_synced_size = len(state.index) if state.index is not None else 0
+                    state.postings = postings
+        return state.postings
+    
+    def _sync_posting_index(self, vector_index: VectorIndex, collection_name: str = "documents") -> None:
+        """Index metadata of vectors this process has not seen inserted (e.g. from other workers)"""
+        postings = self.get_posting_index(collection_name)
+        state = self._vector_state(collection_name)
+        if len(vector_index) == state.postings_synced_size:
+            return
+        missing = [doc_id for doc_id in vector_index.doc_ids if doc_id not in postings and PART_SEPARATOR not in doc_id]
+        projection = {"_id": 0, "doc_id": 1, **{f"metadata.{field}": 1 for field in FILTER_FIELDS}}
+        collection = self.get_collection(collection_name)
+        for start in range(0, len(missing), 1000):
+            for doc in collection.find({"doc_id": {"$in": missing[start:start + 1000]}}, projection):
+                postings.add(doc["doc_id"], doc.get("metadata"))
+        state.postings_synced_size = len(vector_index)
+    
+    def resolve_filters(self, filters: Dict[str, Any], collection_name: str = "documents") -> Set[str]:
+        """doc_ids whose metadata match every filter field (any accepted value within a field)"""
+        postings = self.get_posting_index(collection_name)
+        indexed = {field: values for field, values in filters.items() if postings.indexes(field)}
+        candidates = postings.match(indexed) if indexed else None
+        for field, values in filters.items():
+            if field in indexed:
+                continue
+            # Fields without posting lists are resolved by MongoDB
+            matched = {
+                doc["doc_id"] for doc in self.get_collection(collection_name).find(
+                    {f"metadata.{field}": {"$in": filter_values(values)}}, {"_id": 0, "doc_id": 1}
+                ) if "doc_id" in doc
+            }
+            candidates = matched if candidates is None else candidates & matched
+        return candidates if candidates is not None else set()
+    
+    def search_by_embedding(self, query_embedding: List[float], top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                            collection_name: str = "documents", query: Optional[str] = None) -> List[Dict]:
+        """Search documents by embedding similarity (cosine similarity over the resident index)
+
+        filters maps metadata fields to accepted values; only matching documents are scored.
+        Near-identical queries are answered from the semantic query cache.
+        """
+        try:
+            active_filters = normalize_filters(filters)
+            return self.cached_search(
+                "vector", query_embedding, top_k, active_filters, collection_name,
+                lambda: self._search_by_embedding(query_embedding, top_k, active_filters, collection_name),
+                query
+            )
+
+        except Exception as e:
+            raise Exception(f"Error searching by embedding: {str(e)}")
+    
+    def _search_by_embedding(self, query_embedding: List[float], top_k: int, active_filters: Dict[str, Any],
+                             collection_name: str) -> List[Dict]:
+        index = self.get_vector_index(collection_name)
+        candidates = None
+        if active_filters:
+            self._sync_posting_index(index, collection_name)
+            candidates = self.resolve_filters(active_filters, collection_name)
+        similarities = self._vector_search(index, [query_embedding], top_k, candidates, collection_name)[0]
+        return self.hydrate_documents(
+            [doc_id for doc_id, _ in similarities],
+            scores=dict(similarities),
+            collection_name=collection_name
+        )
+    
+    def search_by_embeddings(self, query_embeddings: List[List[float]], top_k: int = 5, combine_mode: str = "OR",
+                             filters: Optional[Dict[str, Any]] = None, collection_name: str = "documents") -> List[Dict]:
+        """Search with several query embeddings at once and fuse the rankings on doc_id
+
+        combine_mode is OR (best score), AND (found by every query, mean score)
+        or RRF (reciprocal rank fusion score).
+        """
+        try:
+            if not query_embeddings:
+                return []
+            index = self.get_vector_index(collection_name)
+            candidate_k = top_k if combine_mode.upper() == "OR" else max(top_k, FUSION_CANDIDATES)
+            active_filters = normalize_filters(filters)
+            candidates = None
+            if active_filters:
+                self._sync_posting_index(index, collection_name)
+                candidates = self.resolve_filters(active_filters, collection_name)
+            per_query = self._vector_search(index, query_embeddings, candidate_k, candidates, collection_name)
+            fused = fuse_results(per_query, combine_mode, top_k)
+            return self.hydrate_documents(
+                [doc_id for doc_id, _ in fused],
+                scores=dict(fused),
+                collection_name=collection_name
+            )
+
+        except Exception as e:
+            raise Exception(f"Error searching by embeddings: {str(e)}")
+    
+    def _vector_search(self, index: VectorIndex, queries: List[List[float]], top_k: int,
+                       candidates: Optional[Set[str]] = None,
+                       collection_name: str = "documents") -> List[List[Tuple[str, float]]]:
+        """Rank documents for each query, restricted to candidates, folding part vectors into their documents"""
+        parts = self.get_part_map(collection_name)
+        fetch_k = top_k * PART_OVERFETCH if parts else top_k
+        if candidates is not None:
+            if parts:
+                candidates = candidates | {part_id for doc_id in candidates for part_id in parts.get(doc_id, ())}
+            raw = [index.search_subset(query, candidates, fetch_k) for query in queries]
+        elif len(queries) == 1:
+            raw = [index.search(queries[0], fetch_k)]
+        else:
+            raw = index.search_many(queries, fetch_k)
+        if not parts:
+            return raw
+        return [self._fold_parts(index, query, hits, top_k, parts) for query, hits in zip(queries, raw)]
+    
+    def _fold_parts(self, index: VectorIndex, query: List[float], hits: List[Tuple[str, float]], top_k: int,
+                    parts: Dict[str, List[str]]) -> List[Tuple[str, float]]:
+        """Score each document by its own and its parts' vectors (see MULTI_VECTOR_MODE)"""
+        weighted = MULTI_VECTOR_MODE == "weighted"
+        scored: Dict[str, Dict[str, float]] = {}
+        for doc_id, score in hits:
+            scored.setdefault(self.parent_id(doc_id), {})[doc_id] = score
+        if weighted:
+            # Vectors of a ranked document that fell outside the raw hits still count
+            missing = [
+                member for parent_id, members in scored.items()
+                for member in [parent_id, *parts.get(parent_id, ())] if member not in members
+            ]
+            if missing:
+                for doc_id, score in index.search_subset(query, missing, len(missing)):
+                    scored[self.parent_id(doc_id)][doc_id] = score
+        
+        ranked = []
+        for parent_id, members in scored.items():
+            own = members.get(parent_id)
+            best_part = max((score for doc_id, score in members.items() if doc_id != parent_id), default=None)
+            if weighted and own is not None and best_part is not None:
+                score = MULTI_VECTOR_MAIN_WEIGHT * own + (1 - MULTI_VECTOR_MAIN_WEIGHT) * best_part
+            else:
+                score = max(score for score in (own, best_part) if score is not None)
+            ranked.append((parent_id, score))
+        ranked.sort(key=lambda pair: pair[1], reverse=True)
+        return ranked[:top_k]
+    
+    def hydrate_documents(
+        self,
+        doc_ids: List[str],
+        scores: Optional[Dict[str, float]] = None,
+        collection_name: str = "documents",
+        score_field: str = "similarity"
+    ) -> List[Dict]:
+        """Fetch documents for ranked doc_ids in one $in query, keeping the given order"""
+        try:
+            if not doc_ids:
+                return []
+            
+            collection = self.get_collection(collection_name)
+            cursor = collection.find(
+                {"doc_id": {"$in": list(doc_ids)}},
+                {"_id": 0, "doc_id": 1, "content": 1, "metadata": 1}
+            )
+            docs_by_id = {doc["doc_id"]: doc for doc in cursor}
             
-            # Fetch documents
             documents = []
-            for doc_id in top_doc_ids:
-                doc = self.documents_collection.find_one({"doc_id": doc_id})
-                if doc:
-                    similarity_score = next(item["similarity"] for item in similarities if item["doc_id"] == doc_id)
-                    documents.append({
-                        "doc_id": doc["doc_id"],
-                        "content": doc["content"],
-                        "metadata": doc["metadata"],
-                        "similarity": similarity_score
-                    })
+            for doc_id in doc_ids:
+                doc = docs_by_id.get(doc_id)
+                if doc is None:
+                    continue
+                document = {
+                    "doc_id": doc["doc_id"],
+                    "content": doc.get("content", ""),
+                    "metadata": doc.get("metadata", {})
+                }
+                if scores is not None:
+                    document[score_field] = scores.get(doc_id, 0)
+                documents.append(document)
             
             return documents
 
         except Exception as e:
-            raise Exception(f"Error searching by embedding: {str(e)}")
-    
+            raise Exception(f"Error hydrating documents: {str(e)}")
+
+    def get_document_revisions(self, doc_ids: List[str], collection_name: str = "documents") -> Dict[str, str]:
+        """updated_at of each existing doc_id, as a string, in one $in query"""
+        try:
+            if not doc_ids:
+                return {}
+            cursor = self.get_collection(collection_name).find(
+                {"doc_id": {"$in": list(doc_ids)}},
+                {"_id": 0, "doc_id": 1, "updated_at": 1}
+            )
+            return {doc["doc_id"]: str(doc.get("updated_at", "")) for doc in cursor}
+
+        except Exception as e:
+            raise Exception(f"Error getting document revisions: {str(e)}")
+
     def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
         """Calculate cosine similarity between two vectors"""
         try:
@@ -179,8 +1133,10 @@ class MongoDBManager:
             # Delete document
             doc_result = self.documents_collection.delete_one({"doc_id": doc_id})
             
-            # Delete embedding
+            # Delete a legacy embedding row left over from before migration
             emb_result = self.embeddings_collection.delete_one({"doc_id": doc_id})
+            self.get_collection(self.parts_collection_name("documents")).delete_many({"parent_id": doc_id})
+            self.unindex_document(doc_id)
             
             return doc_result.deleted_count > 0
 
@@ -223,12 +1179,11 @@ class MongoDBManager:
             }
             
             # Add embedding to document if provided
-            if embedding:
-                document["embedding"] = embedding
-                document["embedding_dimension"] = len(embedding)
+            document.update(self.embedding_fields(embedding))
             
             # Insert document
             result = collection.insert_one(document)
+            self.index_document(doc_id, embedding, document["metadata"], collection_name, content)
             
             return doc_id
 
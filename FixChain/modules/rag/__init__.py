@@ -1,8 +1,10 @@
 from .registry import register, create
 from .mongodb import MongoDBRAG
+from .ann import ANNRAG
 
 __all__ = [
     "register",
     "create",
     "MongoDBRAG",
+    "ANNRAG",
 ]
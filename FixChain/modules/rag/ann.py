@@ -0,0 +1,124 @@
+from __future__ import annotations
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+from utils.logger import logger
+from .base import RAG
+from ..embedding import get_embedding_service
+from ..mongodb_service import MongoDBManager
+from ..search import registry as index_registry
+from ..search.base import VectorIndex
+
+
+class ANNRAG(RAG):
+    """RAG implementation backed by an approximate nearest-neighbour index.
+
+    MongoDB remains the source of truth for documents and vectors; the index
+    (HNSW or IVF-Flat) is an on-disk acceleration structure that is
+    reconciled with the stored embeddings whenever it is opened. The index
+    is saved after every save_every writes and after a sync that changed it;
+    it records the embedding version of its vectors and is rebuilt when the
+    stored vectors were re-embedded with another one.
+    """
+
+    VERSION_FILE = "ann.json"
+
+    def __init__(
+        self,
+        manager: Optional[MongoDBManager] = None,
+        index_type: str = "hnsw",
+        index_path: Optional[str] = None,
+        embed_fn: Optional[Callable[[str], List[float]]] = None,
+        save_every: Optional[int] = None,
+        **index_params,
+    ):
+        self.manager = manager or MongoDBManager()
+        self.index_type = index_type
+        self.index_path = index_path or os.path.join(os.getenv("ANN_INDEX_DIR", "indexes"), index_type)
+        self.embed_fn = embed_fn
+        self.save_every = save_every if save_every is not None else int(os.getenv("ANN_SAVE_EVERY", "100"))
+        self.index_params = index_params
+        self.embedding_version: Optional[str] = None
+        self._unsaved = 0
+        self.index = self._open_index()
+        self.sync()
+
+    def _open_index(self) -> VectorIndex:
+        if os.path.exists(os.path.join(self.index_path, "index.json")):
+            try:
+                index = index_registry.get(self.index_type).load(self.index_path)
+                version_path = os.path.join(self.index_path, self.VERSION_FILE)
+                if os.path.exists(version_path):
+                    with open(version_path, "r", encoding="utf-8") as f:
+                        self.embedding_version = json.load(f).get("embedding_version")
+                logger.info(f"Loaded {self.index_type} index with {len(index)} vectors from {self.index_path}")
+                return index
+            except Exception as e:
+                logger.warning(f"Could not load index from {self.index_path}, rebuilding: {e}")
+        return index_registry.create(self.index_type, **self.index_params)
+
+    def sync(self) -> Dict[str, int]:
+        """Reconcile the index with the embeddings stored in MongoDB."""
+        version = get_embedding_service().version
+        if self.embedding_version != version:
+            # Vectors of another model (or dimension) cannot be compared with the stored ones
+            if len(self.index):
+                logger.info(f"Rebuilding {self.index_type} index: vectors are {self.embedding_version}, stored ones {version}")
+            self.index = index_registry.create(self.index_type, **self.index_params)
+            self.embedding_version = version
+
+        stored = set(self.manager.get_embedding_ids())
+        indexed = set(self.index.doc_ids)
+
+        removed = 0
+        for doc_id in indexed - stored:
+            removed += int(self.index.remove(doc_id))
+
+        added = 0
+        missing = list(stored - indexed)
+        for start in range(0, len(missing), 1000):
+            for doc_ids, vectors in self.manager.iter_embeddings(missing[start:start + 1000]):
+                added += self.index.add_batch(doc_ids, vectors)
+
+        if added or removed:
+            logger.info(f"Synced {self.index_type} index: {added} added, {removed} removed")
+            self.save()
+        return {"added": added, "removed": removed}
+
+    def save(self) -> None:
+        """Persist the index files (and the embedding version of its vectors) to index_path."""
+        self.index.save(self.index_path)
+        with open(os.path.join(self.index_path, self.VERSION_FILE), "w", encoding="utf-8") as f:
+            json.dump({"embedding_version": self.embedding_version}, f)
+        self._unsaved = 0
+
+    def _written(self) -> None:
+        # Writes since the last save are re-applied from MongoDB by sync() after a restart
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def add_document(
+        self, content: str, metadata: Dict | None = None, embedding: List[float] | None = None
+    ) -> str:
+        doc_id = self.manager.add_document(content, metadata or {}, embedding)
+        if embedding:
+            self.index.add(doc_id, embedding)
+            self._written()
+        return doc_id
+
+    def delete_document(self, doc_id: str) -> bool:
+        if self.index.remove(doc_id):
+            self._written()
+        return self.manager.delete_document(doc_id)
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        if self.embed_fn is None:
+            raise ValueError("ANNRAG needs an embed_fn to search by text")
+        return self.search_by_embedding(self.embed_fn(query), top_k)
+
+    def search_by_embedding(self, embedding: List[float], top_k: int = 5, **search_params) -> List[Dict]:
+        """Search with optional recall knobs (ef for HNSW, nprobe for IVF)."""
+        hits = self.index.search(embedding, top_k, **search_params)
+        return self.manager.hydrate_documents([doc_id for doc_id, _ in hits], scores=dict(hits))
@@ -18,3 +18,12 @@ class MongoDBRAG(RAG):
 
     def search(self, query: str, top_k: int = 5) -> List[Dict]:
         return self.manager.search_documents(query, top_k)
+
+    def search_by_embedding(self, embedding: List[float], top_k: int = 5) -> List[Dict]:
+        return self.manager.search_by_embedding(embedding, top_k)
+
+    def hybrid_search(self, query: str, embedding: List[float], top_k: int = 5) -> List[Dict]:
+        return self.manager.hybrid_search(query, embedding, top_k)
+
+    def get_documents(self, doc_ids: List[str]) -> List[Dict]:
+        return self.manager.hydrate_documents(doc_ids)
@@ -18,7 +18,9 @@ def create(name: str, *args, **kwargs) -> RAG:
     return _registry[name](*args, **kwargs)
 
 
-# Register built-in implementation
+# Register built-in implementations
 from .mongodb import MongoDBRAG
+from .ann import ANNRAG
 
 register("mongodb", MongoDBRAG)
+register("ann", ANNRAG)
@@ -0,0 +1,419 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from utils.logger import logger
+from modules.embedding import (
+    EmbeddingService,
+    RateLimiter,
+    create_embedding_provider,
+    get_embedding_service,
+    set_embedding_service,
+)
+from modules.mongodb_service import MongoDBManager
+
+# Collections whose stored vectors share the query embedding space
+DEFAULT_COLLECTIONS = ["documents", "bug_rag_documents"]
+
+# A worker owns a job while its lease is fresh; a crashed worker's job is picked up after it expires
+LEASE_SECONDS = int(os.getenv("REEMBED_LEASE_SECONDS", "120"))
+POLL_SECONDS = 60
+
+# Attempts per batch before the job pauses (quota errors back off exponentially)
+MAX_ATTEMPTS = 5
+
+JOBS_COLLECTION = "embedding_jobs"
+VERSIONS_COLLECTION = "embedding_versions"
+
+ACTIVE_STATUSES = ["pending", "running", "switching"]
+# Held (unique) by the one job in an active status, so concurrent starts cannot both succeed
+ACTIVE_SLOT = "active"
+
+# Seconds between passes that re-embed vectors other workers write with the source version until
+# they follow the cut-over (they check every POLL_SECONDS)
+CATCH_UP_SECONDS = 5
+
+_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+_tasks: Set[asyncio.Task] = set()
+# Generation of the active version record whose vectors this worker's indexes were loaded from
+_synced_generation: Optional[str] = None
+
+
+def _jobs(manager: MongoDBManager):
+    return manager.get_collection(JOBS_COLLECTION)
+
+
+def _public(job: Optional[Dict]) -> Optional[Dict[str, Any]]:
+    if job is None:
+        return None
+    job = {key: value for key, value in job.items() if key not in ("_id", "active_slot")}
+    for key, value in job.items():
+        if isinstance(value, datetime):
+            job[key] = value.isoformat()
+    last_id = job["checkpoint"]["last_id"]
+    if isinstance(last_id, ObjectId):
+        job["checkpoint"] = {**job["checkpoint"], "last_id": str(last_id)}
+    return job
+
+
+def get_active_version(manager: MongoDBManager) -> Optional[Dict[str, Any]]:
+    """Provider spec whose vectors queries are embedded against, once a re-embedding job has switched it"""
+    return manager.get_collection(VERSIONS_COLLECTION).find_one({"_id": "active"}, {"_id": 0})
+
+
+def create_target_service(target: Dict[str, Any]) -> EmbeddingService:
+    """Embedding service for a provider spec, sharing the process cache (keys include the model)"""
+    provider = create_embedding_provider(target.get("provider"), target.get("model"), target.get("dimension"))
+    return EmbeddingService(provider, get_embedding_service().cache, target.get("tag"))
+
+
+def sync_active_version(manager: MongoDBManager) -> None:
+    """Embed queries with the version the stored vectors use, even if the environment names another
+
+    Also how workers other than the one running a job follow its cut-over,
+    and reload vectors the job re-embedded after it (a new generation).
+    """
+    global _synced_generation
+    active = get_active_version(manager)
+    if active is None:
+        return
+    generation = active.get("generation")
+    if active["version"] == get_embedding_service().version:
+        if _synced_generation is not None and generation != _synced_generation:
+            for collection_name in active.get("collections", DEFAULT_COLLECTIONS):
+                # The worker that ran the job already rewrote any shared snapshot
+                manager.reload_vector_index(collection_name, rewrite_snapshot=False)
+        _synced_generation = generation
+        return
+    logger.warning(f"Stored vectors are {active['version']} but {get_embedding_service().version} is in use; "
+                   f"switching to {active['version']}")
+    # Vector indexes follow the embedding version on their next use
+    set_embedding_service(create_target_service(active))
+    _synced_generation = generation
+
+
+def _activate(manager: MongoDBManager, job: Dict) -> None:
+    """Publish the job's target as the version every worker embeds queries with and indexes"""
+    global _synced_generation
+    generation = uuid.uuid4().hex
+    manager.get_collection(VERSIONS_COLLECTION).replace_one(
+        {"_id": "active"},
+        {**job["target"], "version": job["target_version"], "collections": job["collections"],
+         "job_id": job["_id"], "generation": generation, "activated_at": datetime.now()},
+        upsert=True
+    )
+    _synced_generation = generation
+
+
+def start_reembed_job(
+    manager: MongoDBManager,
+    target: Dict[str, Any],
+    collections: Optional[List[str]] = None,
+    batch_size: int = 100,
+    requests_per_minute: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Record a job re-embedding every stored vector of collections with target
+
+    target holds provider, model, dimension and tag (see create_embedding_provider).
+    The job runs in whichever worker claims it (see resume_reembed_jobs).
+    """
+    try:
+        version = create_target_service(target).version
+        _jobs(manager).create_index("active_slot", unique=True, sparse=True)
+        job_id = uuid.uuid4().hex
+        job = {
+            "_id": job_id,
+            "job_id": job_id,
+            "source_version": get_embedding_service().version,
+            "target_version": version,
+            "target": target,
+            "collections": collections or DEFAULT_COLLECTIONS,
+            "batch_size": batch_size,
+            "requests_per_minute": requests_per_minute,
+            "status": "pending",
+            "active_slot": ACTIVE_SLOT,
+            # Resume point: last _id done in the collection being processed
+            "checkpoint": {"collection": None, "last_id": None},
+            "processed": 0,
+            "switched": 0,
+            "error": None,
+            "lease_owner": None,
+            "lease_until": datetime.now(),
+            "created_at": datetime.now(),
+            "updated_at": datetime.now(),
+            "finished_at": None,
+        }
+        try:
+            _jobs(manager).insert_one(job)
+        except DuplicateKeyError:
+            raise ValueError("Another re-embedding job is still running")
+        logger.info(f"Re-embedding job {job['job_id']}: {job['source_version']} -> {version} over {job['collections']}")
+        return _public(job)
+
+    except ValueError:
+        raise
+    except Exception as e:
+        raise Exception(f"Error starting re-embedding job: {str(e)}")
+
+
+def get_reembed_job(manager: MongoDBManager, job_id: str) -> Optional[Dict[str, Any]]:
+    return _public(_jobs(manager).find_one({"_id": job_id}))
+
+
+def resume_reembed_job(manager: MongoDBManager, job_id: str) -> Optional[Dict[str, Any]]:
+    """Make a paused or failed job claimable again; it continues from its checkpoint"""
+    try:
+        job = _jobs(manager).find_one_and_update(
+            {"_id": job_id, "status": {"$in": ["paused", "failed"]}},
+            {"$set": {"status": "pending", "active_slot": ACTIVE_SLOT, "error": None,
+                      "lease_until": datetime.now(), "updated_at": datetime.now()}},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise ValueError("Another re-embedding job is still running")
+    return _public(job)
+
+
+def _claim(manager: MongoDBManager, job_id: Optional[str] = None) -> Optional[Dict]:
+    now = datetime.now()
+    query: Dict[str, Any] = {"status": {"$in": ACTIVE_STATUSES}, "lease_until": {"$lte": now}}
+    if job_id:
+        query["_id"] = job_id
+    return _jobs(manager).find_one_and_update(
+        query,
+        {"$set": {"lease_owner": _worker_id, "lease_until": now + timedelta(seconds=LEASE_SECONDS),
+                  "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _renew(manager: MongoDBManager, job_id: str, update: Dict[str, Any]) -> None:
+    """Write progress and extend the lease; raises if another worker took the job over"""
+    now = datetime.now()
+    update = {**update, "$set": {**update.get("$set", {}), "lease_until": now + timedelta(seconds=LEASE_SECONDS),
+                                  "updated_at": now}}
+    result = _jobs(manager).update_one({"_id": job_id, "lease_owner": _worker_id}, update)
+    if result.matched_count == 0:
+        raise RuntimeError(f"Lost the lease on re-embedding job {job_id}")
+
+
+async def _sleep(manager: MongoDBManager, job_id: str, seconds: float) -> None:
+    """Wait without letting the lease expire: it is renewed at least every third of LEASE_SECONDS"""
+    until = time.monotonic() + seconds
+    while True:
+        _renew(manager, job_id, {})
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, LEASE_SECONDS / 3))
+
+
+async def _embed_with_retry(manager: MongoDBManager, job_id: str, service: EmbeddingService, texts: List[str],
+                            limiter: Optional[RateLimiter]) -> List[List[float]]:
+    delay = 2.0
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        while limiter is not None:
+            wait = limiter.reserve()
+            if wait <= 0:
+                break
+            await _sleep(manager, job_id, wait)
+        try:
+            return await asyncio.to_thread(service.embed_many, texts, "retrieval_document")
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            logger.warning(f"Re-embedding batch failed (attempt {attempt}/{MAX_ATTEMPTS}), retrying in {delay:.0f}s: {e}")
+            await _sleep(manager, job_id, delay)
+            delay *= 2
+
+
+async def _reembed_collection(manager: MongoDBManager, job: Dict, collection_name: str,
+                              service: EmbeddingService, limiter: Optional[RateLimiter]) -> int:
+    """Write target vectors next to the live ones, batch by batch, checkpointing after each
+
+    Returns the number of vectors written.
+    """
+    collection = manager.get_collection(collection_name)
+    target_version = job["target_version"]
+    checkpoint = job["checkpoint"]
+    last_id = checkpoint["last_id"] if checkpoint["collection"] == collection_name else None
+    batch_size = max(1, min(job["batch_size"], service.provider.max_batch_size))
+    written = 0
+    while True:
+        query: Dict[str, Any] = {
+            "embedding": {"$exists": True, "$ne": None},
+            "embedding_version": {"$ne": target_version},
+            "embedding_next_version": {"$ne": target_version},
+        }
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(collection.find(query, {"_id": 1, "content": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return written
+        vectors = await _embed_with_retry(manager, job["_id"], service, [doc.get("content") or "" for doc in batch], limiter)
+        # Matching on content skips documents edited meanwhile; their new vector is re-embedded later
+        await asyncio.to_thread(collection.bulk_write, [
+            UpdateOne({"_id": doc["_id"], "content": doc.get("content")},
+                      {"$set": {"embedding_next": vector, "embedding_next_version": target_version}})
+            for doc, vector in zip(batch, vectors)
+        ], ordered=False)
+        last_id = batch[-1]["_id"]
+        written += len(batch)
+        _renew(manager, job["_id"], {
+            "$set": {"checkpoint": {"collection": collection_name, "last_id": last_id}},
+            "$inc": {"processed": len(batch)}
+        })
+
+
+def _switch_collection(manager: MongoDBManager, job: Dict, collection_name: str, batch_size: int = 500) -> int:
+    """Promote the target vectors of a collection to the live embedding field
+
+    Runs after the cut-over: indexes already read target vectors from either
+    field (see MongoDBManager.iter_embeddings), so searches never see a mix.
+    """
+    collection = manager.get_collection(collection_name)
+    switched = 0
+    while True:
+        batch = list(collection.find(
+            {"embedding_next_version": job["target_version"]}, {"_id": 1, "embedding_next": 1}
+        ).limit(batch_size))
+        if not batch:
+            return switched
+        collection.bulk_write([
+            UpdateOne({"_id": doc["_id"]}, {
+                "$set": manager.embedding_fields(doc["embedding_next"], job["target_version"]),
+                "$unset": {"embedding_next": "", "embedding_next_version": ""}
+            })
+            for doc in batch
+        ], ordered=False)
+        switched += len(batch)
+        _renew(manager, job["_id"], {"$inc": {"switched": len(batch)}})
+
+
+def _stored_collections(manager: MongoDBManager, collections: List[str]) -> List[str]:
+    """Collections holding the vectors of collections: each one and its part vectors"""
+    return [name for collection_name in collections
+            for name in (collection_name, manager.parts_collection_name(collection_name))]
+
+
+async def _catch_up(manager: MongoDBManager, job: Dict, collections: List[str],
+                    service: EmbeddingService, limiter: Optional[RateLimiter]) -> int:
+    """Re-embed vectors written on another version since the collections were scanned, until none are left"""
+    total = 0
+    while True:
+        written = 0
+        for collection_name in collections:
+            written += await _reembed_collection(
+                manager, {**job, "checkpoint": {"collection": None, "last_id": None}}, collection_name, service, limiter
+            )
+        if not written:
+            return total
+        total += written
+
+
+async def run_reembed_job(manager: MongoDBManager, job: Dict) -> None:
+    """Run a claimed job to completion, or pause it at its checkpoint on error
+
+    Queries keep using the live vectors (and the source model) while target
+    vectors are written alongside them. At the cut-over the target becomes
+    the active version: every worker then embeds queries with it and indexes
+    only target vectors. Target vectors are promoted to the live field
+    afterwards, and vectors other workers still write with the source
+    version until they follow the cut-over are re-embedded as they appear.
+    """
+    job_id = job["_id"]
+    try:
+        service = create_target_service(job["target"])
+        limiter = RateLimiter(job["requests_per_minute"]) if job.get("requests_per_minute") else None
+        collections = _stored_collections(manager, job["collections"])
+        if job["status"] != "switching":
+            _renew(manager, job_id, {"$set": {"status": "running"}})
+            if "documents" in job["collections"]:
+                # Vectors left in the legacy side collection cannot be re-embedded in place
+                await asyncio.to_thread(manager.migrate_embeddings, ["documents"],
+                                        on_batch=lambda: _renew(manager, job_id, {}))
+            resume_from = job["checkpoint"]["collection"]
+            start = collections.index(resume_from) if resume_from in collections else 0
+            for collection_name in collections[start:]:
+                await _reembed_collection(manager, job, collection_name, service, limiter)
+                logger.info(f"Re-embedding job {job_id}: {collection_name} ready")
+            await _catch_up(manager, job, collections, service, limiter)
+            job["switching_at"] = datetime.now()
+            _renew(manager, job_id, {"$set": {"status": "switching", "switching_at": job["switching_at"]}})
+
+        # Cut-over (repeated if a resumed job crashed in it); other workers follow via sync_active_version
+        set_embedding_service(service)
+        _activate(manager, job)
+        for collection_name in job["collections"]:
+            await asyncio.to_thread(manager.reload_vector_index, collection_name)
+            _renew(manager, job_id, {})
+        for collection_name in collections:
+            await asyncio.to_thread(_switch_collection, manager, job, collection_name)
+
+        # Workers still on the source version write source vectors until their next check
+        caught_up = 0
+        deadline = job.get("switching_at", datetime.now()) + timedelta(seconds=POLL_SECONDS + CATCH_UP_SECONDS)
+        while True:
+            written = await _catch_up(manager, job, collections, service, limiter)
+            for collection_name in collections:
+                await asyncio.to_thread(_switch_collection, manager, job, collection_name)
+            caught_up += written
+            if not written and datetime.now() >= deadline:
+                break
+            await _sleep(manager, job_id, CATCH_UP_SECONDS)
+        if caught_up:
+            # Indexes loaded at the cut-over lack these vectors; a new generation makes every worker reload
+            _activate(manager, job)
+            for collection_name in job["collections"]:
+                await asyncio.to_thread(manager.reload_vector_index, collection_name)
+                _renew(manager, job_id, {})
+
+        remaining = sum(
+            count for collection_name in job["collections"]
+            for version, count in manager.count_embedding_versions(collection_name).items()
+            if version != job["target_version"]
+        )
+        _renew(manager, job_id, {"$set": {"status": "completed", "remaining": remaining, "caught_up": caught_up,
+                                          "finished_at": datetime.now(), "lease_until": datetime.now()},
+                                 "$unset": {"active_slot": ""}})
+        logger.info(f"Re-embedding job {job_id} completed: queries now use {job['target_version']}"
+                    f"{f', {remaining} vectors left on other versions' if remaining else ''}")
+
+    except Exception as e:
+        logger.error(f"Re-embedding job {job_id} paused: {e}")
+        _jobs(manager).update_one(
+            {"_id": job_id, "lease_owner": _worker_id},
+            {"$set": {"status": "paused", "error": str(e), "lease_until": datetime.now(), "updated_at": datetime.now()},
+             "$unset": {"active_slot": ""}}
+        )
+
+
+def resume_reembed_jobs(manager: MongoDBManager) -> None:
+    """Claim jobs left without a live worker (pending, or crashed mid-run) and run them in the background"""
+    while True:
+        job = _claim(manager)
+        if job is None:
+            return
+        logger.info(f"Resuming re-embedding job {job['_id']} from {job['checkpoint']}")
+        task = asyncio.create_task(run_reembed_job(manager, job))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+async def watch_reembed_jobs(manager: MongoDBManager, interval: float = POLL_SECONDS) -> None:
+    """Periodically follow cut-overs and pick up new or orphaned jobs; run once per worker"""
+    while True:
+        try:
+            sync_active_version(manager)
+            resume_reembed_jobs(manager)
+        except Exception as e:
+            logger.error(f"Error checking re-embedding jobs: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,43 @@
+from .registry import register, create
+from .base import VectorIndex
+from .flat import FlatIndex
+from .hnsw import HNSWIndex
+from .ivf import IVFFlatIndex
+from .quantization import QuantizedIndex, ScalarQuantizer, ProductQuantizer
+from .postings import PostingIndex, normalize_filters
+from .fusion import fuse_results, FUSION_MODES
+from .bm25 import BM25Index, tokenize
+from .snapshot import MappedIndex, write_snapshot, read_manifest
+from .reduction import ReducedIndex, PCAReducer, TruncationReducer, load_reducer, save_reducer
+from .dedup import DuplicateIndex, MinHasher, content_hash
+from .query_cache import SemanticQueryCache
+
+__all__ = [
+    "register",
+    "create",
+    "VectorIndex",
+    "FlatIndex",
+    "HNSWIndex",
+    "IVFFlatIndex",
+    "QuantizedIndex",
+    "ScalarQuantizer",
+    "ProductQuantizer",
+    "PostingIndex",
+    "normalize_filters",
+    "fuse_results",
+    "FUSION_MODES",
+    "BM25Index",
+    "tokenize",
+    "MappedIndex",
+    "write_snapshot",
+    "read_manifest",
+    "ReducedIndex",
+    "PCAReducer",
+    "TruncationReducer",
+    "load_reducer",
+    "save_reducer",
+    "DuplicateIndex",
+    "MinHasher",
+    "content_hash",
+    "SemanticQueryCache",
+]
@@ -0,0 +1,277 @@
+from __future__ import annotations
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.logger import logger
+
+
+class VectorIndex(ABC):
+    """Base interface for in-memory cosine-similarity indexes.
+
+    Handles vector storage shared by every implementation: unit-normalized
+    rows in one contiguous matrix, a doc_id array, a doc_id -> row map and a
+    tombstone mask for removed rows. Subclasses only decide how to search.
+    """
+
+    kind = "base"
+
+    def __init__(self, dimension: Optional[int] = None, dtype=np.float32, initial_capacity: int = 1024):
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.RLock()
+        self._capacity = max(int(initial_capacity), 1)
+        self._vectors: Optional[np.ndarray] = None
+        self._doc_ids = np.empty(self._capacity, dtype=object)
+        self._live = np.zeros(self._capacity, dtype=bool)
+        self._rows: Dict[str, int] = {}
+        self._size = 0
+        if dimension:
+            self._vectors = np.zeros((self._capacity, dimension), dtype=self.dtype)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._rows
+
+    @property
+    def doc_ids(self) -> List[str]:
+        """Live document ids in row order."""
+        with self._lock:
+            return [str(doc_id) for doc_id in self._doc_ids[:self._size][self._live[:self._size]]]
+
+    def params(self) -> Dict[str, Any]:
+        """Constructor parameters persisted alongside the index."""
+        return {}
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float64)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        # Zero vectors stay zero so they score 0, like cosine_similarity did
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(self.dtype)
+
+    def _ensure_capacity(self, needed: int) -> None:
+        if self._vectors is not None and needed <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        vectors = np.zeros((capacity, self.dimension), dtype=self.dtype)
+        doc_ids = np.empty(capacity, dtype=object)
+        live = np.zeros(capacity, dtype=bool)
+        if self._vectors is not None:
+            vectors[:self._size] = self._vectors[:self._size]
+            doc_ids[:self._size] = self._doc_ids[:self._size]
+            live[:self._size] = self._live[:self._size]
+        self._vectors, self._doc_ids, self._live = vectors, doc_ids, live
+        self._capacity = capacity
+
+    def _validate(self, doc_ids: Sequence[str], vectors: Iterable[Sequence[float]]) -> Tuple[List[str], List[Sequence[float]]]:
+        ids: List[str] = []
+        rows: List[Sequence[float]] = []
+        for doc_id, vector in zip(doc_ids, vectors):
+            if vector is None or len(vector) == 0:
+                continue
+            if self.dimension is None:
+                self.dimension = len(vector)
+            if len(vector) != self.dimension:
+                logger.warning(
+                    f"Skipping vector for {doc_id}: dimension {len(vector)} != index dimension {self.dimension}"
+                )
+                continue
+            ids.append(doc_id)
+            rows.append(vector)
+        if len(set(ids)) != len(ids):
+            # Last write wins for ids repeated within one batch
+            latest = {doc_id: position for position, doc_id in enumerate(ids)}
+            ids = [ids[position] for position in sorted(latest.values())]
+            rows = [rows[position] for position in sorted(latest.values())]
+        return ids, rows
+
+    def _check_query(self, query: Sequence[float]) -> np.ndarray:
+        if len(query) != self.dimension:
+            raise ValueError(f"Query dimension {len(query)} does not match index dimension {self.dimension}")
+        return self._normalize(np.asarray(query, dtype=np.float64))
+
+    def _check_queries(self, queries: Sequence[Sequence[float]]) -> np.ndarray:
+        """Normalize a batch of queries into a (num_queries, dimension) matrix."""
+        for query in queries:
+            if len(query) != self.dimension:
+                raise ValueError(f"Query dimension {len(query)} does not match index dimension {self.dimension}")
+        return self._normalize(np.asarray(queries, dtype=np.float64).reshape(len(queries), -1))
+
+    def add(self, doc_id: str, vector: Sequence[float]) -> bool:
+        """Add or replace a single vector. Returns False if it was skipped."""
+        return self.add_batch([doc_id], [vector]) == 1
+
+    def add_batch(self, doc_ids: Sequence[str], vectors: Iterable[Sequence[float]]) -> int:
+        """Add or replace vectors in bulk and return how many were indexed."""
+        ids, rows = self._validate(doc_ids, vectors)
+        if not ids:
+            return 0
+
+        normalized = self._normalize(np.asarray(rows, dtype=np.float64))
+        with self._lock:
+            for doc_id in ids:
+                self._remove_locked(doc_id)
+            start = self._size
+            self._ensure_capacity(start + len(ids))
+            self._vectors[start:start + len(ids)] = normalized
+            self._doc_ids[start:start + len(ids)] = ids
+            self._live[start:start + len(ids)] = True
+            for offset, doc_id in enumerate(ids):
+                self._rows[doc_id] = start + offset
+            self._size += len(ids)
+            self._on_added(np.arange(start, start + len(ids)))
+        return len(ids)
+
+    def remove(self, doc_id: str) -> bool:
+        """Remove a vector by document id."""
+        with self._lock:
+            removed = self._remove_locked(doc_id)
+            if removed and self._size - len(self._rows) > max(len(self._rows), 1024):
+                self._compact()
+            return removed
+
+    def _remove_locked(self, doc_id: str) -> bool:
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+            return False
+        self._live[row] = False
+        return True
+
+    def _on_added(self, rows: np.ndarray) -> None:
+        """Hook for subclasses to index freshly appended rows."""
+
+    def _compact(self) -> np.ndarray:
+        """Drop tombstoned rows, keeping row order. Returns the surviving old rows."""
+        keep = np.flatnonzero(self._live[:self._size])
+        count = len(keep)
+        self._vectors[:count] = self._vectors[keep]
+        self._doc_ids[:count] = self._doc_ids[keep]
+        self._doc_ids[count:self._size] = None
+        self._live[:count] = True
+        self._live[count:self._size] = False
+        self._size = count
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._doc_ids[:count])}
+        return keep
+
+    def clear(self) -> None:
+        """Drop every vector but keep the allocated buffers."""
+        with self._lock:
+            self._doc_ids[:self._size] = None
+            self._live[:self._size] = False
+            self._rows.clear()
+            self._size = 0
+
+    @abstractmethod
+    def search(self, query: Sequence[float], top_k: int = 5) -> List[Tuple[str, float]]:
+        """Return (doc_id, cosine similarity) pairs, best first."""
+        raise NotImplementedError
+
+    def search_many(self, queries: Sequence[Sequence[float]], top_k: int = 5) -> List[List[Tuple[str, float]]]:
+        """Search several queries at once; one result list per query."""
+        return [self.search(query, top_k) for query in queries]
+
+    def _rows_for(self, doc_ids: Iterable[str]) -> np.ndarray:
+        """Sorted storage rows of the live doc_ids among doc_ids."""
+        rows = np.fromiter((self._rows[doc_id] for doc_id in doc_ids if doc_id in self._rows), dtype=np.int64)
+        rows.sort()
+        return rows
+
+    def _scores_for_rows(self, rows: np.ndarray, q: np.ndarray) -> np.ndarray:
+        return self._vectors[rows] @ q
+
+    def search_subset(self, query: Sequence[float], doc_ids: Iterable[str], top_k: int = 5) -> List[Tuple[str, float]]:
+        """Exact search restricted to doc_ids; only the surviving rows are scored."""
+        if top_k <= 0:
+            return []
+        with self._lock:
+            rows = self._rows_for(doc_ids)
+            if len(rows) == 0:
+                return []
+            q = self._check_query(query)
+            scores = self._scores_for_rows(rows, q)
+            order = self._top_rows(scores, min(top_k, len(rows)))
+            return [(str(self._doc_ids[rows[i]]), float(scores[i])) for i in order]
+
+    @staticmethod
+    def _top_rows(scores: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the top-k scores, ties broken by position."""
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(scores):
+            kth = scores[np.argpartition(-scores, k - 1)[:k]].min()
+            # Keep every position tied with the k-th score so the tie-break is exact
+            candidates = np.flatnonzero(scores >= kth)
+        else:
+            candidates = np.arange(len(scores))
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return order[:k]
+
+    # Persistence
+
+    def _extra_arrays(self) -> Dict[str, np.ndarray]:
+        """Structure arrays a subclass needs to persist."""
+        return {}
+
+    def _restore_extra(self, arrays: Dict[str, np.ndarray]) -> None:
+        """Rebuild subclass structures from persisted arrays."""
+
+    def save(self, path: str) -> None:
+        """Persist the index into a directory."""
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            size = self._size
+            dimension = self.dimension or 0
+            vectors = self._vectors[:size] if self._vectors is not None else np.zeros((0, dimension), dtype=self.dtype)
+            np.save(os.path.join(path, "vectors.npy"), vectors)
+            np.save(os.path.join(path, "live.npy"), self._live[:size])
+            with open(os.path.join(path, "doc_ids.json"), "w", encoding="utf-8") as f:
+                json.dump([None if doc_id is None else str(doc_id) for doc_id in self._doc_ids[:size]], f)
+            np.savez(os.path.join(path, "structure.npz"), **self._extra_arrays())
+            with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "kind": self.kind,
+                    "dimension": self.dimension,
+                    "dtype": self.dtype.name,
+                    "size": size,
+                    "params": self.params()
+                }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """Load an index previously written by save()."""
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if cls.kind not in ("base", info["kind"]):
+            raise ValueError(f"Index at {path} is '{info['kind']}', not '{cls.kind}'")
+        if cls.kind == "base":
+            from .registry import get
+            cls = get(info["kind"])
+
+        vectors = np.load(os.path.join(path, "vectors.npy"))
+        live = np.load(os.path.join(path, "live.npy"))
+        with open(os.path.join(path, "doc_ids.json"), "r", encoding="utf-8") as f:
+            doc_ids = json.load(f)
+
+        index = cls(dimension=info["dimension"], dtype=info["dtype"],
+                    initial_capacity=max(len(doc_ids), 1), **info.get("params", {}))
+        with index._lock:
+            size = len(doc_ids)
+            if size:
+                index._ensure_capacity(size)
+                index._vectors[:size] = vectors
+                index._doc_ids[:size] = doc_ids
+                index._live[:size] = live
+                index._rows = {doc_id: row for row, doc_id in enumerate(doc_ids) if live[row]}
+            index._size = size
+            with np.load(os.path.join(path, "structure.npz")) as structure:
+                index._restore_extra({name: structure[name] for name in structure.files})
+        return index
@@ -0,0 +1,101 @@
+from __future__ import annotations
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens (unicode aware, so accented text splits on words)."""
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class BM25Index:
+    """In-process Okapi BM25 inverted index.
+
+    Postings map each term to {doc_id: term frequency}, so a query only
+    touches the documents containing its terms. Documents can be added,
+    replaced and removed incrementally; collection statistics (document
+    count, average length) are maintained as running totals.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._terms: Dict[str, Counter] = {}
+        self._lengths: Dict[str, int] = {}
+        self._order: Dict[str, int] = {}
+        self._total_length = 0
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._lengths
+
+    @property
+    def doc_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._lengths)
+
+    def add(self, doc_id: str, text: str) -> None:
+        """Index (or re-index) the text of one document."""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self.remove(doc_id)
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._terms[doc_id] = terms
+            length = sum(terms.values())
+            self._lengths[doc_id] = length
+            self._total_length += length
+            self._order[doc_id] = self._next
+            self._next += 1
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            terms = self._terms.pop(doc_id, None)
+            if terms is None:
+                return False
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[term]
+            self._total_length -= self._lengths.pop(doc_id)
+            self._order.pop(doc_id, None)
+            return True
+
+    def search(self, query: str, top_k: int = 5, doc_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Return (doc_id, BM25 score) pairs, best first; ties keep indexing order.
+
+        doc_ids optionally restricts scoring to a candidate set (e.g. a metadata filter).
+        """
+        if top_k <= 0:
+            return []
+        allowed = set(doc_ids) if doc_ids is not None else None
+        with self._lock:
+            count = len(self._lengths)
+            if count == 0:
+                return []
+            avg_length = self._total_length / count or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    if allowed is not None and doc_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self._order[item[0]]))
+            return ranked[:top_k]
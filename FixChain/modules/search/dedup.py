@@ -0,0 +1,163 @@
+from __future__ import annotations
+import hashlib
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .bm25 import tokenize
+
+_HASH_MAX = np.uint32(0xFFFFFFFF)
+
+
+def content_hash(text: str) -> str:
+    """sha256 of the text with whitespace runs collapsed, for exact duplicates."""
+    return hashlib.sha256(" ".join((text or "").split()).encode("utf-8")).hexdigest()
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) whose LSH collision threshold (1/b)^(1/r) is closest below threshold.
+
+    Erring low favours recall; candidates are verified against the threshold
+    with their full signatures anyway.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    """MinHash signatures over word shingles, using multiply-shift hash permutations."""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> Set[str]:
+        tokens = tokenize(text)
+        if len(tokens) <= self.shingle_size:
+            return {" ".join(tokens)} if tokens else set()
+        return {" ".join(tokens[i:i + self.shingle_size]) for i in range(len(tokens) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self.shingles(text)
+        if not shingles:
+            return np.full(self.num_perm, _HASH_MAX, dtype=np.uint32)
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+        with np.errstate(over="ignore"):
+            mixed = (hashes[:, None] * self._a[None, :] + self._b[None, :]) >> np.uint64(32)
+        return mixed.min(axis=0).astype(np.uint32)
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """Estimated Jaccard similarity: fraction of agreeing signature slots."""
+        return float(np.mean(first == second))
+
+
+class DuplicateIndex:
+    """Exact and near-duplicate lookup of document texts.
+
+    Exact duplicates are found by content hash. Near duplicates go through
+    MinHash LSH: signatures are split into bands, documents sharing any band
+    become candidates, and a candidate matches when its estimated Jaccard
+    similarity reaches threshold. A threshold of 1.0 disables the near
+    duplicate stage.
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128, shingle_size: int = 3):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = lsh_bands(num_perm, threshold) if threshold < 1.0 else (0, 0)
+        self._lock = threading.RLock()
+        self._exact: Dict[str, str] = {}
+        self._hashes: Dict[str, str] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._hashes
+
+    def fingerprint(self, text: str) -> Tuple[str, Optional[np.ndarray]]:
+        """Content hash and (when near duplicates are enabled) MinHash signature of a text."""
+        return content_hash(text), self.hasher.signature(text) if self.bands else None
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, doc_id: str, text: Optional[str] = None, fingerprint: Optional[Tuple[str, Optional[np.ndarray]]] = None) -> None:
+        """Register a canonical document by its text or precomputed fingerprint."""
+        digest, signature = fingerprint or self.fingerprint(text)
+        if self.bands and (signature is None or len(signature) != self.hasher.num_perm):
+            signature = self.hasher.signature(text) if text is not None else None
+        with self._lock:
+            self.remove(doc_id)
+            self._hashes[doc_id] = digest
+            self._exact.setdefault(digest, doc_id)
+            if self.bands and signature is not None:
+                self._signatures[doc_id] = signature
+                for buckets, key in zip(self._buckets, self._band_keys(signature)):
+                    buckets.setdefault(key, set()).add(doc_id)
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            digest = self._hashes.pop(doc_id, None)
+            if digest is None:
+                return
+            if self._exact.get(digest) == doc_id:
+                del self._exact[digest]
+                # Another document with the same text becomes the canonical one
+                for other_id, other_digest in self._hashes.items():
+                    if other_digest == digest:
+                        self._exact[digest] = other_id
+                        break
+            signature = self._signatures.pop(doc_id, None)
+            if signature is not None:
+                for buckets, key in zip(self._buckets, self._band_keys(signature)):
+                    members = buckets.get(key)
+                    if members is not None:
+                        members.discard(doc_id)
+                        if not members:
+                            del buckets[key]
+
+    def find(self, text: str, fingerprint: Optional[Tuple[str, Optional[np.ndarray]]] = None) -> Optional[Tuple[str, float]]:
+        """(canonical doc_id, similarity) of the best duplicate of text, or None."""
+        digest, signature = fingerprint or self.fingerprint(text)
+        with self._lock:
+            exact = self._exact.get(digest)
+            if exact is not None:
+                return exact, 1.0
+            if not self.bands or signature is None:
+                return None
+            candidates: Set[str] = set()
+            for buckets, key in zip(self._buckets, self._band_keys(signature)):
+                candidates |= buckets.get(key, set())
+            best: Optional[Tuple[str, float]] = None
+            for doc_id in candidates:
+                score = MinHasher.similarity(signature, self._signatures[doc_id])
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (doc_id, score)
+            return best
+
+    def find_or_add(self, doc_id: str, text: str) -> Tuple[Optional[Tuple[str, float]], Tuple[str, Optional[np.ndarray]]]:
+        """Atomically look up text and register it under doc_id when it is new.
+
+        Returns the match (None when doc_id became canonical) and the fingerprint.
+        """
+        fingerprint = self.fingerprint(text)
+        with self._lock:
+            match = self.find(text, fingerprint)
+            if match is None:
+                self.add(doc_id, text, fingerprint)
+            return match, fingerprint
@@ -0,0 +1,50 @@
+from __future__ import annotations
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from .base import VectorIndex
+
+
+class FlatIndex(VectorIndex):
+    """Exact cosine-similarity index kept resident in memory.
+
+    Vectors are stored unit-normalized in one contiguous float32 matrix, so a
+    query is a single matrix-vector product followed by an argpartition.
+    Deleted rows are tombstoned and compacted lazily to keep insertion order,
+    which is also the tie-break order of the previous stable Python sort.
+    """
+
+    kind = "flat"
+
+    def search(self, query: Sequence[float], top_k: int = 5) -> List[Tuple[str, float]]:
+        """Return (doc_id, cosine similarity) pairs, best first."""
+        if top_k <= 0:
+            return []
+        with self._lock:
+            if not self._rows:
+                return []
+            q = self._check_query(query)
+            scores = self._vectors[:self._size] @ q
+            if len(self._rows) != self._size:
+                scores[~self._live[:self._size]] = -np.inf
+
+            order = self._top_rows(scores, min(top_k, len(self._rows)))
+            return [(str(self._doc_ids[row]), float(scores[row])) for row in order]
+
+    def search_many(self, queries: Sequence[Sequence[float]], top_k: int = 5) -> List[List[Tuple[str, float]]]:
+        """Score every query with one matrix-matrix product."""
+        if top_k <= 0 or len(queries) == 0:
+            return [[] for _ in queries]
+        with self._lock:
+            if not self._rows:
+                return [[] for _ in queries]
+            scores = self._check_queries(queries) @ self._vectors[:self._size].T
+            if len(self._rows) != self._size:
+                scores[:, ~self._live[:self._size]] = -np.inf
+
+            k = min(top_k, len(self._rows))
+            return [
+                [(str(self._doc_ids[row]), float(row_scores[row])) for row in self._top_rows(row_scores, k)]
+                for row_scores in scores
+            ]
@@ -0,0 +1,42 @@
+from __future__ import annotations
+from typing import Dict, List, Sequence, Tuple
+
+FUSION_MODES = ("OR", "AND", "RRF")
+
+
+def fuse_results(
+    result_lists: Sequence[Sequence[Tuple[str, float]]],
+    mode: str = "OR",
+    top_k: int = 5,
+    rrf_k: int = 60,
+) -> List[Tuple[str, float]]:
+    """Merge per-query (doc_id, score) lists into one ranking keyed on doc_id.
+
+    OR keeps every document with its best score, AND keeps documents found by
+    every query with their mean score, and RRF ranks by reciprocal rank fusion
+    (sum of 1 / (rrf_k + rank)). Ties keep first-seen order.
+    """
+    mode = mode.upper()
+    if mode not in FUSION_MODES:
+        raise ValueError(f"Unknown combine mode '{mode}', expected one of {FUSION_MODES}")
+    if top_k <= 0 or not result_lists:
+        return []
+
+    fused: Dict[str, float] = {}
+    hits: Dict[str, int] = {}
+    for results in result_lists:
+        for rank, (doc_id, score) in enumerate(results, start=1):
+            if mode == "RRF":
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+            elif mode == "AND":
+                fused[doc_id] = fused.get(doc_id, 0.0) + score
+            else:
+                fused[doc_id] = max(fused.get(doc_id, score), score)
+            hits[doc_id] = hits.get(doc_id, 0) + 1
+
+    if mode == "AND":
+        fused = {doc_id: total / len(result_lists)
+                 for doc_id, total in fused.items() if hits[doc_id] == len(result_lists)}
+
+    # sorted() is stable, so equal scores stay in first-seen order
+    return sorted(fused.items(), key=lambda item: -item[1])[:top_k]
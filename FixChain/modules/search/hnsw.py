@@ -0,0 +1,219 @@
+from __future__ import annotations
+import heapq
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .base import VectorIndex
+
+
+class HNSWIndex(VectorIndex):
+    """Hierarchical Navigable Small World graph (Malkov & Yashunin).
+
+    Search cost grows roughly logarithmically with corpus size. ``M`` bounds
+    the links per node, ``ef_construction`` trades build time for graph
+    quality and ``ef_search`` trades query latency for recall. Removed
+    documents stay in the graph as routing nodes and are filtered from
+    results until enough tombstones pile up to trigger a rebuild.
+    """
+
+    kind = "hnsw"
+
+    def __init__(
+        self,
+        dimension: Optional[int] = None,
+        dtype=np.float32,
+        initial_capacity: int = 1024,
+        M: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 64,
+        seed: int = 42,
+    ):
+        super().__init__(dimension, dtype, initial_capacity)
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self._level_mult = 1 / math.log(max(M, 2))
+        self._rng = np.random.default_rng(seed)
+        self._levels: List[int] = []
+        self._graph: List[Dict[int, List[int]]] = []
+        self._entry = -1
+        self._max_level = -1
+
+    def params(self) -> Dict[str, Any]:
+        return {
+            "M": self.M,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "seed": self.seed,
+        }
+
+    def _reset_graph(self) -> None:
+        self._levels = []
+        self._graph = []
+        self._entry = -1
+        self._max_level = -1
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            self._reset_graph()
+
+    def _on_added(self, rows: np.ndarray) -> None:
+        for row in rows:
+            self._insert(int(row))
+
+    def _compact(self) -> np.ndarray:
+        keep = super()._compact()
+        self._reset_graph()
+        for row in range(self._size):
+            self._insert(row)
+        return keep
+
+    def _search_layer(self, q: np.ndarray, entry_points: List[int], ef: int, layer: int) -> List[Tuple[float, int]]:
+        """Best-first search of one layer. Returns (similarity, row) best first."""
+        visited = set(entry_points)
+        sims = (self._vectors[entry_points] @ q).tolist()
+        candidates = [(-s, row) for s, row in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        results = [(s, row) for s, row in zip(sims, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        links = self._graph[layer]
+        while candidates:
+            neg_sim, row = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+            neighbours = [n for n in links.get(row, ()) if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            neighbour_sims = (self._vectors[neighbours] @ q).tolist()
+            for s, n in zip(neighbour_sims, neighbours):
+                if len(results) < ef or s > results[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(results, (s, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, key=lambda item: (-item[0], item[1]))
+
+    def _select_neighbours(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """Diversity heuristic: keep a candidate only if it is closer to the
+        base node than to every neighbour already selected."""
+        if len(candidates) <= m:
+            return [row for _, row in candidates]
+        rows = [row for _, row in candidates]
+        pairwise = self._vectors[rows] @ self._vectors[rows].T
+        selected: List[int] = []
+        pruned: List[int] = []
+        for i, (s, _) in enumerate(candidates):
+            if len(selected) >= m:
+                break
+            if not selected or float(pairwise[i, selected].max()) < s:
+                selected.append(i)
+            else:
+                pruned.append(i)
+        # Top up with the best pruned candidates so nodes keep enough links
+        for i in pruned:
+            if len(selected) >= m:
+                break
+            selected.append(i)
+        return [rows[i] for i in selected]
+
+    def _insert(self, row: int) -> None:
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        self._levels.append(level)
+        while len(self._graph) <= level:
+            self._graph.append({})
+        for layer in range(level + 1):
+            self._graph[layer][row] = []
+
+        if self._entry < 0:
+            self._entry, self._max_level = row, level
+            return
+
+        q = self._vectors[row]
+        entry_points = [self._entry]
+        for layer in range(self._max_level, level, -1):
+            entry_points = [self._search_layer(q, entry_points, 1, layer)[0][1]]
+
+        for layer in range(min(level, self._max_level), -1, -1):
+            found = self._search_layer(q, entry_points, self.ef_construction, layer)
+            max_links = self.M0 if layer == 0 else self.M
+            neighbours = self._select_neighbours(found, self.M)
+            self._graph[layer][row] = neighbours
+            for n in neighbours:
+                links = self._graph[layer][n]
+                links.append(row)
+                if len(links) > max_links:
+                    sims = (self._vectors[links] @ self._vectors[n]).tolist()
+                    ranked = sorted(zip(sims, links), key=lambda item: (-item[0], item[1]))
+                    self._graph[layer][n] = self._select_neighbours(ranked, max_links)
+            entry_points = [r for _, r in found]
+
+        if level > self._max_level:
+            self._entry, self._max_level = row, level
+
+    def search(self, query: Sequence[float], top_k: int = 5, ef: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Return approximate (doc_id, cosine similarity) pairs, best first."""
+        if top_k <= 0:
+            return []
+        with self._lock:
+            if not self._rows:
+                return []
+            q = self._check_query(query)
+            entry_points = [self._entry]
+            for layer in range(self._max_level, 0, -1):
+                entry_points = [self._search_layer(q, entry_points, 1, layer)[0][1]]
+
+            ef = max(ef or self.ef_search, top_k)
+            while True:
+                found = self._search_layer(q, entry_points, ef, 0)
+                hits = [(s, row) for s, row in found if self._live[row]]
+                # Tombstones can crowd live rows out of the beam; widen it
+                if len(hits) >= top_k or len(found) >= self._size:
+                    break
+                ef *= 2
+            return [(str(self._doc_ids[row]), float(s)) for s, row in hits[:top_k]]
+
+    # Persistence
+
+    def _extra_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {
+            "levels": np.asarray(self._levels, dtype=np.int32),
+            "entry": np.asarray([self._entry, self._max_level], dtype=np.int64),
+        }
+        for layer, links in enumerate(self._graph):
+            nodes = sorted(links)
+            offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(links[node]) for node in nodes])
+            flat = [n for node in nodes for n in links[node]]
+            arrays[f"layer{layer}_nodes"] = np.asarray(nodes, dtype=np.int64)
+            arrays[f"layer{layer}_offsets"] = offsets
+            arrays[f"layer{layer}_links"] = np.asarray(flat, dtype=np.int64)
+        return arrays
+
+    def _restore_extra(self, arrays: Dict[str, np.ndarray]) -> None:
+        self._reset_graph()
+        if "levels" not in arrays:
+            # Older or foreign file without a graph: rebuild from vectors
+            for row in range(self._size):
+                self._insert(row)
+            return
+        self._levels = arrays["levels"].tolist()
+        self._entry, self._max_level = (int(v) for v in arrays["entry"])
+        layer = 0
+        while f"layer{layer}_nodes" in arrays:
+            nodes = arrays[f"layer{layer}_nodes"].tolist()
+            offsets = arrays[f"layer{layer}_offsets"].tolist()
+            flat = arrays[f"layer{layer}_links"].tolist()
+            self._graph.append({
+                node: flat[offsets[i]:offsets[i + 1]] for i, node in enumerate(nodes)
+            })
+            layer += 1
@@ -0,0 +1,182 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.logger import logger
+from .base import VectorIndex
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 20, seed: int = 42) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity and return k unit centroids."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFFlatIndex(VectorIndex):
+    """Inverted-file index with exact scoring inside the probed lists.
+
+    Vectors are clustered into ``nlist`` cells by spherical k-means; a query
+    scores only the rows of its ``nprobe`` closest cells. Until enough vectors
+    exist to train (``min_train_size``) the index falls back to a full scan.
+    """
+
+    kind = "ivf_flat"
+
+    def __init__(
+        self,
+        dimension: Optional[int] = None,
+        dtype=np.float32,
+        initial_capacity: int = 1024,
+        nlist: int = 64,
+        nprobe: int = 8,
+        min_train_size: Optional[int] = None,
+        kmeans_iterations: int = 20,
+        seed: int = 42,
+    ):
+        super().__init__(dimension, dtype, initial_capacity)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size or nlist * 16
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments: List[int] = []
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}
+
+    def params(self) -> Dict[str, Any]:
+        return {
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "min_train_size": self.min_train_size,
+            "kmeans_iterations": self.kmeans_iterations,
+            "seed": self.seed,
+        }
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def train(self) -> None:
+        """(Re)cluster the live vectors and rebuild the inverted lists."""
+        with self._lock:
+            live_rows = np.flatnonzero(self._live[:self._size])
+            if len(live_rows) == 0:
+                return
+            sample = live_rows
+            max_sample = self.nlist * 256
+            if len(sample) > max_sample:
+                sample = np.random.default_rng(self.seed).choice(sample, size=max_sample, replace=False)
+            self._centroids = spherical_kmeans(
+                self._vectors[sample], self.nlist, self.kmeans_iterations, self.seed
+            )
+            self._assignments = []
+            self._lists = [[] for _ in range(len(self._centroids))]
+            self._list_arrays = {}
+            self._assign(np.arange(self._size))
+            logger.info(f"Trained IVF index with {len(self._centroids)} lists on {len(sample)} vectors")
+
+    def _assign(self, rows: np.ndarray) -> None:
+        if len(rows) == 0:
+            return
+        cells = np.argmax(self._vectors[rows] @ self._centroids.T, axis=1).tolist()
+        for row, cell in zip(rows.tolist(), cells):
+            self._assignments.append(cell)
+            self._lists[cell].append(row)
+            self._list_arrays.pop(cell, None)
+
+    def _on_added(self, rows: np.ndarray) -> None:
+        if self.is_trained:
+            self._assign(rows)
+        elif len(self._rows) >= self.min_train_size:
+            self.train()
+
+    def _compact(self) -> np.ndarray:
+        assignments = self._assignments
+        keep = super()._compact()
+        if self.is_trained:
+            self._assignments = []
+            self._lists = [[] for _ in range(len(self._centroids))]
+            self._list_arrays = {}
+            for row, old_row in enumerate(keep.tolist()):
+                cell = assignments[old_row]
+                self._assignments.append(cell)
+                self._lists[cell].append(row)
+        return keep
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            self._centroids = None
+            self._assignments = []
+            self._lists = []
+            self._list_arrays = {}
+
+    def _list_rows(self, cell: int) -> np.ndarray:
+        rows = self._list_arrays.get(cell)
+        if rows is None:
+            rows = np.asarray(self._lists[cell], dtype=np.int64)
+            self._list_arrays[cell] = rows
+        return rows
+
+    def search(self, query: Sequence[float], top_k: int = 5, nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Return approximate (doc_id, cosine similarity) pairs, best first."""
+        if top_k <= 0:
+            return []
+        with self._lock:
+            if not self._rows:
+                return []
+            q = self._check_query(query)
+            if self.is_trained:
+                nprobe = min(nprobe or self.nprobe, len(self._centroids))
+                cells = self._top_rows(self._centroids @ q, nprobe)
+                rows = np.concatenate([self._list_rows(int(cell)) for cell in cells])
+                rows = rows[self._live[rows]]
+            else:
+                rows = np.flatnonzero(self._live[:self._size])
+            if len(rows) == 0:
+                return []
+
+            scores = self._vectors[rows] @ q
+            order = self._top_rows(scores, min(top_k, len(rows)))
+            return [(str(self._doc_ids[rows[i]]), float(scores[i])) for i in order]
+
+    # Persistence
+
+    def _extra_arrays(self) -> Dict[str, np.ndarray]:
+        if not self.is_trained:
+            return {}
+        return {
+            "centroids": self._centroids,
+            "assignments": np.asarray(self._assignments, dtype=np.int32),
+        }
+
+    def _restore_extra(self, arrays: Dict[str, np.ndarray]) -> None:
+        self._centroids = None
+        self._assignments = []
+        self._lists = []
+        self._list_arrays = {}
+        if "centroids" not in arrays:
+            if len(self._rows) >= self.min_train_size:
+                self.train()
+            return
+        self._centroids = arrays["centroids"].astype(np.float32)
+        self._lists = [[] for _ in range(len(self._centroids))]
+        for row, cell in enumerate(arrays["assignments"].tolist()):
+            self._assignments.append(cell)
+            self._lists[cell].append(row)
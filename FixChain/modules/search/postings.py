@@ -0,0 +1,118 @@
+from __future__ import annotations
+import threading
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Set
+
+
+def filter_values(value: Any) -> List[Any]:
+    """Flatten a metadata value or filter argument into hashable posting keys."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [v for v in value if v is not None and not isinstance(v, (dict, list))]
+    if isinstance(value, dict):
+        return []
+    return [value]
+
+
+# Operators a filter field may use; any other shape is rejected instead of silently ignored
+FILTER_OPERATORS = ("$eq", "$in")
+
+
+def filter_condition(value: Any) -> List[Any]:
+    """Accepted values of one filter field.
+
+    A scalar or {"$eq": scalar} accepts that value, a list or {"$in": list}
+    accepts any of its values; a document matches when one of its values
+    (list elements such as labels included) is accepted. Raises ValueError
+    for other operators or nested values.
+    """
+    if isinstance(value, dict):
+        if len(value) != 1 or next(iter(value)) not in FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter {value!r}: use a value, a list, {{'$eq': value}} or {{'$in': [values]}}")
+        operator, value = next(iter(value.items()))
+        if operator == "$in" and not isinstance(value, (list, tuple, set)):
+            raise ValueError(f"$in expects a list, got {value!r}")
+        if operator == "$eq" and isinstance(value, (list, tuple, set)):
+            raise ValueError(f"$eq expects a single value, got {value!r}")
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    if any(isinstance(v, (dict, list, tuple, set)) for v in values):
+        raise ValueError(f"Unsupported nested filter value {value!r}")
+    return [v for v in values if v is not None]
+
+
+def normalize_filters(filters: Optional[Mapping[str, Any]]) -> Dict[str, List[Any]]:
+    """Filters as {field: accepted values}, dropping fields without any (see filter_condition)"""
+    normalized = {field: filter_condition(value) for field, value in (filters or {}).items()}
+    return {field: values for field, values in normalized.items() if values}
+
+
+class PostingIndex:
+    """Inverted lists from metadata values to doc_ids, used to pre-filter vector search.
+
+    A filter is ``{field: accepted values}``: a document matches a field when
+    any of its values (scalars or list elements such as labels) is accepted,
+    and matches the filter when every field matches.
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[Any, Set[str]]] = {field: {} for field in self.fields}
+        self._doc_values: Dict[str, Dict[str, List[Any]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_values)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_values
+
+    def indexes(self, field: str) -> bool:
+        return field in self._postings
+
+    def add(self, doc_id: str, metadata: Optional[Mapping[str, Any]]) -> None:
+        """Index (or re-index) the filterable metadata of one document."""
+        metadata = metadata or {}
+        with self._lock:
+            self.remove(doc_id)
+            values = {field: filter_values(metadata.get(field)) for field in self.fields}
+            for field, field_values in values.items():
+                postings = self._postings[field]
+                for value in field_values:
+                    postings.setdefault(value, set()).add(doc_id)
+            self._doc_values[doc_id] = values
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            values = self._doc_values.pop(doc_id, None)
+            if values is None:
+                return False
+            for field, field_values in values.items():
+                postings = self._postings[field]
+                for value in field_values:
+                    members = postings.get(value)
+                    if members is not None:
+                        members.discard(doc_id)
+                        if not members:
+                            del postings[value]
+            return True
+
+    def match(self, filters: Mapping[str, Iterable[Any]]) -> Set[str]:
+        """doc_ids matching every indexed field of filters (OR within a field)."""
+        with self._lock:
+            per_field: List[Set[str]] = []
+            for field, accepted in filters.items():
+                postings = self._postings[field]
+                matched: Set[str] = set()
+                for value in filter_values(accepted):
+                    matched |= postings.get(value, set())
+                per_field.append(matched)
+            if not per_field:
+                return set(self._doc_values)
+            # Intersect smallest first so selective filters stay cheap
+            per_field.sort(key=len)
+            result = set(per_field[0])
+            for matched in per_field[1:]:
+                result &= matched
+                if not result:
+                    break
+            return result
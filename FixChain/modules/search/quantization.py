@@ -0,0 +1,326 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.logger import logger
+from .base import VectorIndex
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 15, seed: int = 42) -> np.ndarray:
+    """Plain (Euclidean) k-means returning k centroids."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        distances = (
+            (vectors ** 2).sum(axis=1, keepdims=True)
+            - 2 * vectors @ centroids.T
+            + (centroids ** 2).sum(axis=1)
+        )
+        assignments = np.argmin(distances, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        counts[empty] = 1
+        centroids = (sums / counts[:, None]).astype(np.float32)
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+class Quantizer(ABC):
+    """Compresses unit vectors into compact codes scored against float queries."""
+
+    kind = "base"
+
+    @property
+    @abstractmethod
+    def is_trained(self) -> bool:
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def code_size(self) -> int:
+        """Bytes per encoded vector."""
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def code_dtype(self) -> np.dtype:
+        raise NotImplementedError
+
+    @abstractmethod
+    def train(self, vectors: np.ndarray) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    @abstractmethod
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate dot products between a float query and encoded rows."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to restore the trained quantizer."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        raise NotImplementedError
+
+
+class ScalarQuantizer(Quantizer):
+    """Symmetric per-dimension int8 quantization (4x smaller than float32)."""
+
+    kind = "int8"
+
+    def __init__(self, dimension: Optional[int] = None):
+        self.dimension = dimension
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.scale is not None
+
+    @property
+    def code_size(self) -> int:
+        return int(self.dimension or 0)
+
+    @property
+    def code_dtype(self) -> np.dtype:
+        return np.dtype(np.int8)
+
+    def train(self, vectors: np.ndarray) -> None:
+        self.dimension = vectors.shape[1]
+        scale = np.abs(vectors).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) @ (query * self.scale).astype(np.float32)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"scale": self.scale}
+
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        self.scale = state["scale"].astype(np.float32)
+        self.dimension = len(self.scale)
+
+
+class ProductQuantizer(Quantizer):
+    """Product quantization: m sub-vectors, each coded by one of ksub centroids.
+
+    Scores use asymmetric distance computation: a per-query lookup table of
+    sub-vector dot products, summed over each row's codes.
+    """
+
+    kind = "pq"
+
+    def __init__(self, dimension: Optional[int] = None, m: int = 96, ksub: int = 256,
+                 iterations: int = 15, seed: int = 42):
+        if ksub > 256:
+            raise ValueError("ksub must be <= 256 to fit codes in one byte")
+        self.dimension = dimension
+        self.m = m
+        self.ksub = ksub
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks: Optional[np.ndarray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.codebooks is not None
+
+    @property
+    def code_size(self) -> int:
+        return self.m
+
+    @property
+    def code_dtype(self) -> np.dtype:
+        return np.dtype(np.uint8)
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.reshape(len(vectors), self.m, self.dimension // self.m)
+
+    def train(self, vectors: np.ndarray) -> None:
+        self.dimension = vectors.shape[1]
+        if self.dimension % self.m:
+            raise ValueError(f"Dimension {self.dimension} is not divisible by m={self.m}")
+        sub = self._split(vectors.astype(np.float32))
+        ksub = min(self.ksub, len(vectors))
+        codebooks = np.zeros((self.m, ksub, self.dimension // self.m), dtype=np.float32)
+        for j in range(self.m):
+            codebooks[j] = kmeans(sub[:, j, :], ksub, self.iterations, self.seed + j)
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        sub = self._split(vectors.astype(np.float32))
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            centroids = self.codebooks[j]
+            distances = (centroids ** 2).sum(axis=1) - 2 * sub[:, j, :] @ centroids.T
+            codes[:, j] = np.argmin(distances, axis=1)
+        return codes
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        table = np.einsum("mkd,md->mk", self.codebooks, self._split(query[None, :].astype(np.float32))[0])
+        return table[np.arange(self.m), codes].sum(axis=1)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        self.codebooks = state["codebooks"].astype(np.float32)
+        self.m, self.ksub = self.codebooks.shape[:2]
+        self.dimension = self.m * self.codebooks.shape[2]
+
+
+QUANTIZERS = {
+    "int8": ScalarQuantizer,
+    "pq": ProductQuantizer,
+}
+
+
+class QuantizedIndex(VectorIndex):
+    """Two-stage index: scan compact codes, then re-rank exactly.
+
+    Only the codes are kept resident. The best ``rerank_k`` candidates of the
+    code scan are re-scored against full-precision vectors fetched through
+    ``full_precision`` (doc_ids -> {doc_id: vector}), e.g. from MongoDB or a
+    memory-mapped snapshot. Without a source the approximate scores are
+    returned as is.
+    """
+
+    kind = "quantized"
+
+    def __init__(
+        self,
+        dimension: Optional[int] = None,
+        dtype=np.float32,
+        initial_capacity: int = 1024,
+        quantizer: str | Quantizer = "int8",
+        rerank_k: int = 200,
+        full_precision: Optional[Callable[[List[str]], Dict[str, Sequence[float]]]] = None,
+        **quantizer_params,
+    ):
+        if isinstance(quantizer, str):
+            quantizer = QUANTIZERS[quantizer](dimension, **quantizer_params)
+        self.quantizer = quantizer
+        self.rerank_k = rerank_k
+        self.full_precision = full_precision
+        super().__init__(dimension, dtype, initial_capacity)
+        self._vectors = None
+
+    def params(self) -> Dict[str, Any]:
+        params = {"quantizer": self.quantizer.kind, "rerank_k": self.rerank_k}
+        if isinstance(self.quantizer, ProductQuantizer):
+            params.update({"m": self.quantizer.m, "ksub": self.quantizer.ksub})
+        return params
+
+    @property
+    def memory_bytes(self) -> int:
+        """Resident bytes used by the codes of live and tombstoned rows."""
+        return self._size * self.quantizer.code_size
+
+    def train(self, vectors: np.ndarray) -> None:
+        """Train the quantizer on a sample of raw vectors."""
+        sample = self._normalize(np.asarray(vectors, dtype=np.float64))
+        self.dimension = sample.shape[1]
+        self.quantizer.train(sample)
+        logger.info(f"Trained {self.quantizer.kind} quantizer on {len(sample)} vectors")
+
+    def _ensure_capacity(self, needed: int) -> None:
+        if self._vectors is not None and needed <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        codes = np.zeros((capacity, self.quantizer.code_size), dtype=self.quantizer.code_dtype)
+        doc_ids = np.empty(capacity, dtype=object)
+        live = np.zeros(capacity, dtype=bool)
+        if self._vectors is not None:
+            codes[:self._size] = self._vectors[:self._size]
+            doc_ids[:self._size] = self._doc_ids[:self._size]
+            live[:self._size] = self._live[:self._size]
+        self._vectors, self._doc_ids, self._live = codes, doc_ids, live
+        self._capacity = capacity
+
+    def add_batch(self, doc_ids: Sequence[str], vectors: Iterable[Sequence[float]]) -> int:
+        ids, rows = self._validate(doc_ids, vectors)
+        if not ids:
+            return 0
+        if not self.quantizer.is_trained:
+            raise ValueError("Quantizer must be trained before vectors are added")
+
+        codes = self.quantizer.encode(self._normalize(np.asarray(rows, dtype=np.float64)))
+        with self._lock:
+            for doc_id in ids:
+                self._remove_locked(doc_id)
+            start = self._size
+            self._ensure_capacity(start + len(ids))
+            self._vectors[start:start + len(ids)] = codes
+            self._doc_ids[start:start + len(ids)] = ids
+            self._live[start:start + len(ids)] = True
+            for offset, doc_id in enumerate(ids):
+                self._rows[doc_id] = start + offset
+            self._size += len(ids)
+        return len(ids)
+
+    def _scores_for_rows(self, rows: np.ndarray, q: np.ndarray) -> np.ndarray:
+        return self.quantizer.scores(self._vectors[rows], q)
+
+    def _rerank(self, approximate: List[Tuple[str, float]], q: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        if not self.full_precision:
+            return approximate[:top_k]
+        candidates = [doc_id for doc_id, _ in approximate]
+        vectors = self.full_precision(candidates)
+        found = [doc_id for doc_id in candidates if vectors.get(doc_id) is not None]
+        if not found:
+            return approximate[:top_k]
+        exact = self._normalize(np.asarray([vectors[doc_id] for doc_id in found], dtype=np.float64)) @ q
+        order = self._top_rows(exact, min(top_k, len(found)))
+        return [(found[i], float(exact[i])) for i in order]
+
+    def _pool_size(self, top_k: int, rerank_k: Optional[int]) -> int:
+        return max(rerank_k or self.rerank_k, top_k) if self.full_precision else top_k
+
+    def search(self, query: Sequence[float], top_k: int = 5, rerank_k: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Return (doc_id, similarity) pairs; exact cosine when re-ranking is available."""
+        if top_k <= 0:
+            return []
+        with self._lock:
+            if not self._rows:
+                return []
+            q = self._check_query(query)
+            scores = self.quantizer.scores(self._vectors[:self._size], q)
+            if len(self._rows) != self._size:
+                scores[~self._live[:self._size]] = -np.inf
+            order = self._top_rows(scores, min(self._pool_size(top_k, rerank_k), len(self._rows)))
+            approximate = [(str(self._doc_ids[row]), float(scores[row])) for row in order]
+        return self._rerank(approximate, q, top_k)
+
+    def search_subset(self, query: Sequence[float], doc_ids: Iterable[str], top_k: int = 5,
+                      rerank_k: Optional[int] = None) -> List[Tuple[str, float]]:
+        if top_k <= 0 or not self._rows:
+            return []
+        q = self._check_query(query)
+        approximate = super().search_subset(query, doc_ids, self._pool_size(top_k, rerank_k))
+        return self._rerank(approximate, q, top_k)
+
+    # Persistence
+
+    def _extra_arrays(self) -> Dict[str, np.ndarray]:
+        return self.quantizer.state() if self.quantizer.is_trained else {}
+
+    def _restore_extra(self, arrays: Dict[str, np.ndarray]) -> None:
+        if arrays:
+            self.quantizer.restore(arrays)
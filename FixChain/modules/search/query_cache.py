@@ -0,0 +1,134 @@
+from __future__ import annotations
+import copy
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+
+from .flat import FlatIndex
+
+
+class _Entry:
+    __slots__ = ("namespace", "scope", "results", "label", "expires_at")
+
+    def __init__(self, namespace: str, scope: Hashable, results: Any, label: Optional[str], expires_at: float):
+        self.namespace = namespace
+        self.scope = scope
+        self.results = results
+        self.label = label
+        self.expires_at = expires_at
+
+
+class SemanticQueryCache:
+    """Results of recent searches, reused for queries with nearly the same embedding.
+
+    Entries are grouped by namespace (the collection) and scope (search mode,
+    top_k, filters, corpus version). Each scope has a small flat index of its
+    cached query embeddings. A query reuses the results of the closest
+    cached query in its scope when their cosine similarity reaches threshold.
+    Entries leave on LRU overflow or TTL, and all entries of a namespace are
+    dropped when invalidate() is called for it.
+
+    When queries carry a text label, a hit records the reworded text as an
+    alias of the cached one, so text-keyed caches downstream (answers) can
+    reuse their entries too.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000, ttl_seconds: float = 600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._scopes: Dict[Tuple[str, Hashable], FlatIndex] = {}
+        self._aliases: "OrderedDict[str, str]" = OrderedDict()
+        self._ids = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, namespace: str, scope: Hashable, embedding: Sequence[float],
+               label: Optional[str] = None) -> Optional[Any]:
+        """Copy of the results cached for the most similar query of the scope, or None"""
+        with self._lock:
+            index = self._scopes.get((namespace, scope))
+            match = index.search(embedding, 1) if index is not None else []
+            if match and match[0][1] >= self.threshold:
+                entry_id = match[0][0]
+                entry = self._entries[entry_id]
+                if entry.expires_at > time.monotonic():
+                    self._entries.move_to_end(entry_id)
+                    if label and entry.label and label != entry.label:
+                        self._aliases[label] = entry.label
+                        self._aliases.move_to_end(label)
+                        while len(self._aliases) > self.max_entries:
+                            self._aliases.popitem(last=False)
+                    self.hits += 1
+                    return copy.deepcopy(entry.results)
+                self._drop(entry_id)
+            self.misses += 1
+            return None
+
+    def store(self, namespace: str, scope: Hashable, embedding: Sequence[float], results: Any,
+              label: Optional[str] = None) -> None:
+        if self.max_entries <= 0 or embedding is None or len(embedding) == 0:
+            return
+        with self._lock:
+            entry_id = str(next(self._ids))
+            index = self._scopes.get((namespace, scope))
+            if index is None:
+                index = self._scopes[(namespace, scope)] = FlatIndex(len(embedding), initial_capacity=16)
+            index.add(entry_id, embedding)
+            self._entries[entry_id] = _Entry(namespace, scope, copy.deepcopy(results), label,
+                                             time.monotonic() + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def canonical_label(self, label: str) -> str:
+        """The cached query text a reworded query was matched to (label itself if none)"""
+        with self._lock:
+            return self._aliases.get(label, label)
+
+    def invalidate(self, namespace: str) -> None:
+        """Drop every entry of a namespace, e.g. after its corpus changed"""
+        with self._lock:
+            stale = [entry_id for entry_id, entry in self._entries.items() if entry.namespace == namespace]
+            for entry_id in stale:
+                self._drop(entry_id)
+            if stale:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self._aliases.clear()
+
+    def _drop(self, entry_id: str) -> None:
+        entry = self._entries.pop(entry_id)
+        key = (entry.namespace, entry.scope)
+        index = self._scopes[key]
+        index.remove(entry_id)
+        if len(index) == 0:
+            del self._scopes[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "scopes": len(self._scopes),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,197 @@
+from __future__ import annotations
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.logger import logger
+from .flat import FlatIndex
+
+
+class Reducer(ABC):
+    """Maps unit vectors to a lower dimension, identically for documents and queries."""
+
+    kind = "base"
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.input_dimension: Optional[int] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.input_dimension is not None
+
+    @abstractmethod
+    def train(self, vectors: np.ndarray) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """Reduce a (n, input_dimension) matrix to (n, dimension)."""
+        raise NotImplementedError
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to restore the trained reducer."""
+        return {"input_dimension": np.array(self.input_dimension)}
+
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        self.input_dimension = int(state["input_dimension"])
+
+
+class TruncationReducer(Reducer):
+    """Keeps the first dimension coordinates (Matryoshka-style prefix)."""
+
+    kind = "truncate"
+
+    def train(self, vectors: np.ndarray) -> None:
+        self.input_dimension = vectors.shape[1]
+        if self.dimension > self.input_dimension:
+            raise ValueError(f"Cannot truncate {self.input_dimension} dimensions to {self.dimension}")
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors[:, :self.dimension]
+
+
+class PCAReducer(Reducer):
+    """Projection onto the top principal directions of a corpus sample.
+
+    Directions come from the uncentered second-moment matrix, which best
+    preserves the dot products that cosine search ranks by.
+    """
+
+    kind = "pca"
+
+    def __init__(self, dimension: int):
+        super().__init__(dimension)
+        self.components: Optional[np.ndarray] = None
+        self.explained_variance = 0.0
+
+    def train(self, vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if self.dimension > vectors.shape[1]:
+            raise ValueError(f"Cannot project {vectors.shape[1]} dimensions to {self.dimension}")
+        eigenvalues, eigenvectors = np.linalg.eigh(vectors.T @ vectors)
+        order = np.argsort(eigenvalues)[::-1][:self.dimension]
+        self.components = eigenvectors[:, order].T.astype(np.float32)
+        self.explained_variance = float(eigenvalues[order].sum() / max(eigenvalues.sum(), 1e-12))
+        self.input_dimension = vectors.shape[1]
+        logger.info(f"Fitted PCA {self.input_dimension} -> {self.dimension} on {len(vectors)} vectors "
+                    f"({self.explained_variance:.1%} of the energy kept)")
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors @ self.components.T
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {
+            **super().state(),
+            "components": self.components,
+            "explained_variance": np.array(self.explained_variance),
+        }
+
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        super().restore(state)
+        self.components = np.asarray(state["components"], dtype=np.float32)
+        self.explained_variance = float(state["explained_variance"])
+
+
+REDUCERS = {"truncate": TruncationReducer, "pca": PCAReducer}
+
+
+def save_reducer(reducer: Reducer, path: str) -> None:
+    """Write a trained reducer to an .npz file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.savez(path, kind=np.array(reducer.kind), dimension=np.array(reducer.dimension), **reducer.state())
+
+
+def load_reducer(path: str) -> Reducer:
+    """Read a reducer written by save_reducer."""
+    with np.load(path) as arrays:
+        reducer = REDUCERS[str(arrays["kind"])](int(arrays["dimension"]))
+        reducer.restore({name: arrays[name] for name in arrays.files})
+    return reducer
+
+
+class ReducedIndex(FlatIndex):
+    """Exact index over reduced vectors.
+
+    Documents and queries arrive at full dimension and go through the same
+    reducer, so memory and scoring time shrink by input/output dimension.
+    Scores are cosine similarities in the reduced space.
+    """
+
+    kind = "reduced"
+
+    def __init__(self, dimension: Optional[int] = None, dtype=np.float32, initial_capacity: int = 1024,
+                 reducer: str | Reducer = "truncate", reduced_dimension: Optional[int] = None):
+        if isinstance(reducer, str):
+            reducer = REDUCERS[reducer](reduced_dimension or dimension)
+        self.reducer = reducer
+        super().__init__(reducer.dimension, dtype, initial_capacity)
+
+    def params(self) -> Dict[str, Any]:
+        return {"reducer": self.reducer.kind, "reduced_dimension": self.reducer.dimension}
+
+    @property
+    def memory_bytes(self) -> int:
+        """Resident bytes of the reduced vectors of live and tombstoned rows."""
+        return self._size * self.reducer.dimension * self.dtype.itemsize
+
+    def train(self, vectors: np.ndarray) -> None:
+        """Fit the reducer on a sample of full vectors."""
+        self.reducer.train(self._normalize(np.asarray(vectors, dtype=np.float64)))
+
+    def reduce(self, vectors: np.ndarray) -> np.ndarray:
+        """Normalize full vectors and map them to the reduced space."""
+        if not self.reducer.is_trained:
+            if not isinstance(self.reducer, TruncationReducer):
+                raise ValueError(f"{self.reducer.kind} reducer must be trained before vectors are added")
+            self.train(vectors)
+        return self.reducer.transform(self._normalize(vectors))
+
+    def add_batch(self, doc_ids: Sequence[str], vectors: Iterable[Sequence[float]]) -> int:
+        ids: List[str] = []
+        rows: List[Sequence[float]] = []
+        for doc_id, vector in zip(doc_ids, vectors):
+            if vector is None or len(vector) == 0:
+                continue
+            if self.reducer.is_trained and len(vector) != self.reducer.input_dimension:
+                logger.warning(f"Skipping vector for {doc_id}: dimension {len(vector)} != "
+                               f"index input dimension {self.reducer.input_dimension}")
+                continue
+            ids.append(doc_id)
+            rows.append(vector)
+        if not ids:
+            return 0
+        return super().add_batch(ids, self.reduce(np.asarray(rows, dtype=np.float64)))
+
+    def _reduce_queries(self, queries: Sequence[Sequence[float]]) -> np.ndarray:
+        for query in queries:
+            if len(query) != self.reducer.input_dimension:
+                raise ValueError(f"Query dimension {len(query)} does not match index input dimension "
+                                 f"{self.reducer.input_dimension}")
+        return self.reducer.transform(self._normalize(np.asarray(queries, dtype=np.float64).reshape(len(queries), -1)))
+
+    def search(self, query: Sequence[float], top_k: int = 5) -> List[Tuple[str, float]]:
+        if not self.reducer.is_trained:
+            return []
+        return super().search(self._reduce_queries([query])[0], top_k)
+
+    def search_many(self, queries: Sequence[Sequence[float]], top_k: int = 5) -> List[List[Tuple[str, float]]]:
+        if not self.reducer.is_trained or len(queries) == 0:
+            return [[] for _ in queries]
+        return super().search_many(self._reduce_queries(queries), top_k)
+
+    def search_subset(self, query: Sequence[float], doc_ids: Iterable[str], top_k: int = 5) -> List[Tuple[str, float]]:
+        if not self.reducer.is_trained:
+            return []
+        return super().search_subset(self._reduce_queries([query])[0], doc_ids, top_k)
+
+    def _extra_arrays(self) -> Dict[str, np.ndarray]:
+        return self.reducer.state() if self.reducer.is_trained else {}
+
+    def _restore_extra(self, arrays: Dict[str, np.ndarray]) -> None:
+        if arrays:
+            self.reducer.restore(arrays)
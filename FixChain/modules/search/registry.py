@@ -0,0 +1,37 @@
+from __future__ import annotations
+from typing import Dict, Type
+
+from .base import VectorIndex
+
+_registry: Dict[str, Type[VectorIndex]] = {}
+
+
+def register(name: str, cls: Type[VectorIndex]) -> None:
+    """Register a vector index implementation."""
+    _registry[name] = cls
+
+
+def get(name: str) -> Type[VectorIndex]:
+    """Look up a registered vector index class."""
+    if name not in _registry:
+        raise KeyError(f"Vector index '{name}' is not registered")
+    return _registry[name]
+
+
+def create(name: str, *args, **kwargs) -> VectorIndex:
+    """Create a registered vector index."""
+    return get(name)(*args, **kwargs)
+
+
+# Register built-in indexes
+from .flat import FlatIndex
+from .hnsw import HNSWIndex
+from .ivf import IVFFlatIndex
+from .quantization import QuantizedIndex
+from .reduction import ReducedIndex
+
+register("flat", FlatIndex)
+register("hnsw", HNSWIndex)
+register("ivf_flat", IVFFlatIndex)
+register("quantized", QuantizedIndex)
+register("reduced", ReducedIndex)
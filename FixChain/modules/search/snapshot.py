@@ -0,0 +1,423 @@
+from __future__ import annotations
+import fcntl
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.logger import logger
+from .flat import FlatIndex
+
+MANIFEST_FILE = "manifest.json"
+DELTA_LOG_FILE = "delta.log"
+LOCK_FILE = "delta.lock"
+FORMAT_VERSION = 1
+
+# Snapshot layout:
+#   <root>/manifest.json          current snapshot dir, dimension, shards, delta offset
+#   <root>/snap-<id>/shard_00000.npy       float32 (rows, dimension), unit-normalized
+#   <root>/snap-<id>/shard_00000.ids.json  doc_id sidecar, one entry per row
+#   <root>/delta.log              NDJSON add/remove records written after the current snapshot
+#   <root>/delta.lock             flock taken shared by log writers/readers, exclusively to rotate the log
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+@contextmanager
+def _log_lock(root: str, exclusive: bool = False):
+    """Hold the delta-log lock of a snapshot root"""
+    fd = os.open(os.path.join(root, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+def read_manifest(root: str) -> Optional[Dict]:
+    """Read the snapshot manifest, or None if no snapshot was written yet."""
+    path = os.path.join(root, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_snapshot(
+    root: str,
+    batches: Iterable[Tuple[Sequence[str], Sequence[Sequence[float]]]],
+    shard_size: int = 65536,
+) -> Dict:
+    """Write (doc_ids, vectors) batches as a new snapshot and switch the manifest to it.
+
+    The manifest is replaced atomically, so readers see either the old or the
+    new snapshot. The delta log is compacted at the switch: records the new
+    snapshot absorbed are dropped, records appended while it was written are
+    kept and replayed on top of it.
+    """
+    os.makedirs(root, exist_ok=True)
+    log_path = os.path.join(root, DELTA_LOG_FILE)
+    delta_offset = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+
+    snapshot_id = f"snap-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    snapshot_dir = os.path.join(root, snapshot_id)
+    os.makedirs(snapshot_dir)
+
+    shards: List[Dict] = []
+    pending_ids: List[str] = []
+    pending_vectors: List[Sequence[float]] = []
+    seen: Dict[str, int] = {}
+    dimension: Optional[int] = None
+
+    def flush() -> None:
+        if not pending_ids:
+            return
+        name = f"shard_{len(shards):05d}"
+        np.save(os.path.join(snapshot_dir, f"{name}.npy"), _normalize(np.asarray(pending_vectors)))
+        with open(os.path.join(snapshot_dir, f"{name}.ids.json"), "w", encoding="utf-8") as f:
+            json.dump(pending_ids, f)
+        shards.append({"vectors": f"{name}.npy", "doc_ids": f"{name}.ids.json", "count": len(pending_ids)})
+        pending_ids.clear()
+        pending_vectors.clear()
+
+    for doc_ids, vectors in batches:
+        for doc_id, vector in zip(doc_ids, vectors):
+            if vector is None or len(vector) == 0 or doc_id in seen:
+                continue
+            if dimension is None:
+                dimension = len(vector)
+            if len(vector) != dimension:
+                logger.warning(f"Skipping vector for {doc_id}: dimension {len(vector)} != {dimension}")
+                continue
+            seen[doc_id] = 1
+            pending_ids.append(doc_id)
+            pending_vectors.append(vector)
+            if len(pending_ids) >= shard_size:
+                flush()
+    flush()
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "snapshot": snapshot_id,
+        "dimension": dimension,
+        "dtype": "float32",
+        "count": len(seen),
+        "shards": shards,
+        "delta_log": DELTA_LOG_FILE,
+        "delta_offset": delta_offset,
+        "created_at": datetime.now().isoformat(),
+    }
+    with _log_lock(root, exclusive=True):
+        # No writer is mid-record here; only the tail appended during the snapshot is carried over
+        if os.path.exists(log_path):
+            tmp_log = f"{log_path}.{uuid.uuid4().hex[:6]}.tmp"
+            with open(log_path, "rb") as src, open(tmp_log, "wb") as dst:
+                src.seek(delta_offset)
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp_log, log_path)
+        manifest["delta_offset"] = 0
+        previous = read_manifest(root)
+        tmp_path = os.path.join(root, f"{MANIFEST_FILE}.{uuid.uuid4().hex[:6]}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(root, MANIFEST_FILE))
+
+    if previous and previous.get("snapshot") != snapshot_id:
+        # Workers that still map the old shards keep their file handles
+        shutil.rmtree(os.path.join(root, previous["snapshot"]), ignore_errors=True)
+
+    logger.info(f"Wrote embedding snapshot {snapshot_id}: {len(seen)} vectors in {len(shards)} shards")
+    return manifest
+
+
+class MappedIndex(FlatIndex):
+    """Exact index over memory-mapped snapshot shards plus an in-memory delta.
+
+    Shards are opened with ``mmap`` so startup does not copy vectors and the
+    OS page cache is shared by every worker mapping the same files. Writes go
+    to the inherited in-memory storage and are appended to the delta log;
+    each search first replays records other processes appended since, and
+    remaps the shards when another process wrote a new snapshot.
+    """
+
+    kind = "mapped"
+
+    def __init__(self, dimension: Optional[int] = None, dtype=np.float32, initial_capacity: int = 1024):
+        super().__init__(dimension, dtype, initial_capacity)
+        self.root: Optional[str] = None
+        self._shards: List[np.ndarray] = []
+        self._shard_ids: List[List[str]] = []
+        self._shard_live: List[np.ndarray] = []
+        self._shard_starts: List[int] = []
+        self._shard_rows: Dict[str, Tuple[int, int]] = {}
+        self._shard_total = 0
+        self._log_path: Optional[str] = None
+        self._log_offset = 0
+        self._snapshot: Optional[str] = None
+        self._manifest_mtime = 0
+        self._writer_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    @classmethod
+    def open(cls, root: str) -> "MappedIndex":
+        """Map the current snapshot under root and replay its delta log."""
+        manifest = read_manifest(root)
+        if manifest is None:
+            raise FileNotFoundError(f"No embedding snapshot in {root}")
+
+        index = cls(dimension=manifest["dimension"])
+        index.root = root
+        with _log_lock(root):
+            index._map(read_manifest(root))
+            index._replay()
+        logger.info(f"Mapped embedding snapshot {index._snapshot} with {len(index)} vectors")
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> "MappedIndex":
+        return cls.open(path)
+
+    def _map(self, manifest: Dict) -> None:
+        """Map the shards of manifest, dropping whatever was mapped or held in memory before"""
+        self.clear()
+        self.dimension = manifest["dimension"] or self.dimension
+        self._shards, self._shard_ids, self._shard_live, self._shard_starts = [], [], [], []
+        self._shard_rows = {}
+        self._shard_total = 0
+        snapshot_dir = os.path.join(self.root, manifest["snapshot"])
+        for shard in manifest["shards"]:
+            vectors = np.load(os.path.join(snapshot_dir, shard["vectors"]), mmap_mode="r")
+            with open(os.path.join(snapshot_dir, shard["doc_ids"]), "r", encoding="utf-8") as f:
+                doc_ids = json.load(f)
+            shard_no = len(self._shards)
+            self._shards.append(vectors)
+            self._shard_ids.append(doc_ids)
+            self._shard_live.append(np.ones(len(doc_ids), dtype=bool))
+            self._shard_starts.append(self._shard_total)
+            self._shard_total += len(doc_ids)
+            for row, doc_id in enumerate(doc_ids):
+                self._shard_rows[doc_id] = (shard_no, row)
+
+        self._snapshot = manifest["snapshot"]
+        self._manifest_mtime = os.stat(os.path.join(self.root, MANIFEST_FILE)).st_mtime_ns
+        self._log_path = os.path.join(self.root, manifest.get("delta_log", DELTA_LOG_FILE))
+        self._log_offset = manifest.get("delta_offset", 0)
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._shard_rows)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._rows or doc_id in self._shard_rows
+
+    @property
+    def doc_ids(self) -> List[str]:
+        with self._lock:
+            mapped = [doc_id for doc_ids, live in zip(self._shard_ids, self._shard_live)
+                      for doc_id, alive in zip(doc_ids, live) if alive]
+            return mapped + super().doc_ids
+
+    def _drop_mapped(self, doc_id: str) -> bool:
+        location = self._shard_rows.pop(doc_id, None)
+        if location is None:
+            return False
+        shard_no, row = location
+        self._shard_live[shard_no][row] = False
+        return True
+
+    def _apply(self, op: str, doc_id: str, vector: Optional[Sequence[float]] = None) -> None:
+        if op == "add":
+            self._drop_mapped(doc_id)
+            super().add_batch([doc_id], [vector])
+        elif op == "remove":
+            self._drop_mapped(doc_id)
+            super().remove(doc_id)
+
+    def _append_log(self, records: List[Dict]) -> None:
+        if not self._log_path:
+            return
+        payload = "".join(json.dumps({**record, "src": self._writer_id}) + "\n" for record in records)
+        # One O_APPEND write per batch keeps records from different workers whole
+        with _log_lock(self.root):
+            fd = os.open(self._log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, payload.encode("utf-8"))
+            finally:
+                os.close(fd)
+
+    def _replay(self, skip_own: bool = True) -> int:
+        """Apply log records past the current offset; the caller holds the log lock"""
+        if not os.path.exists(self._log_path):
+            return 0
+        applied = 0
+        with open(self._log_path, "rb") as f:
+            f.seek(self._log_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # record still being written
+                self._log_offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping malformed delta log record")
+                    continue
+                if skip_own and record.get("src") == self._writer_id:
+                    continue  # already applied in memory
+                self._apply(record.get("op"), record.get("doc_id"), record.get("vector"))
+                applied += 1
+        return applied
+
+    def refresh(self) -> int:
+        """Replay delta-log records appended by other processes, remapping after a new snapshot.
+
+        Returns records applied.
+        """
+        if not self._log_path:
+            return 0
+        # Unlocked stats only decide whether to look closer
+        manifest_path = os.path.join(self.root, MANIFEST_FILE)
+        try:
+            manifest_changed = os.stat(manifest_path).st_mtime_ns != self._manifest_mtime
+            log_grew = os.path.exists(self._log_path) and os.path.getsize(self._log_path) > self._log_offset
+        except FileNotFoundError:
+            return 0
+        if not manifest_changed and not log_grew:
+            return 0
+        with self._lock, _log_lock(self.root):
+            manifest = read_manifest(self.root)
+            if manifest is None or manifest["snapshot"] == self._snapshot:
+                self._manifest_mtime = os.stat(manifest_path).st_mtime_ns
+                return self._replay()
+            # The compacted log holds what the new snapshot lacks, this process's writes included
+            self._map(manifest)
+            applied = self._replay(skip_own=False)
+            logger.info(f"Remapped embedding snapshot {self._snapshot} with {len(self)} vectors")
+            return applied
+
+    def add_batch(self, doc_ids: Sequence[str], vectors: Iterable[Sequence[float]]) -> int:
+        ids, rows = self._validate(doc_ids, vectors)
+        if not ids:
+            return 0
+        with self._lock:
+            for doc_id in ids:
+                self._drop_mapped(doc_id)
+            added = super().add_batch(ids, rows)
+            self._append_log([
+                {"op": "add", "doc_id": doc_id, "vector": [float(v) for v in vector]}
+                for doc_id, vector in zip(ids, rows)
+            ])
+        return added
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            removed = self._drop_mapped(doc_id) | super().remove(doc_id)
+            if removed:
+                self._append_log([{"op": "remove", "doc_id": doc_id}])
+            return removed
+
+    def search(self, query: Sequence[float], top_k: int = 5) -> List[Tuple[str, float]]:
+        if top_k <= 0:
+            return []
+        self.refresh()
+        with self._lock:
+            if len(self) == 0:
+                return []
+            q = self._check_query(query)
+            # (score, global row) so ties keep snapshot-then-delta insertion order
+            candidates: List[Tuple[float, int, str]] = []
+            for shard_no, vectors in enumerate(self._shards):
+                live = self._shard_live[shard_no]
+                if not live.any():
+                    continue
+                scores = np.asarray(vectors @ q, dtype=self.dtype)
+                scores[~live] = -np.inf
+                for row in self._top_rows(scores, min(top_k, int(live.sum()))):
+                    candidates.append((float(scores[row]), self._shard_starts[shard_no] + int(row),
+                                       self._shard_ids[shard_no][row]))
+            for doc_id, score in super().search(query, top_k):
+                candidates.append((score, self._shard_total + self._rows[doc_id], doc_id))
+
+            candidates.sort(key=lambda item: (-item[0], item[1]))
+            return [(doc_id, score) for score, _, doc_id in candidates[:top_k]]
+
+    def search_many(self, queries: Sequence[Sequence[float]], top_k: int = 5) -> List[List[Tuple[str, float]]]:
+        if top_k <= 0 or len(queries) == 0:
+            return [[] for _ in queries]
+        self.refresh()
+        with self._lock:
+            if len(self) == 0:
+                return [[] for _ in queries]
+            q = self._check_queries(queries)
+            candidates: List[List[Tuple[float, int, str]]] = [[] for _ in queries]
+            for shard_no, vectors in enumerate(self._shards):
+                live = self._shard_live[shard_no]
+                if not live.any():
+                    continue
+                scores = np.asarray(q @ vectors.T, dtype=self.dtype)
+                scores[:, ~live] = -np.inf
+                k = min(top_k, int(live.sum()))
+                for query_no, row_scores in enumerate(scores):
+                    for row in self._top_rows(row_scores, k):
+                        candidates[query_no].append((float(row_scores[row]), self._shard_starts[shard_no] + int(row),
+                                                     self._shard_ids[shard_no][row]))
+            for query_no, results in enumerate(super().search_many(queries, top_k)):
+                for doc_id, score in results:
+                    candidates[query_no].append((score, self._shard_total + self._rows[doc_id], doc_id))
+
+            merged = []
+            for query_candidates in candidates:
+                query_candidates.sort(key=lambda item: (-item[0], item[1]))
+                merged.append([(doc_id, score) for score, _, doc_id in query_candidates[:top_k]])
+            return merged
+
+    def search_subset(self, query: Sequence[float], doc_ids: Iterable[str], top_k: int = 5) -> List[Tuple[str, float]]:
+        if top_k <= 0:
+            return []
+        self.refresh()
+        with self._lock:
+            doc_ids = list(doc_ids)
+            per_shard: Dict[int, List[int]] = {}
+            for doc_id in doc_ids:
+                location = self._shard_rows.get(doc_id)
+                if location is not None:
+                    per_shard.setdefault(location[0], []).append(location[1])
+            if not per_shard and not self._rows:
+                return []
+            q = self._check_query(query)
+            candidates: List[Tuple[float, int, str]] = []
+            for shard_no, rows in per_shard.items():
+                rows = np.asarray(sorted(rows), dtype=np.int64)
+                scores = np.asarray(self._shards[shard_no][rows] @ q, dtype=self.dtype)
+                for i in self._top_rows(scores, min(top_k, len(rows))):
+                    candidates.append((float(scores[i]), self._shard_starts[shard_no] + int(rows[i]),
+                                       self._shard_ids[shard_no][rows[i]]))
+            for doc_id, score in super().search_subset(query, doc_ids, top_k):
+                candidates.append((score, self._shard_total + self._rows[doc_id], doc_id))
+
+            candidates.sort(key=lambda item: (-item[0], item[1]))
+            return [(doc_id, score) for score, _, doc_id in candidates[:top_k]]
+
+    def _batches(self) -> Iterator[Tuple[List[str], np.ndarray]]:
+        for doc_ids, vectors, live in zip(self._shard_ids, self._shards, self._shard_live):
+            rows = np.flatnonzero(live)
+            if len(rows):
+                yield [doc_ids[row] for row in rows], vectors[rows]
+        delta_ids = super().doc_ids
+        if delta_ids:
+            yield delta_ids, self._vectors[[self._rows[doc_id] for doc_id in delta_ids]]
+
+    def save(self, path: str) -> None:
+        """Write every live vector as a new snapshot under path (see write_snapshot)."""
+        self.refresh()
+        with self._lock:
+            write_snapshot(path, self._batches())
+        # Picks up the compacted log when path is this index's own root
+        self.refresh()
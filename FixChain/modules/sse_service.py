@@ -0,0 +1,53 @@
+import json
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from utils.logger import logger
+
+# Proxies (nginx) buffer responses unless told not to, which would hold back every event
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """One server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream_answer_events(
+    request: Request,
+    first_event: str,
+    first_data: Dict[str, Any],
+    answer: AsyncIterator[str],
+    error_prefix: str = ""
+) -> AsyncIterator[str]:
+    """Send first_data (sources, statistics) at once, then the answer piece by piece
+
+    Events: first_event, token* (data {"text": ...}), then done or error.
+    When the client disconnects the answer stream is closed, which stops the
+    LLM call behind it.
+    """
+    yield sse_event(first_event, first_data)
+    try:
+        async for text in answer:
+            if await request.is_disconnected():
+                logger.info("Client disconnected, answer stream cancelled")
+                return
+            yield sse_event("token", {"text": text})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"{error_prefix}{str(e)}"})
+        return
+    finally:
+        await answer.aclose()
+    yield sse_event("done", {})
+
+
+async def single_piece(text: str) -> AsyncIterator[str]:
+    """An answer stream made of one fixed text (e.g. the no-results message)"""
+    yield text
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """StreamingResponse for server-sent events"""
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
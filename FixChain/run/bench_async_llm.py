@@ -0,0 +1,89 @@
+"""
+Benchmark: blocking vs offloaded Gemini calls inside async handlers
+
+Runs N concurrent "answer" requests against a fake model that sleeps like a
+slow LLM, while a health probe measures how late the event loop answers.
+
+Usage:
+    python run/bench_async_llm.py --requests 20 --delay 0.5
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controller import rag_controller
+from modules import llm_service
+
+
+class FakeSlowModel:
+    """Stands in for GenerativeModel: blocks the calling thread for delay seconds"""
+
+    class Response:
+        text = "fake answer"
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.delay)
+        return self.Response()
+
+
+async def blocking_handler(model):
+    """The previous pattern: a synchronous model call inside an async handler"""
+    return model.generate_content("prompt").text
+
+
+async def offloaded_handler(model):
+    """The current code path of /rag/search answer generation, past the answer cache"""
+    rag_controller.llm_model = model
+    return await rag_controller._generate_answer("query", [{"content": "doc"}])
+
+
+async def health_probe(stop, latencies, interval=0.01):
+    """Measure how long past its deadline a trivial handler gets to run"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        latencies.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def run_scenario(handler, model, num_requests):
+    stop = asyncio.Event()
+    latencies = []
+    probe = asyncio.create_task(health_probe(stop, latencies))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(model) for _ in range(num_requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark blocking vs non-blocking LLM calls")
+    parser.add_argument("--requests", type=int, default=20, help="Concurrent requests per scenario")
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds the fake model takes per call")
+    args = parser.parse_args()
+
+    model = FakeSlowModel(args.delay)
+    print(f"{args.requests} concurrent requests, fake model delay {args.delay}s, "
+          f"LLM_MAX_CONCURRENCY={llm_service.LLM_MAX_CONCURRENCY}")
+    print(f"{'Scenario':<12} {'wall s':>8} {'req/s':>8} {'health p50 ms':>14} {'health max ms':>14}")
+    for name, handler in (("blocking", blocking_handler), ("offloaded", offloaded_handler)):
+        elapsed, latencies = asyncio.run(run_scenario(handler, model, args.requests))
+        p50 = statistics.median(latencies) if latencies else 0.0
+        worst = max(latencies) if latencies else 0.0
+        print(f"{name:<12} {elapsed:>8.2f} {args.requests / elapsed:>8.1f} {p50:>14.1f} {worst:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
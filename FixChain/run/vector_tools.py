@@ -0,0 +1,193 @@
+"""
+Maintenance commands for the vector search layer
+
+Usage:
+    python run/vector_tools.py snapshot --dir data/embedding_snapshot
+    python run/vector_tools.py evaluate --quantizer pq --m 96 --rerank-k 200
+    python run/vector_tools.py reduce --methods truncate pca --dims 384 256 128
+    python run/vector_tools.py migrate --collections documents bug_rag_documents
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.logger import logger
+from modules.mongodb_service import get_mongo_manager
+from modules.search import FlatIndex, QuantizedIndex, ReducedIndex
+
+# Load environment variables from root directory
+root_env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.env')
+load_dotenv(root_env_path)
+
+
+def cmd_snapshot(args):
+    """Write the embeddings of a collection as memory-mapped float32 shards"""
+    manager = get_mongo_manager()
+    # Same per-version directory the service loads from
+    snapshot_dir = manager.snapshot_dir(args.collection, args.dir)
+    if not snapshot_dir:
+        raise SystemExit("Pass --dir or set EMBEDDING_SNAPSHOT_DIR")
+    manifest = manager.write_embedding_snapshot(
+        snapshot_dir, shard_size=args.shard_size, collection_name=args.collection
+    )
+    print(f"Snapshot {manifest['snapshot']}: {manifest['count']} vectors, "
+          f"{len(manifest['shards'])} shards, dimension {manifest['dimension']}")
+
+
+def load_corpus(manager, collection_name="documents"):
+    """Load every stored embedding as (doc_ids, float32 matrix)"""
+    doc_ids, vectors = [], []
+    for batch_ids, batch_vectors in manager.iter_embeddings(collection_name=collection_name):
+        for doc_id, vector in zip(batch_ids, batch_vectors):
+            if vector and (not vectors or len(vector) == len(vectors[0])):
+                doc_ids.append(doc_id)
+                vectors.append(vector)
+    return doc_ids, np.asarray(vectors, dtype=np.float32)
+
+
+def split_queries(doc_ids, vectors, num_queries, seed):
+    """Hold out random stored vectors as queries; the rest is the searched corpus"""
+    rng = np.random.default_rng(seed)
+    num_queries = max(1, min(num_queries, len(doc_ids) // 10))
+    held_out = np.zeros(len(doc_ids), dtype=bool)
+    held_out[rng.choice(len(doc_ids), size=num_queries, replace=False)] = True
+    corpus_ids = [doc_id for doc_id, skip in zip(doc_ids, held_out) if not skip]
+    return corpus_ids, vectors[~held_out], vectors[held_out]
+
+
+def recall_at_k(truth, results):
+    """Mean fraction of the exact top-k found by an approximate search"""
+    hits = [len({doc_id for doc_id, _ in t} & {doc_id for doc_id, _ in r}) / max(len(t), 1)
+            for t, r in zip(truth, results)]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def timed_search(index, queries, k, **params):
+    """Run every query and return (results, milliseconds per query)"""
+    start = time.perf_counter()
+    results = [index.search(q, k, **params) for q in queries]
+    return results, (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+
+def cmd_evaluate(args):
+    """Report recall@k and memory of quantized search against exact search"""
+    doc_ids, vectors = load_corpus(get_mongo_manager(), args.collection)
+    if len(doc_ids) < 20:
+        raise SystemExit(f"Need at least 20 stored embeddings to evaluate, found {len(doc_ids)}")
+    corpus_ids, corpus, queries = split_queries(doc_ids, vectors, args.queries, args.seed)
+
+    exact = FlatIndex()
+    exact.add_batch(corpus_ids, corpus)
+    truth, exact_ms = timed_search(exact, queries, args.k)
+
+    full_precision = dict(zip(corpus_ids, corpus))
+    quantizer_params = {"m": args.m, "ksub": args.ksub} if args.quantizer == "pq" else {}
+    index = QuantizedIndex(
+        quantizer=args.quantizer,
+        rerank_k=args.rerank_k,
+        full_precision=lambda ids: {doc_id: full_precision[doc_id] for doc_id in ids},
+        **quantizer_params
+    )
+    index.train(corpus)
+    index.add_batch(corpus_ids, corpus)
+    reranked, reranked_ms = timed_search(index, queries, args.k)
+    index.full_precision = None
+    first_pass, first_pass_ms = timed_search(index, queries, args.k)
+
+    float_bytes = corpus.shape[0] * corpus.shape[1] * 4
+    print(f"Corpus: {len(corpus_ids)} vectors x {corpus.shape[1]} dims, {len(queries)} held-out queries")
+    print(f"{'Exact float32 scan':<24} {float_bytes:>12,} bytes {exact_ms:8.2f} ms/query")
+    print(f"{args.quantizer + ' code scan':<24} {index.memory_bytes:>12,} bytes {first_pass_ms:8.2f} ms/query"
+          f"  recall@{args.k} {recall_at_k(truth, first_pass):.3f}")
+    print(f"{args.quantizer + f' + re-rank {args.rerank_k}':<24} {'':>18} {reranked_ms:8.2f} ms/query"
+          f"  recall@{args.k} {recall_at_k(truth, reranked):.3f}")
+    print(f"Compression: {float_bytes / max(index.memory_bytes, 1):.1f}x")
+
+
+def cmd_reduce(args):
+    """Report recall@k, memory and query time of reduced-dimension search against exact search"""
+    doc_ids, vectors = load_corpus(get_mongo_manager(), args.collection)
+    if len(doc_ids) < 20:
+        raise SystemExit(f"Need at least 20 stored embeddings to evaluate, found {len(doc_ids)}")
+    corpus_ids, corpus, queries = split_queries(doc_ids, vectors, args.queries, args.seed)
+
+    exact = FlatIndex()
+    exact.add_batch(corpus_ids, corpus)
+    truth, exact_ms = timed_search(exact, queries, args.k)
+
+    float_bytes = corpus.shape[0] * corpus.shape[1] * 4
+    print(f"Corpus: {len(corpus_ids)} vectors x {corpus.shape[1]} dims, {len(queries)} held-out queries")
+    print(f"{'Exact float32 scan':<24} {float_bytes:>12,} bytes {exact_ms:8.2f} ms/query")
+    for method in args.methods:
+        for dimension in args.dims:
+            if dimension >= corpus.shape[1]:
+                continue
+            index = ReducedIndex(reducer=method, reduced_dimension=dimension)
+            index.train(corpus)
+            index.add_batch(corpus_ids, corpus)
+            results, ms = timed_search(index, queries, args.k)
+            print(f"{f'{method} {dimension}':<24} {index.memory_bytes:>12,} bytes {ms:8.2f} ms/query"
+                  f"  recall@{args.k} {recall_at_k(truth, results):.3f}  speed-up {exact_ms / max(ms, 1e-9):.1f}x")
+
+
+def cmd_migrate(args):
+    """Move vectors onto their documents and backfill doc_id, batch by batch"""
+    stats = get_mongo_manager().migrate_embeddings(args.collections, batch_size=args.batch_size)
+    print(f"Backfilled {stats['doc_ids_backfilled']} doc_ids, moved {stats['embeddings_moved']} embeddings "
+          f"({stats['orphaned_embeddings']} without a document dropped)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector search maintenance tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="Write an mmap-able embedding snapshot")
+    snapshot_parser.add_argument("--dir", help="Snapshot directory (default: EMBEDDING_SNAPSHOT_DIR)")
+    snapshot_parser.add_argument("--shard-size", type=int, default=65536, help="Vectors per shard")
+    snapshot_parser.add_argument("--collection", default="documents")
+    snapshot_parser.set_defaults(func=cmd_snapshot)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="Measure recall@k of quantized search")
+    evaluate_parser.add_argument("--quantizer", choices=["int8", "pq"], default="int8")
+    evaluate_parser.add_argument("--m", type=int, default=96, help="PQ sub-vectors (must divide the dimension)")
+    evaluate_parser.add_argument("--ksub", type=int, default=256, help="PQ centroids per sub-vector")
+    evaluate_parser.add_argument("--rerank-k", type=int, default=200, help="Candidates re-ranked at full precision")
+    evaluate_parser.add_argument("--k", type=int, default=10)
+    evaluate_parser.add_argument("--queries", type=int, default=200)
+    evaluate_parser.add_argument("--seed", type=int, default=42)
+    evaluate_parser.add_argument("--collection", default="documents")
+    evaluate_parser.set_defaults(func=cmd_evaluate)
+
+    reduce_parser = subparsers.add_parser("reduce", help="Measure recall@k and speed of reduced dimensions")
+    reduce_parser.add_argument("--methods", nargs="+", choices=["truncate", "pca"], default=["truncate", "pca"])
+    reduce_parser.add_argument("--dims", nargs="+", type=int, default=[512, 384, 256, 128, 64],
+                               help="Reduced dimensions to compare")
+    reduce_parser.add_argument("--k", type=int, default=10)
+    reduce_parser.add_argument("--queries", type=int, default=200)
+    reduce_parser.add_argument("--seed", type=int, default=42)
+    reduce_parser.add_argument("--collection", default="documents")
+    reduce_parser.set_defaults(func=cmd_reduce)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Move embeddings to the inline storage layout")
+    migrate_parser.add_argument("--collections", nargs="+", default=["documents", "bug_rag_documents"],
+                                help="Collections whose documents need a doc_id")
+    migrate_parser.add_argument("--batch-size", type=int, default=500)
+    migrate_parser.set_defaults(func=cmd_migrate)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except Exception as e:
+        logger.error(f"{args.command} failed: {str(e)}")
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -38,6 +38,7 @@ class RAGService:
         
         # API endpoints
         self.search_endpoint = f"{self.base_url}/rag/search"
+        self.retrieve_endpoint = f"{self.base_url}/rag/retrieve"
         self.add_endpoint = f"{self.base_url}/rag/add"
         
         # Default headers
@@ -46,13 +47,16 @@ class RAGService:
             "Accept": "application/json"
         }
     
-    def search_rag_knowledge(self, issues_data: List[Dict], limit: int = 5) -> RAGSearchResult:
+    def search_rag_knowledge(self, issues_data: List[Dict], limit: int = 5,
+                             generate_answer: bool = False) -> RAGSearchResult:
         """
         Search RAG knowledge base for similar bug fixes
         
         Args:
             issues_data: List of issues from SonarQube analysis
             limit: Maximum number of results to return
+            generate_answer: Also ask the API for a Gemini answer; otherwise only
+                sources are retrieved and answer is empty
             
         Returns:
             RAGSearchResult with search results or error information
@@ -72,9 +76,9 @@ class RAGService:
             
             self.logger.info(f"Searching RAG with query: {search_payload['query'][:100]}...")
             
-            # Make API request
+            # Make API request; retrieval alone skips the LLM call
             response = requests.post(
-                self.search_endpoint,
+                self.search_endpoint if generate_answer else self.retrieve_endpoint,
                 json=search_payload,
                 headers=self.headers,
                 timeout=self.timeout
@@ -361,7 +365,7 @@ if __name__ == "__main__":
         }
     ]
     
-    search_result = rag_service.search_rag_knowledge(sample_issues)
+    search_result = rag_service.search_rag_knowledge(sample_issues, generate_answer=True)
     print(f"Search result: {search_result.success}")
     if search_result.success:
         print(f"Answer: {search_result.answer[:100]}...")